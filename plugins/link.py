@@ -113,7 +113,7 @@ class Plugin(BasePlugin):
         messages = self.api.get_conversation_messages()
         if not messages:
             return None
-        for message in messages[::-1]:
+        for message in reversed(messages):
             matches = url_pattern.findall(clean_text(message.txt))
             if matches:
                 for url in matches[::-1]:
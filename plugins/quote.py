@@ -95,7 +95,7 @@ class Plugin(BasePlugin):
         messages = self.api.get_conversation_messages()
         if not messages:
             return None
-        for message in messages[::-1]:
+        for message in reversed(messages):
             if clean_text(message.txt) == txt:
                 return message
         return None
@@ -115,4 +115,4 @@ class Plugin(BasePlugin):
         elif len(args) > 1:
             return False
         return Completion(the_input.auto_completion,
-                          [clean_text(msg.txt) for msg in messages[::-1]], '')
+                          [clean_text(msg.txt) for msg in reversed(messages)], '')
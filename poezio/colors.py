@@ -1,4 +1,5 @@
-from typing import Tuple, Dict, List
+from collections import OrderedDict
+from typing import Any, Tuple, Dict, List, Sequence, Union
 import curses
 import hashlib
 import math
@@ -7,6 +8,9 @@ from . import hsluv
 
 Palette = Dict[float, int]
 
+# Number of nicks (or JIDs) whose color is kept by nick_color
+NICK_COLOR_CACHE_SIZE = 4096
+
 # BT.601 (YCbCr) constants, see XEP-0392
 K_R = 0.299
 K_G = 0.587
@@ -68,13 +72,40 @@ def text_to_angle(text: str) -> float:
     return hue / 65535 * 360
 
 
-def ccg_palette_lookup(palette: Palette, angle: float) -> int:
-    # try quick lookup first
-    try:
-        return palette[round(angle)]
-    except KeyError:
-        pass
+# For each rounded angle, the color of the palette nearest to all the
+# angles it covers, or the two candidates (lower angle, higher angle,
+# whether the lower one wins a tie) when it depends on the exact angle.
+LookupEntry = Union[int, Tuple[int, int, bool]]
+
+_lookup_table = (None, [])  # type: Tuple[Any, List[LookupEntry]]
+
 
+def build_ccg_lookup_table(palette: Palette) -> List[LookupEntry]:
+    """
+    Precompute the results of ccg_palette_lookup for the angles of a
+    palette generated by generate_ccg_palette (whose angles are integers).
+    """
+    # a tie goes to the first color of the palette, as in the linear search
+    order = {angle: i for i, angle in enumerate(palette)}
+    angles = sorted(palette)
+    table = []  # type: List[LookupEntry]
+    pos = 0
+    for i in range(361):
+        while pos < len(angles) and angles[pos] < i:
+            pos += 1
+        if pos < len(angles) and angles[pos] == i:
+            table.append(palette[i])
+        elif pos == 0:
+            table.append(palette[angles[0]])
+        elif pos == len(angles):
+            table.append(palette[angles[-1]])
+        else:
+            low, high = angles[pos - 1], angles[pos]
+            table.append((low, high, order[low] < order[high]))
+    return table
+
+
+def _linear_palette_lookup(palette: Palette, angle: float) -> int:
     best_metric = float("inf")
     best = None
     for anglep, color in palette.items():
@@ -86,6 +117,66 @@ def ccg_palette_lookup(palette: Palette, angle: float) -> int:
     return best
 
 
+def ccg_palette_lookup(palette: Palette, angle: float) -> int:
+    """
+    Return the color of the palette with the angle nearest to the given
+    one, from a table built once per palette.
+    """
+    global _lookup_table
+    table_palette, table = _lookup_table
+    if table_palette is not palette:
+        if not palette or not all(isinstance(a, int) for a in palette):
+            return _linear_palette_lookup(palette, angle)
+        table = build_ccg_lookup_table(palette)
+        _lookup_table = (palette, table)
+    index = round(angle)
+    if not 0 <= index <= 360:
+        return _linear_palette_lookup(palette, angle)
+    entry = table[index]
+    if isinstance(entry, int):
+        return entry
+    low, high, low_first = entry
+    to_low, to_high = angle - low, high - angle
+    if to_low < to_high or (to_low == to_high and low_first):
+        return palette[low]
+    return palette[high]
+
+
 def ccg_text_to_color(palette, text: str) -> int:
     angle = text_to_angle(text)
     return ccg_palette_lookup(palette, angle)
+
+
+_nick_colors = OrderedDict()  # type: OrderedDict[str, Tuple[int, int]]
+# The (palette, nick colors) the cached colors were computed with
+_nick_colors_source = (None, None)  # type: Tuple[Any, Any]
+
+
+def nick_color(palette: Palette, nick_colors: Sequence[Tuple[int, int]],
+               text: str) -> Tuple[int, int]:
+    """
+    Return the deterministic color of a nick (or JID): XEP-0392 CCG with
+    the palette if there is one, else one of the nick colors, chosen from
+    the md5 of the text.
+
+    The colors of the last NICK_COLOR_CACHE_SIZE texts are kept until
+    another palette or list of nick colors is given (e.g. on theme reload).
+    """
+    global _nick_colors_source
+    if (_nick_colors_source[0] is not palette
+            or _nick_colors_source[1] is not nick_colors):
+        _nick_colors.clear()
+        _nick_colors_source = (palette, nick_colors)
+    color = _nick_colors.get(text)
+    if color is not None:
+        _nick_colors.move_to_end(text)
+        return color
+    if palette:
+        color = ccg_text_to_color(palette, text), -1
+    else:
+        digest = int(hashlib.md5(text.encode('utf-8')).hexdigest(), 16)
+        color = nick_colors[digest % len(nick_colors)]
+    _nick_colors[text] = color
+    if len(_nick_colors) > NICK_COLOR_CACHE_SIZE:
+        _nick_colors.popitem(last=False)
+    return color
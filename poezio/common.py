@@ -14,9 +14,10 @@ from datetime import (
     timezone,
 )
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple, Union, Any
+from typing import Dict, List, Optional, Pattern, Tuple, Union, Any
 
 import os
+import re
 import subprocess
 import time
 import string
@@ -402,6 +403,25 @@ def parse_secs_to_str(duration: int = 0) -> str:
     return result
 
 
+def build_highlight_regex(nickname: str, highlight_on: str) -> Pattern:
+    """
+    Compile a single regex finding what highlights us in a message: our
+    nickname as a word, or any of the words of the highlight_on option
+    (separated by colons) anywhere, ignoring the case.
+
+    :param str nickname: Our nickname
+    :param str highlight_on: The value of the highlight_on option
+    :return: The compiled regex
+    :rtype: :py:class:`re.Pattern`
+
+    >>> bool(build_highlight_regex('toto', 'foo:bar').search('Foobar'))
+    True
+    """
+    terms = [r'(?:^|\W)' + re.escape(nickname) + r'(?:\W|$)']
+    terms.extend(re.escape(word) for word in highlight_on.split(':') if word)
+    return re.compile('|'.join(terms), re.I)
+
+
 def format_tune_string(infos: Dict[str, str]) -> str:
     """
     Construct a string from a dict created from an "User tune" event.
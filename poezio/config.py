@@ -16,10 +16,11 @@ import stat
 import sys
 import pkg_resources
 
+from collections import OrderedDict
 from configparser import RawConfigParser, NoOptionError, NoSectionError
 from pathlib import Path
 from shutil import copy2
-from typing import Callable, Dict, List, Optional, Union, Tuple
+from typing import Any, Callable, Dict, List, Optional, Union, Tuple, cast
 
 from poezio.args import parse_args
 from poezio import xdg
@@ -89,12 +90,22 @@ DEFAULT_CONFIG = {
         'keyfile': '',
         'lang': 'en',
         'lazy_resize': True,
+        'load_log': 10,
+        'log_buffer_size': 65536,
         'log_dir': '',
         'log_errors': True,
+        'log_flush_interval': 5,
+        'log_index_interval': 100,
+        'log_max_open_files': 64,
+        'log_sync': 'always',
+        'max_color_pairs': 0,
         'max_lines_in_memory': 2048,
+        'max_mam_queries': 4,
         'max_messages_in_memory': 2048,
         'max_nick_length': 25,
+        'max_refresh_rate': 30,
         'muc_history_length': 50,
+        'muc_presence_batch_delay': 0.1,
         'notify_messages': True,
         'open_all_bookmarks': False,
         'password': '',
@@ -157,6 +168,9 @@ DEFAULT_CONFIG = {
     'muc_colors': {}
 }
 
+# Number of resolved values kept by a Config
+CONFIG_CACHE_SIZE = 4096
+
 
 class Config(RawConfigParser):
     """
@@ -164,6 +178,9 @@ class Config(RawConfigParser):
     """
 
     def __init__(self, file_name: Path, default=None) -> None:
+        # The last resolved values returned by get, get_by_tabname and
+        # the typed getters, emptied each time the configuration changes
+        self._cache = OrderedDict()  # type: OrderedDict[Tuple, Any]
         RawConfigParser.__init__(self, None)
         # make the options case sensitive
         self.optionxform = lambda param: str(param)
@@ -171,7 +188,37 @@ class Config(RawConfigParser):
         self.read_file()
         self.default = default
 
+    def invalidate_cache(self) -> None:
+        """
+        Forget the resolved values, for the next get calls to read the
+        new ones.
+        """
+        self._cache.clear()
+
+    def _cache_result(self, key: Tuple, value: Any) -> None:
+        """
+        Keep a resolved value, forgetting the least recently used one
+        if there are more than CONFIG_CACHE_SIZE.
+        """
+        cache = self._cache
+        cache[key] = value
+        if len(cache) > CONFIG_CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def add_section(self, section: str) -> None:
+        self._cache.clear()
+        RawConfigParser.add_section(self, section)
+
+    def remove_section(self, section: str) -> bool:
+        self._cache.clear()
+        return RawConfigParser.remove_section(self, section)
+
+    def remove_option(self, section: str, option: str) -> bool:
+        self._cache.clear()
+        return RawConfigParser.remove_option(self, section, option)
+
     def read_file(self):
+        self._cache.clear()
         RawConfigParser.read(self, str(self.file_name), encoding='utf-8')
         # Check config integrity and fix it if it’s wrong
         # only when the object is the main config
@@ -190,6 +237,20 @@ class Config(RawConfigParser):
         The type of default defines the type
         returned
         """
+        key = (option, section, default, type(default))
+        try:
+            res = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(key)
+            return res
+        res = self._get_uncached(option, default, section)
+        self._cache_result(key, res)
+        return res
+
+    def _get_uncached(self, option: str, default: Optional[ConfigValue],
+                      section: str) -> ConfigValue:
         if default is None:
             if self.default:
                 default = self.default.get(section, {}).get(option)
@@ -224,6 +285,22 @@ class Config(RawConfigParser):
         in the section, we search for the global option if fallback is
         True. And we return `default` as a fallback as a last resort.
         """
+        key = ('tabname', option, tabname, fallback, fallback_server, default,
+               type(default))
+        try:
+            res = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(key)
+            return res
+        res = self._get_by_tabname_uncached(option, tabname, fallback,
+                                            fallback_server, default)
+        self._cache_result(key, res)
+        return res
+
+    def _get_by_tabname_uncached(self, option, tabname, fallback,
+                                 fallback_server, default):
         from slixmpp import JID
         if isinstance(tabname, JID):
             tabname = tabname.full
@@ -253,6 +330,49 @@ class Config(RawConfigParser):
             return self.get(option, default)
         return default
 
+    def _get_typed(self, option: str, section: str, typ: type) -> Any:
+        key = (option, section, typ)
+        try:
+            res = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            self._cache.move_to_end(key)
+            return res
+        default = None
+        if self.default:
+            default = self.default.get(section, {}).get(option)
+        if not isinstance(default, typ):
+            default = typ()
+        res = self.get(option, default, section)
+        self._cache_result(key, res)
+        return res
+
+    def get_bool(self, option: str, section=DEFSECTION) -> bool:
+        """
+        get, for a boolean option: no need to guess the type from the
+        default value.
+        """
+        return cast(bool, self._get_typed(option, section, bool))
+
+    def get_int(self, option: str, section=DEFSECTION) -> int:
+        """
+        get, for an integer option
+        """
+        return cast(int, self._get_typed(option, section, int))
+
+    def get_float(self, option: str, section=DEFSECTION) -> float:
+        """
+        get, for a float option
+        """
+        return cast(float, self._get_typed(option, section, float))
+
+    def get_str(self, option: str, section=DEFSECTION) -> str:
+        """
+        get, for a string option
+        """
+        return cast(str, self._get_typed(option, section, str))
+
     def __get(self, option, section=DEFSECTION, **kwargs):
         """
         facility for RawConfigParser.get
@@ -443,6 +563,7 @@ class Config(RawConfigParser):
                         'Could not toggle option: %s.'
                         ' Current value is %s.' % (option, current or "empty"),
                         'Warning')
+        self._cache.clear()
         if self.has_section(section):
             RawConfigParser.set(self, section, option, value)
         else:
@@ -459,6 +580,7 @@ class Config(RawConfigParser):
         """
         Remove an option and then save it the config file
         """
+        self._cache.clear()
         if self.has_section(section):
             RawConfigParser.remove_option(self, section, option)
         if not self.remove_in_file(section, option):
@@ -469,6 +591,7 @@ class Config(RawConfigParser):
         """
         Set a value, save, and return True on success and False on failure
         """
+        self._cache.clear()
         if self.has_section(section):
             RawConfigParser.set(self, section, option, value)
         else:
@@ -480,6 +603,7 @@ class Config(RawConfigParser):
         """
         Set the value of an option temporarily
         """
+        self._cache.clear()
         try:
             RawConfigParser.set(self, section, option, value)
         except NoSectionError:
@@ -23,9 +23,10 @@ from poezio.common import safeJID
 from poezio.config import config, DEFAULT_CONFIG, options as config_opts
 from poezio.contact import Contact, Resource
 from poezio.decorators import deny_anonymous
+from poezio.logger import logger
 from poezio.plugin import PluginConfig
 from poezio.roster import roster
-from poezio.theming import dump_tuple, get_theme
+from poezio.theming import color_pairs, dump_tuple, get_theme
 from poezio.decorators import command_args_parser
 from poezio.core.structs import Command, POSSIBLE_SHOW
 
@@ -1336,6 +1337,42 @@ class CommandCore:
         """
         self.core.reload_config()
 
+    @command_args_parser.quoted(0, 1)
+    def rebuild_log_index(self, args):
+        """
+        /rebuild_log_index [jid]
+        """
+        if args is None:
+            return self.help('rebuild_log_index')
+        try:
+            if args:
+                nb_records = logger.rebuild_index(args[0])
+                self.core.information(
+                    'Log index of %s rebuilt (%s records)' % (args[0],
+                                                             nb_records),
+                    'Info')
+            else:
+                nb_files = logger.rebuild_all_indexes()
+                self.core.information(
+                    'Log index of %s files rebuilt' % nb_files, 'Info')
+        except OSError as exc:
+            self.core.information(
+                'Unable to rebuild the log index: %s' % exc, 'Error')
+
+    @command_args_parser.ignored
+    def log_files(self):
+        """
+        /log_files
+        """
+        self.core.information(logger.stats(), 'Info')
+
+    @command_args_parser.ignored
+    def color_pairs(self):
+        """
+        /color_pairs
+        """
+        self.core.information(color_pairs.stats(), 'Info')
+
 
 def dumb_callback(*args, **kwargs):
     "mock callback"
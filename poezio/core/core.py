@@ -130,6 +130,13 @@ class Core:
 
         self.tabs = Tabs(self.events)
         self.previous_tab_nb = 0
+        # The tab drawn by the last refresh_window: when another one is
+        # displayed, all the windows must be drawn again
+        self.last_refreshed_tab = None  # type: Optional[tabs.Tab]
+        # The pending refresh_window of schedule_refresh, and the loop
+        # time of the last refresh_window
+        self.scheduled_refresh = None  # type: Optional[asyncio.Handle]
+        self.last_refresh_time = 0.0
 
         own_nick = config.get('default_nick')
         own_nick = own_nick or self.xmpp.boundjid.user
@@ -367,9 +374,11 @@ class Core:
 
     def on_any_config_change(self, option, value):
         """
-        Update the roster, in case a roster option changed.
+        Update the roster, in case a roster option changed, and draw
+        everything again on the next refresh.
         """
         roster.modified()
+        windows.invalidate_all()
 
     def add_configuration_handler(self, option: str, callback: Callable):
         """
@@ -384,6 +393,7 @@ class Core:
         Triggers all the handlers associated with the given configuration
         option
         """
+        config.invalidate_cache()
         # First call the callbacks associated with any configuration change
         for callback in self.configuration_change_handlers[""]:
             callback(option, value)
@@ -443,6 +453,7 @@ class Core:
         error_msg = theming.reload_theme()
         if error_msg:
             self.information(error_msg, 'Warning')
+        windows.invalidate_all()
         self.refresh_window()
 
     def on_password_change(self, option, value):
@@ -477,6 +488,7 @@ class Core:
         # reload the theme
         log.debug("Reloading the theme…")
         theming.reload_theme()
+        windows.invalidate_all()
         log.debug("Theme reloaded.")
         # reload the config from the disk
         log.debug("Reloading the config…")
@@ -577,6 +589,7 @@ class Core:
 
     def exit(self, event=None):
         log.debug("exit(%s)", event)
+        logger.flush_all(sync=True)
         asyncio.get_event_loop().stop()
 
     def on_exception(self, typ, value, trace):
@@ -1079,6 +1092,9 @@ class Core:
         self.tabs.append(new_tab)
         if focus:
             self.tabs.set_current_tab(new_tab)
+        elif isinstance(new_tab, tabs.ChatTab):
+            # Do not build the lines of a tab nobody is looking at
+            new_tab.text_win.make_lazy()
 
     def insert_tab(self, old_pos: int, new_pos: int = 99999) -> bool:
         """
@@ -1226,6 +1242,7 @@ class Core:
             new_tab = tabs.DynamicConversationTab(self, jid)
         if not focus:
             new_tab.state = "private"
+        mam.load_local_history(new_tab)
         self.add_tab(new_tab, focus)
         self.refresh_window()
         return new_tab
@@ -1250,6 +1267,7 @@ class Core:
             new_tab.directed_presence = tab.directed_presence
         if not focus:
             new_tab.state = "private"
+        mam.load_local_history(new_tab)
         # insert it in the tabs
         self.add_tab(new_tab, focus)
         self.refresh_window()
@@ -1412,7 +1430,7 @@ class Core:
         )
         popup_on = config.get('information_buffer_popup_on').split()
         if isinstance(self.tabs.current_tab, tabs.RosterInfoTab):
-            self.refresh_window()
+            self.schedule_refresh()
         elif typ != '' and typ.lower() in popup_on:
             popup_time = config.get('popup_time') + (nb_lines - 1) * 2
             self._pop_information_win_up(nb_lines, popup_time)
@@ -1452,12 +1470,37 @@ class Core:
         """
         Refresh everything
         """
+        if self.scheduled_refresh is not None:
+            self.scheduled_refresh.cancel()
+            self.scheduled_refresh = None
+        self.last_refresh_time = asyncio.get_event_loop().time()
         nocursor = curses.curs_set(0)
+        if self.tabs.current_tab is not self.last_refreshed_tab:
+            windows.invalidate_all()
+            self.last_refreshed_tab = self.tabs.current_tab
         self.tabs.current_tab.state = 'current'
         self.tabs.current_tab.refresh()
         self.doupdate()
         curses.curs_set(nocursor)
 
+    def schedule_refresh(self) -> None:
+        """
+        Refresh everything on the next frame instead of right away, so
+        that the updates received in a burst (e.g. the presences of a
+        room join) are drawn at once, at most max_refresh_rate times per
+        second. The direct consequences of a key press should use
+        refresh_window instead.
+        """
+        if self.scheduled_refresh is not None:
+            return
+        rate = config.get('max_refresh_rate')
+        if rate <= 0:
+            self.refresh_window()
+            return
+        loop = asyncio.get_event_loop()
+        delay = max(self.last_refresh_time + 1 / rate - loop.time(), 0)
+        self.scheduled_refresh = loop.call_later(delay, self.refresh_window)
+
     def refresh_tab_win(self) -> None:
         """
         Refresh the window containing the tab list
@@ -1644,6 +1687,7 @@ class Core:
         Completely erase and redraw the screen
         """
         self.stdscr.clear()
+        windows.invalidate_all()
         self.refresh_window()
 
     def call_for_resize(self):
@@ -2029,6 +2073,30 @@ class Core:
             self.command.reload,
             shortdesc='Reload the config. You can achieve the same by '
             'sending SIGUSR1 to poezio.')
+        self.register_command(
+            'rebuild_log_index',
+            self.command.rebuild_log_index,
+            usage='[jid]',
+            desc='Rebuild the index of the log file of a JID, or of all '
+            'the log files if no JID is given. The index is used to find '
+            'the messages logged around a given date without reading the '
+            'whole file.',
+            shortdesc='Rebuild the index of the log files.')
+        self.register_command(
+            'log_files',
+            self.command.log_files,
+            desc='Show how many log files are open, out of the maximum '
+            '(see the log_max_open_files option), and how often a message '
+            'was logged in a file already open, in a file that had to be '
+            'opened, or caused another file to be closed.',
+            shortdesc='Show the open log files statistics.')
+        self.register_command(
+            'color_pairs',
+            self.command.color_pairs,
+            desc='Show how many curses color pairs are used, out of the '
+            'maximum (see the max_color_pairs option), and how often they '
+            'were found, created or reused for other colors.',
+            shortdesc='Show the color pairs statistics.')
 
         if config.get('enable_user_activity'):
             self.register_command(
@@ -27,6 +27,7 @@ from xml.etree import ElementTree as ET
 
 from poezio import common
 from poezio import fixes
+from poezio import mam
 from poezio import pep
 from poezio import tabs
 from poezio import xhtml
@@ -737,6 +738,9 @@ class HandlerCore:
                 self.core.xmpp, room_from, self.core.own_nick, msg='')
             return
 
+        # The presences received before this message must be processed
+        # first, for its sender (and our own nick) to be up to date
+        tab.process_presence_buffer()
         nick_from = message['mucnick']
         user = tab.get_user_by_name(nick_from)
         if user and user in tab.ignores:
@@ -816,10 +820,7 @@ class HandlerCore:
             tab.set_last_sent_message(message, correct=replaced)
 
         if tab is self.core.tabs.current_tab:
-            tab.text_win.refresh()
-            tab.info_header.refresh(tab, tab.text_win, user=tab.own_user)
-            tab.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh()
         elif tab.state != old_state:
             self.core.refresh_tab_win()
             current = self.core.tabs.current_tab
@@ -853,6 +854,11 @@ class HandlerCore:
         tmp_dir = get_image_cache()
         body = xhtml.get_body_from_message_stanza(
             message, use_xhtml=use_xhtml, extract_images_to=tmp_dir)
+        # The presences received before this message must be processed
+        # first, for the private tab and its user to follow nick changes
+        muc_tab = self.core.tabs.by_name_and_class(room_from, tabs.MucTab)
+        if muc_tab:
+            muc_tab.process_presence_buffer()
         tab = self.core.tabs.by_name_and_class(
             jid.full,
             tabs.PrivateTab)  # get the tab with the private conversation
@@ -915,7 +921,7 @@ class HandlerCore:
             if not config.get_by_tabname('disable_beep', jid.full):
                 curses.beep()
         if tab is self.core.tabs.current_tab:
-            self.core.refresh_window()
+            self.core.schedule_refresh()
         else:
             tab.state = 'normal' if sent else 'private'
             self.core.refresh_tab_win()
@@ -968,6 +974,10 @@ class HandlerCore:
         """
         Chatstate received in a private conversation from a MUC
         """
+        muc_tab = self.core.tabs.by_name_and_class(message['from'].bare,
+                                                   tabs.MucTab)
+        if muc_tab:
+            muc_tab.process_presence_buffer()
         tab = self.core.tabs.by_name_and_class(message['from'].full,
                                                tabs.PrivateTab)
         if not tab:
@@ -988,14 +998,13 @@ class HandlerCore:
         nick = message['mucnick']
         room_from = message.get_mucroom()
         tab = self.core.tabs.by_name_and_class(room_from, tabs.MucTab)
+        if tab:
+            tab.process_presence_buffer()
         if tab and tab.get_user_by_name(nick):
             self.core.events.trigger('muc_chatstate', message, tab)
             tab.get_user_by_name(nick).chatstate = state
         if tab == self.core.tabs.current_tab:
-            if not self.core.size.tab_degrade_x:
-                tab.user_win.refresh(tab.users)
-            tab.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh()
         else:
             _composing_tab_state(tab, state)
             self.core.refresh_tab_win()
@@ -1053,7 +1062,7 @@ class HandlerCore:
                     roster.update_contact_groups(jid)
         roster.update_size()
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_subscription_request(self, presence):
         """subscribe received"""
@@ -1076,7 +1085,7 @@ class HandlerCore:
             self.core.tabs.first().state = 'highlight'
             roster.modified()
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_subscription_authorized(self, presence):
         """subscribed received"""
@@ -1091,7 +1100,7 @@ class HandlerCore:
         roster.modified()
 
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_subscription_remove(self, presence):
         """unsubscribe received"""
@@ -1104,7 +1113,7 @@ class HandlerCore:
             '%s does not want to receive your status anymore.' % jid, 'Roster')
         self.core.tabs.first().state = 'highlight'
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_subscription_removed(self, presence):
         """unsubscribed received"""
@@ -1123,7 +1132,7 @@ class HandlerCore:
                 jid, 'Roster')
         self.core.tabs.first().state = 'highlight'
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     ### Presence-related handlers ###
 
@@ -1149,11 +1158,9 @@ class HandlerCore:
         if tab:
             tab.update_status(
                 Status(show=presence['show'], message=presence['status']))
-        if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
-        elif self.core.tabs.current_tab == tab:
-            tab.refresh()
-            self.core.doupdate()
+        if (isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab)
+                or self.core.tabs.current_tab == tab):
+            self.core.schedule_refresh()
 
     def on_presence_error(self, presence):
         jid = presence['from']
@@ -1195,7 +1202,7 @@ class HandlerCore:
                               'Roster')
         roster.modified()
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_got_online(self, presence):
         """
@@ -1235,7 +1242,7 @@ class HandlerCore:
             self.core.add_information_message_to_conversation_tab(
                 jid.bare, '\x195}%s is \x194}online' % name)
         if isinstance(self.core.tabs.current_tab, tabs.RosterInfoTab):
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_groupchat_presence(self, presence):
         """
@@ -1339,6 +1346,7 @@ class HandlerCore:
         Called when we are connected and authenticated
         """
         self.core.connection_time = time.time()
+        mam.clear_disco_cache()
         if not self.core.plugins_autoloaded:  # Do not reload plugins on reconnection
             self.core.autoload_plugins()
         self.core.information("Authentication success.", 'Info')
@@ -1445,7 +1453,7 @@ class HandlerCore:
                     ),
                     typ=2)
             if modif:
-                self.core.refresh_window()
+                self.core.schedule_refresh()
 
     def on_groupchat_subject(self, message):
         """
@@ -1502,7 +1510,7 @@ class HandlerCore:
         tab.topic_from = nick_from
         if self.core.tabs.by_name_and_class(
                 room_from, tabs.MucTab) is self.core.tabs.current_tab:
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
     def on_receipt(self, message):
         """
@@ -1577,8 +1585,7 @@ class HandlerCore:
                 log.debug('', exc_info=True)
 
             if isinstance(self.core.tabs.current_tab, tabs.XMLTab):
-                self.core.tabs.current_tab.refresh()
-                self.core.doupdate()
+                self.core.schedule_refresh()
 
     def incoming_stanza(self, stanza):
         """
@@ -1602,8 +1609,7 @@ class HandlerCore:
             except:
                 log.debug('', exc_info=True)
             if isinstance(self.core.tabs.current_tab, tabs.XMLTab):
-                self.core.tabs.current_tab.refresh()
-                self.core.doupdate()
+                self.core.schedule_refresh()
 
     def ssl_invalid_chain(self, tb):
         self.core.information('The certificate sent by the server is invalid.',
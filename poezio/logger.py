@@ -9,9 +9,13 @@ The logger module that handles logging of the poezio
 conversations and roster changes
 """
 
+import asyncio
 import mmap
+import os
 import re
-from typing import List, Dict, Optional, IO, Any
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional, IO, Any, Iterator, Tuple
 from datetime import datetime
 
 from poezio import common
@@ -32,6 +36,13 @@ INFO_LOG_RE = re.compile(r'^MI (\d{4})(\d{2})(\d{2})T'
                          r'(\d{2}):(\d{2}):(\d{2})Z '
                          r'(\d+) (.*)$')
 
+# Each log file can have an index next to it, with the same name and this
+# suffix. The index is made of fixed-size records (a timestamp, a space,
+# a zero-padded byte offset and a newline), one every log_index_interval
+# messages, so that it can be searched without being parsed.
+INDEX_SUFFIX = '.idx'
+INDEX_RECORD_SIZE = 32
+
 
 class LogItem:
     def __init__(self, year, month, day, hour, minute, second, nb_lines,
@@ -71,14 +82,37 @@ class Logger:
     """
     Appends things to files. Error/information/warning logs
     and also log the conversations to logfiles
+
+    Depending on the log_sync option, the lines are either written and
+    flushed immediately, or kept in a per-file buffer which is written
+    when it gets too big, after log_flush_interval seconds, or when the
+    file is closed.
+
+    At most log_max_open_files files are kept open, the least recently
+    used ones being closed (and transparently reopened when needed).
     """
 
     def __init__(self):
         self._roster_logfile = None  # Optional[IO[Any]]
-        # a dict of 'groupchatname': file-object (opened)
-        self._fds = {}  # type: Dict[str, IO[Any]]
+        # a dict of 'groupchatname': file-object (opened), least recently
+        # used first
+        self._fds = OrderedDict()  # type: Dict[str, IO[Any]]
+        # Statistics of the open files cache
+        self.fd_hits = 0
+        self.fd_misses = 0
+        self.fd_evictions = 0
+        # file-object -> lines not yet written
+        self._buffers = {}  # type: Dict[IO[Any], List[str]]
+        # file-object -> size of the lines not yet written
+        self._buffer_sizes = {}  # type: Dict[IO[Any], int]
+        self._flush_handle = None  # type: Optional[asyncio.Handle]
+        # file-object -> size of the file, buffered lines included
+        self._offsets = {}  # type: Dict[IO[Any], int]
+        # room -> number of messages logged since the last index record
+        self._index_counts = {}  # type: Dict[str, int]
 
     def __del__(self):
+        self.flush_all()
         for opened_file in self._fds.values():
             if opened_file:
                 try:
@@ -89,22 +123,111 @@ class Logger:
     def close(self, jid) -> None:
         jid = str(jid).replace('/', '\\')
         if jid in self._fds:
+            self._flush(self._fds[jid])
             self._fds[jid].close()
+            self._offsets.pop(self._fds[jid], None)
             log.debug('Log file for %s closed.', jid)
             del self._fds[jid]
         return None
 
     def reload_all(self) -> None:
         """Close and reload all the file handles (on SIGHUP)"""
+        self.flush_all()
         for opened_file in self._fds.values():
             if opened_file:
                 opened_file.close()
+        self._offsets.clear()
         log.debug('All log file handles closed')
-        for room in self._fds:
+        for room in list(self._fds):
             self._check_and_create_log_dir(room)
             log.debug('Log handle for %s re-created', room)
         return None
 
+    def _write(self, fd: IO[Any], text: str) -> None:
+        """
+        Write some text in a log file, or buffer it, depending on the
+        log_sync option.
+        Raises OSError if the text could not be written.
+        """
+        if config.get('log_sync') == 'always':
+            if fd in self._buffers:
+                self._flush(fd, raise_errors=True)
+            fd.write(text)
+            fd.flush()
+            return
+        self._buffers.setdefault(fd, []).append(text)
+        size = self._buffer_sizes.get(fd, 0) + len(text)
+        self._buffer_sizes[fd] = size
+        if size >= config.get('log_buffer_size'):
+            self._flush(fd, raise_errors=True)
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_later(
+                config.get('log_flush_interval'), self._on_flush_timer)
+
+    def _flush(self, fd: IO[Any], sync: bool = False,
+               raise_errors: bool = False) -> None:
+        """Write the buffered lines of a log file"""
+        lines = self._buffers.pop(fd, None)
+        self._buffer_sizes.pop(fd, None)
+        try:
+            if lines:
+                fd.write(''.join(lines))
+                fd.flush()
+            if sync:
+                os.fsync(fd.fileno())
+        except (OSError, ValueError):
+            if raise_errors:
+                raise
+            log.error(
+                'Unable to write in the log file (%s)',
+                getattr(fd, 'name', fd),
+                exc_info=True)
+
+    def _on_flush_timer(self) -> None:
+        self._flush_handle = None
+        self.flush_all(sync=config.get('log_sync') == 'fsync')
+
+    def flush_all(self, sync: bool = False) -> None:
+        """
+        Write all the buffered lines, and optionally make sure they
+        are on the disk
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if sync:
+            for fd in set(self._fds.values()) | set(self._buffers):
+                self._flush(fd, sync=True)
+            if self._roster_logfile:
+                self._flush(self._roster_logfile, sync=True)
+        else:
+            for fd in list(self._buffers):
+                self._flush(fd)
+
+    def _evict_fds(self) -> None:
+        """Close the least recently used files if too many are open"""
+        limit = max(config.get('log_max_open_files'), 1)
+        while len(self._fds) > limit:
+            room, fd = self._fds.popitem(last=False)
+            self._flush(fd)
+            self._offsets.pop(fd, None)
+            try:
+                fd.close()
+            except OSError:
+                log.error('Unable to close the log file of %s', room,
+                          exc_info=True)
+            self.fd_evictions += 1
+            log.debug(
+                'Log file for %s closed (open files: %s hits, %s misses, '
+                '%s evictions)', room, self.fd_hits, self.fd_misses,
+                self.fd_evictions)
+
+    def stats(self) -> str:
+        """Statistics of the open log files, to tune log_max_open_files"""
+        return ('%s/%s log files open, %s hits, %s misses, %s evictions' %
+                (len(self._fds), max(config.get('log_max_open_files'), 1),
+                 self.fd_hits, self.fd_misses, self.fd_evictions))
+
     def _check_and_create_log_dir(self, room: str,
                                   open_fd: bool = True) -> Optional[IO[Any]]:
         """
@@ -126,6 +249,8 @@ class Logger:
         try:
             fd = filename.open('a', encoding='utf-8')
             self._fds[room] = fd
+            self._offsets[fd] = os.fstat(fd.fileno()).st_size
+            self._evict_fds()
             return fd
         except IOError:
             log.error(
@@ -151,32 +276,164 @@ class Logger:
         if not logged_msg:
             return True
         jid = str(jid).replace('/', '\\')
-        if jid in self._fds.keys():
+        if jid in self._fds:
+            self.fd_hits += 1
+            self._fds.move_to_end(jid)
             fd = self._fds[jid]
         else:
+            self.fd_misses += 1
             option_fd = self._check_and_create_log_dir(jid)
             if option_fd is None:
                 return True
             fd = option_fd
         filename = log_dir / jid
         try:
-            fd.write(logged_msg)
+            self._write(fd, logged_msg)
         except OSError:
             log.error(
                 'Unable to write in the log file (%s)',
                 filename,
                 exc_info=True)
             return False
+        self._index_message(jid, fd, logged_msg)
+        return True
+
+    def _index_message(self, room: str, fd: IO[Any], logged_msg: str) -> None:
+        """
+        Keep track of the offset of a message that was just logged, and
+        add it to the index of the log file if it is the first one logged
+        there since poezio started, or if log_index_interval messages were
+        logged since the last index record.
+        """
+        offset = self._offsets.get(fd)
+        if offset is None:
+            return
+        self._offsets[fd] = offset + len(logged_msg.encode('utf-8'))
+        interval = config.get_by_tabname('log_index_interval', room)
+        if interval <= 0:
+            return
+        count = self._index_counts.get(room)
+        if count is not None and count + 1 < interval:
+            self._index_counts[room] = count + 1
+            return
+        self._index_counts[room] = 0
+        # logged_msg starts with "MR " or "MI ", then the timestamp
+        _append_index(log_dir / (room + INDEX_SUFFIX), logged_msg[3:21],
+                      offset)
+
+    def find_offset(self, jid: str, date: datetime) -> Optional[int]:
+        """
+        Find the offset of the first message logged for a jid at or after
+        date (the size of the file if there is none), seeking from the
+        closest record of the index of the log file.
+        Return None if that file has no index.
+        """
+        jid = str(jid).replace('/', '\\')
+        if jid in self._fds:
+            self._flush(self._fds[jid])
+        str_time = common.get_utc_time(date).strftime(
+            '%Y%m%dT%H:%M:%SZ').encode('ascii')
+        start = _search_index(log_dir / (jid + INDEX_SUFFIX), str_time)
+        if start is None:
+            return None
+        filename = log_dir / jid
+        try:
+            with filename.open('rb') as fd:
+                with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+                    if start > len(m) or (start and
+                                          m[start - 1:start + 1] != b'\nM'):
+                        log.debug('Stale log index for %s, rebuild it.', jid)
+                        start = 0
+                    pos = start
+                    while pos < len(m):
+                        if m[pos + 3:pos + 21] >= str_time:
+                            return pos
+                        pos = m.find(b'\nM', pos) + 1
+                        if pos == 0:
+                            break
+                    return len(m)
+        except (OSError, ValueError):  # mmap fails on empty files
+            return 0
+
+    def rebuild_index(self, jid: str) -> int:
+        """
+        Write the index of a log file from scratch, and return its number
+        of records.
+        """
+        jid = str(jid).replace('/', '\\')
+        if jid in self._fds:
+            self._flush(self._fds[jid])
+        interval = config.get_by_tabname('log_index_interval', jid)
+        if interval <= 0:
+            return 0
+        filename = log_dir / jid
+        records = []
+        nb_messages = 0
+        try:
+            with filename.open('rb') as fd:
+                with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+                    for nb_messages, pos in enumerate(_message_offsets(m), 1):
+                        if (nb_messages - 1) % interval == 0:
+                            records.append(b'%s %012d\n' %
+                                           (m[pos + 3:pos + 21], pos))
+        except FileNotFoundError:
+            return 0
+        except ValueError:  # mmap fails on empty files
+            pass
+        index = log_dir / (jid + INDEX_SUFFIX)
+        tmp_index = log_dir / (jid + INDEX_SUFFIX + '.tmp')
+        with tmp_index.open('wb') as fd:
+            fd.write(b''.join(records))
+        os.replace(str(tmp_index), str(index))
+        if nb_messages:
+            self._index_counts[jid] = (nb_messages - 1) % interval
         else:
+            self._index_counts.pop(jid, None)
+        return len(records)
+
+    def rebuild_all_indexes(self) -> int:
+        """
+        Rebuild the index of every conversation log file, and return
+        the number of files indexed.
+        """
+        nb_files = 0
+        for filename in sorted(log_dir.iterdir()):
+            name = filename.name
+            if (name.startswith('.') or name.endswith(INDEX_SUFFIX)
+                    or name.endswith('.tmp') or not filename.is_file()
+                    or name in ('errors.log', 'roster.log')):
+                continue
             try:
-                fd.flush()  # TODO do something better here?
+                self.rebuild_index(name)
             except OSError:
-                log.error(
-                    'Unable to flush the log file (%s)',
-                    filename,
-                    exc_info=True)
-                return False
-        return True
+                log.error('Unable to index the log file (%s)', filename,
+                          exc_info=True)
+                continue
+            nb_files += 1
+        return nb_files
+
+    def get_logs(self, jid: str, nb: int = 10,
+                 end: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Get the nb last messages logged for a jid (before the offset end,
+        if given).
+        Return them along with the offset of the first one in the file,
+        which is 0 once the beginning of the log has been reached.
+        """
+        jid = str(jid).replace('/', '\\')
+        if jid in self._fds:
+            self._flush(self._fds[jid])
+        filename = log_dir / jid
+        try:
+            with filename.open('rb') as fd:
+                lines, offset = _get_lines_from_fd(fd, nb=nb, end=end)
+        except FileNotFoundError:
+            return [], 0
+        except (OSError, ValueError):  # mmap fails on empty files
+            log.debug('Unable to read the log file (%s)', filename,
+                      exc_info=True)
+            return [], 0
+        return parse_log_lines(lines, jid), offset
 
     def log_roster_change(self, jid: str, message: str) -> bool:
         """
@@ -201,11 +458,10 @@ class Logger:
             lines = message.split('\n')
             first_line = lines.pop(0)
             nb_lines = str(len(lines)).zfill(3)
-            self._roster_logfile.write(
-                'MI %s %s %s %s\n' % (str_time, nb_lines, jid, first_line))
-            for line in lines:
-                self._roster_logfile.write(' %s\n' % line)
-            self._roster_logfile.flush()
+            self._write(
+                self._roster_logfile,
+                'MI %s %s %s %s\n' % (str_time, nb_lines, jid, first_line) +
+                ''.join(' %s\n' % line for line in lines))
         except:
             log.error(
                 'Unable to write in the log file (%s)',
@@ -245,20 +501,78 @@ def build_log_message(nick: str,
     return logged_msg + ''.join(' %s\n' % line for line in lines)
 
 
-def _get_lines_from_fd(fd: IO[Any], nb: int = 10) -> List[str]:
+def _get_lines_from_fd(fd: IO[Any], nb: int = 10,
+                       end: Optional[int] = None) -> Tuple[List[str], int]:
     """
-    Get the last log lines from a fileno
+    Get the last log lines from a fileno, before the offset end if given.
+    Return the lines and the offset of the first one.
     """
     with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+        if end is None:
+            end = len(m)
+        if end == 0 or nb <= 0:
+            return [], end
         # start of messages begin with MI or MR, after a \n
-        pos = m.rfind(b"\nM") + 1
+        pos = m.rfind(b"\nM", 0, end) + 1
         # number of message found so far
         count = 0
         while pos != 0 and count < nb - 1:
             count += 1
             pos = m.rfind(b"\nM", 0, pos) + 1
-        lines = m[pos:].decode(errors='replace').splitlines()
-    return lines
+        lines = m[pos:end].decode(errors='replace').splitlines()
+    return lines, pos
+
+
+def _message_offsets(m: mmap.mmap) -> Iterator[int]:
+    """
+    Iterate over the offsets of the messages of a mmap'd log file
+    """
+    if m[:1] == b'M':
+        yield 0
+    pos = m.find(b'\nM')
+    while pos != -1:
+        yield pos + 1
+        pos = m.find(b'\nM', pos + 1)
+
+
+def _append_index(filename: Path, str_time: str, offset: int) -> None:
+    """
+    Add a record to the index of a log file
+    """
+    try:
+        with filename.open('ab') as fd:
+            extra = fd.tell() % INDEX_RECORD_SIZE
+            if extra:  # a previous write was interrupted
+                fd.truncate(fd.tell() - extra)
+            fd.write(('%s %012d\n' % (str_time, offset)).encode('ascii'))
+    except OSError:
+        log.error(
+            'Unable to write in the log index (%s)', filename, exc_info=True)
+
+
+def _search_index(filename: Path, str_time: bytes) -> Optional[int]:
+    """
+    Binary search the index of a log file for the offset of the last
+    indexed message before str_time.
+    Return None if there is no index.
+    """
+    try:
+        with filename.open('rb') as fd:
+            with mmap.mmap(fd.fileno(), 0, prot=mmap.PROT_READ) as m:
+                low, high = 0, len(m) // INDEX_RECORD_SIZE
+                while low < high:
+                    middle = (low + high) // 2
+                    record = middle * INDEX_RECORD_SIZE
+                    if m[record:record + 18] < str_time:
+                        low = middle + 1
+                    else:
+                        high = middle
+                if low == 0:
+                    return 0
+                record = (low - 1) * INDEX_RECORD_SIZE
+                return int(m[record + 19:record + 31])
+    except (OSError, ValueError):  # mmap fails on empty files
+        return None
 
 
 def parse_log_lines(lines: List[str], jid: str) -> List[Dict[str, Any]]:
@@ -9,15 +9,19 @@
 import asyncio
 import logging
 import random
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from hashlib import md5
 from typing import (
     Any,
     AsyncIterable,
+    AsyncIterator,
+    Awaitable,
     Callable,
     Dict,
     List,
     Optional,
+    Set,
+    Tuple,
 )
 
 from slixmpp import JID, Message as SMessage
@@ -27,6 +31,7 @@ from poezio import tabs
 from poezio import xhtml, colors
 from poezio.config import config
 from poezio.common import to_utc
+from poezio.logger import logger
 from poezio.text_buffer import TextBuffer, HistoryGap
 from poezio.ui.types import (
     BaseMessage,
@@ -41,6 +46,116 @@ class DiscoInfoException(Exception): pass
 class MAMQueryException(Exception): pass
 class NoMAMSupportException(Exception): pass
 
+# JID -> disco#info request, shared by all the MAM queries against that JID
+# until the next session
+_disco_cache = {}  # type: Dict[str, asyncio.Future]
+
+
+class MAMScheduler:
+    """
+    Run the MAM queries of the tabs, at most max_mam_queries at a time.
+
+    When a slot is free, the query of the current tab goes first, then
+    those of the tabs with the most important state (see STATE_PRIORITY:
+    highlights, private messages, …), in the order they were scheduled.
+    There is at most one query per JID, waiting or running.
+    """
+
+    def __init__(self) -> None:
+        # JID -> (tab, query) waiting for a slot
+        self._pending = OrderedDict(
+        )  # type: Dict[str, Tuple[tabs.ChatTab, Callable[[tabs.ChatTab], Awaitable[None]]]]
+        # JIDs of the running queries
+        self._running = set()  # type: Set[str]
+
+    def schedule(self, tab: tabs.ChatTab,
+                 query: Callable[[tabs.ChatTab], Awaitable[None]]) -> bool:
+        """
+        Set the query status of the tab and schedule a query for it, unless
+        one is already waiting or running for that JID.
+        Return True if the query was scheduled.
+        """
+        key = str(tab.jid)
+        if key in self._pending or key in self._running:
+            return False
+        tab.query_status = True
+        self._pending[key] = (tab, query)
+        self._run_next()
+        return True
+
+    @staticmethod
+    def _priority(tab: tabs.ChatTab) -> float:
+        if tab is tab.core.tabs.current_tab:
+            return float('inf')
+        return tabs.basetabs.STATE_PRIORITY.get(tab.state, 0)
+
+    def _run_next(self) -> None:
+        """Start the most important queries, if there are free slots"""
+        limit = max(config.get('max_mam_queries'), 1)
+        while self._pending and len(self._running) < limit:
+            key = max(
+                self._pending,
+                key=lambda key: self._priority(self._pending[key][0]))
+            tab, query = self._pending.pop(key)
+            if tab.closed:
+                tab.query_status = False
+                continue
+            self._running.add(key)
+            asyncio.ensure_future(self._run(key, tab, query))
+
+    async def _run(self, key: str, tab: tabs.ChatTab,
+                   query: Callable[[tabs.ChatTab], Awaitable[None]]) -> None:
+        try:
+            await query(tab)
+        except Exception:
+            log.error('Error in the MAM query for %s', key, exc_info=True)
+            tab.query_status = False
+        finally:
+            self._running.discard(key)
+            self._run_next()
+
+
+scheduler = MAMScheduler()
+
+
+def clear_disco_cache() -> None:
+    """Forget the disco#info results (e.g. on a new session)"""
+    _disco_cache.clear()
+
+
+async def get_features(core, jid: JID) -> List[str]:
+    """
+    Get the disco#info features of a JID, only querying it once per
+    session (concurrent calls share the same request).
+    """
+    key = str(jid)
+    request = _disco_cache.get(key)
+    if request is None:
+        request = asyncio.ensure_future(
+            core.xmpp.plugin['xep_0030'].get_info(jid=jid))
+        _disco_cache[key] = request
+    try:
+        iq = await asyncio.shield(request)
+    except (IqError, IqTimeout):
+        # Do not cache errors
+        if _disco_cache.get(key) is request:
+            del _disco_cache[key]
+        raise DiscoInfoException()
+    return iq['disco_info'].get_features()
+
+
+def _muc_nick_color(tab: 'tabs.MucTab', nick: str, deterministic: bool):
+    """Get the color of a nick in a MUC history line"""
+    if not deterministic:
+        color = random.choice(list(xhtml.colors))
+        return (xhtml.colors.get(color), -1)
+    user = tab.get_user_by_name(nick)
+    if user:
+        return user.color
+    theme = get_theme()
+    return colors.nick_color(theme.ccg_palette, theme.LIST_COLOR_NICKNAMES,
+                             nick)
+
 
 def make_line(
         tab: tabs.ChatTab,
@@ -58,23 +173,7 @@ def make_line(
 
     if isinstance(tab, tabs.MucTab):
         nick = jid.resource
-        user = tab.get_user_by_name(nick)
-        if deterministic:
-            if user:
-                color = user.color
-            else:
-                theme = get_theme()
-                if theme.ccg_palette:
-                    fg_color = colors.ccg_text_to_color(theme.ccg_palette, nick)
-                    color = fg_color, -1
-                else:
-                    mod = len(theme.LIST_COLOR_NICKNAMES)
-                    nick_pos = int(md5(nick.encode('utf-8')).hexdigest(), 16) % mod
-                    color = theme.LIST_COLOR_NICKNAMES[nick_pos]
-        else:
-            color = random.choice(list(xhtml.colors))
-            color = xhtml.colors.get(color)
-            color = (color, -1)
+        color = _muc_nick_color(tab, nick, deterministic)
     else:
         if jid.bare == tab.core.xmpp.boundjid.bare:
             nick = tab.core.own_nick
@@ -92,6 +191,82 @@ def make_line(
         user=None,
     )
 
+def make_log_line(
+        tab: tabs.ChatTab,
+        entry: Dict[str, Any],
+        deterministic: bool = True,
+    ) -> Message:
+    """Build a history Message from an entry of the local logs"""
+    nick = entry.get('nickname')
+    color = None
+    if nick:
+        if isinstance(tab, tabs.MucTab):
+            color = _muc_nick_color(tab, nick, deterministic)
+        elif nick == getattr(tab, 'own_nick', tab.core.own_nick):
+            color = get_theme().COLOR_OWN_NICK
+        else:
+            color = get_theme().COLOR_REMOTE_USER
+    return Message(
+        txt=entry['txt'],
+        time=entry['time'],
+        nickname=nick,
+        nick_color=color,
+        history=True,
+        user=None,
+    )
+
+
+def fetch_local_history(tab: tabs.ChatTab,
+                        amount: int,
+                        end: Optional[datetime] = None) -> List[BaseMessage]:
+    """
+    Read up to amount messages from the local logs, going backwards from
+    the last ones read for this tab (tab.log_offset), and keeping only
+    those older than end (the first message in the buffer by default).
+    """
+    if amount <= 0 or tab.log_offset == 0:
+        return []
+    if config.get_by_tabname('load_log', tab.jid.bare) <= 0:
+        return []
+    if end is None:
+        for msg in tab._text_buffer.messages:
+            if isinstance(msg, Message):
+                end = msg.time
+                break
+    # The logs only have a precision of one second
+    if end is None:
+        end = datetime.now().replace(microsecond=0)
+    else:
+        end = end.replace(microsecond=0)
+        if tab.log_offset is None:
+            # Seek right before end using the index of the log file, if any
+            tab.log_offset = logger.find_offset(tab.log_name, end)
+            if tab.log_offset == 0:
+                return []
+    entries = []  # type: List[Dict[str, Any]]
+    while len(entries) < amount and tab.log_offset != 0:
+        page, offset = logger.get_logs(
+            tab.log_name, nb=amount - len(entries), end=tab.log_offset)
+        if offset == tab.log_offset:
+            break
+        tab.log_offset = offset
+        entries[0:0] = [entry for entry in page if entry['time'] < end]
+    entries = entries[-amount:]
+    deterministic = config.get_by_tabname(
+        'deterministic_nick_colors',
+        tab.jid.bare
+    )
+    return [make_log_line(tab, entry, deterministic) for entry in entries]
+
+
+def load_local_history(tab: tabs.ChatTab) -> None:
+    """Fill a new tab with the last messages from the local logs"""
+    amount = config.get_by_tabname('load_log', tab.jid.bare)
+    messages = fetch_local_history(tab, amount=amount)
+    if messages:
+        tab._text_buffer.add_history_messages(messages)
+
+
 async def get_mam_iterator(
         core,
         groupchat: bool,
@@ -103,12 +278,8 @@ async def get_mam_iterator(
         before: Optional[str] = None,
     ) -> AsyncIterable[Message]:
     """Get an async iterator for this mam query"""
-    try:
-        query_jid = remote_jid if groupchat else JID(core.xmpp.boundjid.bare)
-        iq = await core.xmpp.plugin['xep_0030'].get_info(jid=query_jid)
-    except (IqError, IqTimeout):
-        raise DiscoInfoException()
-    if 'urn:xmpp:mam:2' not in iq['disco_info'].get_features():
+    query_jid = remote_jid if groupchat else JID(core.xmpp.boundjid.bare)
+    if 'urn:xmpp:mam:2' not in await get_features(core, query_jid):
         raise NoMAMSupportException()
 
     args = {
@@ -140,43 +311,59 @@ def _parse_message(msg: SMessage) -> Dict:
     }
 
 
-async def retrieve_messages(tab: tabs.ChatTab,
-                            results: AsyncIterable[SMessage],
-                            amount: int = 100) -> List[BaseMessage]:
-    """Run the MAM query and put messages in order"""
-    text_buffer = tab._text_buffer
-    msg_count = 0
-    msgs = []
-    to_add = []
+async def iterate_messages(tab: tabs.ChatTab,
+                           results: AsyncIterable[SMessage],
+                           amount: int = 100,
+                           ) -> AsyncIterator[List[BaseMessage]]:
+    """
+    Run the MAM query and yield its pages as soon as they arrive, each in
+    chronological order, from the most recent page to the oldest one.
+    """
+    remaining = amount
     deterministic = config.get_by_tabname(
         'deterministic_nick_colors',
         tab.jid.bare
     )
     try:
         async for rsm in results:
+            msgs = []
             for msg in rsm['mam']['results']:
                 if msg['mam_result']['forwarded']['stanza'] \
                         .xml.find('{%s}%s' % ('jabber:client', 'body')) is not None:
                     args = _parse_message(msg)
                     msgs.append(make_line(tab, deterministic=deterministic, **args))
-            for msg in reversed(msgs):
-                to_add.append(msg)
-                msg_count += 1
-                if msg_count == amount:
-                    to_add.reverse()
-                    return to_add
-            msgs = []
-        to_add.reverse()
-        return to_add
+            if not msgs:
+                continue
+            msgs = msgs[-remaining:]
+            remaining -= len(msgs)
+            yield msgs
+            if remaining <= 0:
+                return
     except (IqError, IqTimeout) as exc:
         log.debug('Unable to complete MAM query: %s', exc, exc_info=True)
         raise MAMQueryException('Query interrupted')
 
 
-async def fetch_history(tab: tabs.ChatTab,
-                        start: Optional[datetime] = None,
-                        end: Optional[datetime] = None,
-                        amount: int = 100) -> List[BaseMessage]:
+async def retrieve_messages(tab: tabs.ChatTab,
+                            results: AsyncIterable[SMessage],
+                            amount: int = 100) -> List[BaseMessage]:
+    """Run the MAM query and put messages in order"""
+    to_add = []  # type: List[BaseMessage]
+    async for msgs in iterate_messages(tab, results, amount):
+        to_add[0:0] = msgs
+    return to_add
+
+
+async def iterate_history(tab: tabs.ChatTab,
+                          start: Optional[datetime] = None,
+                          end: Optional[datetime] = None,
+                          amount: int = 100,
+                          ) -> AsyncIterator[List[BaseMessage]]:
+    """
+    Query the archive of a tab, and yield the pages of messages as they
+    arrive (see iterate_messages). The iteration stops early if the tab
+    gets closed.
+    """
     remote_jid = tab.jid
     if not end:
         for msg in tab._text_buffer.messages:
@@ -203,7 +390,33 @@ async def fetch_history(tab: tabs.ChatTab,
         start=start_str,
         reverse=True,
     )
-    return await retrieve_messages(tab, mam_iterator, amount)
+    async for msgs in iterate_messages(tab, mam_iterator, amount):
+        if tab.closed:
+            log.debug('Tab %s closed, MAM query interrupted', tab.name)
+            return
+        yield msgs
+
+
+async def fetch_history(tab: tabs.ChatTab,
+                        start: Optional[datetime] = None,
+                        end: Optional[datetime] = None,
+                        amount: int = 100) -> List[BaseMessage]:
+    messages = []  # type: List[BaseMessage]
+    async for msgs in iterate_history(tab, start, end, amount):
+        messages[0:0] = msgs
+    return messages
+
+
+def _needs_history(tab: tabs.ChatTab) -> bool:
+    """
+    Is the position in the tab < two screen pages from the top of the
+    buffer? (in which case we want more history, to keep some prefetched
+    margin)
+    """
+    tw = tab.text_win
+    total, pos, height = len(tw.built_lines), tw.pos, tw.height
+    return (total - pos) // height <= 1
+
 
 async def fill_missing_history(tab: tabs.ChatTab, gap: HistoryGap) -> None:
     start = gap.last_timestamp_before_leave
@@ -213,15 +426,53 @@ async def fill_missing_history(tab: tabs.ChatTab, gap: HistoryGap) -> None:
     if end:
         end = end - timedelta(seconds=1)
     try:
-        messages = await fetch_history(tab, start=start, end=end, amount=999)
-        tab._text_buffer.add_history_messages(messages, gap=gap)
-        if messages:
+        # Older pages are inserted right after the leave message, and
+        # therefore before the more recent ones.
+        async for messages in iterate_history(tab, start=start, end=end, amount=999):
+            tab._text_buffer.add_history_messages(messages, gap=gap)
             tab.core.refresh_window()
     except (NoMAMSupportException, MAMQueryException, DiscoInfoException):
         return
     finally:
         tab.query_status = False
 
+async def add_local_and_missing_history(tab: tabs.ChatTab,
+                                        local_messages: List[BaseMessage],
+                                        end: datetime,
+                                        amount: int) -> int:
+    """
+    Insert messages read from the local logs in the buffer, after asking
+    the server for the more recent ones (up to end) that the logs miss,
+    e.g. those sent while we were offline. Return the number of messages
+    inserted.
+    """
+    # The logs only have a precision of one second
+    start = local_messages[-1].time + timedelta(seconds=1)
+    nb_messages = 0
+    try:
+        async for messages in iterate_history(
+                tab, start=start, end=end, amount=amount):
+            nb_messages += len(messages)
+            tab._text_buffer.add_history_messages(messages)
+            tab.core.refresh_window()
+    except (NoMAMSupportException, MAMQueryException, DiscoInfoException):
+        if nb_messages:
+            # The logs would leave a hole before the messages received
+            tab.log_offset = 0
+        else:
+            tab._text_buffer.add_history_messages(local_messages)
+            tab.core.refresh_window()
+        raise
+    if nb_messages >= amount:
+        # The logs do not reach these messages: the older ones have to be
+        # read from the server too.
+        tab.log_offset = 0
+        return nb_messages
+    tab._text_buffer.add_history_messages(local_messages)
+    tab.core.refresh_window()
+    return nb_messages + len(local_messages)
+
+
 async def on_new_tab_open(tab: tabs.ChatTab) -> None:
     """Called when opening a new tab"""
     amount = 2 * tab.text_win.height
@@ -231,10 +482,27 @@ async def on_new_tab_open(tab: tabs.ChatTab) -> None:
             end = message.time
             break
     end = end - timedelta(microseconds=1)
+    local_messages = fetch_local_history(
+        tab,
+        amount=config.get_by_tabname('load_log', tab.jid.bare),
+        end=end,
+    )
+    nb_messages = 0
     try:
-        messages = await fetch_history(tab, end=end, amount=amount)
-        tab._text_buffer.add_history_messages(messages)
-        if messages:
+        if local_messages:
+            nb_messages = await add_local_and_missing_history(
+                tab, local_messages, end, amount)
+            if nb_messages >= amount:
+                return None
+        # Once history messages are in the buffer, let iterate_history
+        # start right before them.
+        pages = iterate_history(
+            tab,
+            end=None if nb_messages else end,
+            amount=amount - nb_messages,
+        )
+        async for messages in pages:
+            tab._text_buffer.add_history_messages(messages)
             tab.core.refresh_window()
     except (NoMAMSupportException, MAMQueryException, DiscoInfoException):
         return None
@@ -244,8 +512,7 @@ async def on_new_tab_open(tab: tabs.ChatTab) -> None:
 
 def schedule_tab_open(tab: tabs.ChatTab) -> None:
     """Set the query status and schedule a MAM query"""
-    tab.query_status = True
-    asyncio.ensure_future(on_tab_open(tab))
+    scheduler.schedule(tab, on_tab_open)
 
 
 async def on_tab_open(tab: tabs.ChatTab) -> None:
@@ -258,43 +525,59 @@ async def on_tab_open(tab: tabs.ChatTab) -> None:
 
 def schedule_scroll_up(tab: tabs.ChatTab) -> None:
     """Set query status and schedule a scroll up"""
-    tab.query_status = True
-    asyncio.ensure_future(on_scroll_up(tab))
+    scheduler.schedule(tab, on_scroll_up)
 
 
 async def on_scroll_up(tab: tabs.ChatTab) -> None:
-    tw = tab.text_win
-
     # If position in the tab is < two screen pages, then fetch MAM, so that we
     # keep some prefetched margin. A first page should also be prefetched on
     # join if not already available.
-    total, pos, height = len(tw.built_lines), tw.pos, tw.height
-    rest = (total - pos) // height
-
-    if rest > 1:
+    if not _needs_history(tab):
         tab.query_status = False
         return None
+    height = tab.text_win.height
+
+    # Read what we can from the local logs first, and only ask the server
+    # for the rest.
+    local_messages = fetch_local_history(tab, amount=height)
+    if local_messages:
+        tab._text_buffer.add_history_messages(local_messages)
+        tab.core.refresh_window()
+        if len(local_messages) >= height:
+            tab.query_status = False
+            return None
 
     try:
         # XXX: Do we want to fetch a possibly variable number of messages?
         # (InfoTab changes height depending on the type of messages, see
         # `information_buffer_popup_on`).
-        messages = await fetch_history(tab, amount=height)
+        nb_messages = 0
+        pages = iterate_history(tab, amount=height - len(local_messages))
+        async for messages in pages:
+            nb_messages += len(messages)
+            tab._text_buffer.add_history_messages(messages)
+            tab.core.refresh_window()
+            # Stop there if the user scrolled away from the top
+            if not _needs_history(tab):
+                break
+        if tab.closed:
+            return None
         last_message_exists = False
         if tab._text_buffer.messages:
             last_message = tab._text_buffer.messages[0]
             last_message_exists = True
-        if not messages and last_message_exists and not isinstance(last_message, EndOfArchive):
+        if not nb_messages and last_message_exists and not isinstance(last_message, EndOfArchive):
             time = tab._text_buffer.messages[0].time
             messages = [EndOfArchive('End of archive reached', time=time)]
-        tab._text_buffer.add_history_messages(messages)
-        if messages:
+            tab._text_buffer.add_history_messages(messages)
             tab.core.refresh_window()
     except NoMAMSupportException:
-        tab.core.information('MAM not supported for %r' % tab.jid, 'Info')
+        if not local_messages:
+            tab.core.information('MAM not supported for %r' % tab.jid, 'Info')
         return None
     except (MAMQueryException, DiscoInfoException):
-        tab.core.information('An error occured when fetching MAM for %r' % tab.jid, 'Error')
+        if not local_messages:
+            tab.core.information('An error occured when fetching MAM for %r' % tab.jid, 'Error')
         return None
     finally:
         tab.query_status = False
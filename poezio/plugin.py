@@ -45,6 +45,7 @@ class PluginConfig(config.Config):
 
     def read(self):
         """Read the config file"""
+        self.invalidate_cache()
         RawConfigParser.read(self, str(self.file_name))
         if not self.has_section(self.module_name):
             self.add_section(self.module_name)
@@ -6,7 +6,8 @@
 # it under the terms of the zlib license. See the COPYING file.
 '''This is a template module just for instruction. And poopt.'''
 
-from typing import List, Tuple
+import re
+from typing import Dict, List, Optional, Tuple
 
 # CFFI codepath.
 from cffi import FFI
@@ -31,16 +32,41 @@ libc = ffi.dlopen(None)
 # extracted with mbrtowc(), and supposing these two compononents are not
 # bugged, and since poezio’s code should never pass '\t', '\n' or their
 # friends, a return value of -1 from wcwidth() is considered to be a bug in
-# wcwidth() (until proven otherwise). xwcwidth() is here to work around
+# wcwidth() (until proven otherwise). _wcwidth() is here to work around
 # this bug.
-def xwcwidth(c: str) -> int:
-    character = ord(c)
+def _wcwidth(character: int) -> int:
     res = libc.wcwidth(character)
-    if res == -1 and c != '\x19':
+    if res == -1 and character != 0x19:
         return 1
     return res
 
 
+# Calling wcwidth() through CFFI for each char is slow, so the widths are
+# kept in a table, filled 256 chars at a time for the BMP, and in a dict for
+# the chars outside of it.
+_bmp_widths = [None] * 256  # type: List[Optional[List[int]]]
+_astral_widths = {}  # type: Dict[int, int]
+
+
+def _bmp_block(index: int) -> List[int]:
+    block = [_wcwidth(character) for character in range(index << 8, (index + 1) << 8)]
+    _bmp_widths[index] = block
+    return block
+
+
+def xwcwidth(c: str) -> int:
+    character = ord(c)
+    if character < 0x10000:
+        block = _bmp_widths[character >> 8]
+        if block is None:
+            block = _bmp_block(character >> 8)
+        return block[character & 0xff]
+    res = _astral_widths.get(character)
+    if res is None:
+        res = _astral_widths[character] = _wcwidth(character)
+    return res
+
+
 # cut_text: takes a string and returns a tuple of int.
 #
 # Each two int tuple is a line, represented by the ending position it
@@ -86,6 +112,10 @@ def cut_text(string: str, width: int) -> List[Tuple[int, int]]:
     #: unsigned int
     #spos = -1
 
+    # Apart from the NUL char, all the ASCII chars (that are not formatting
+    # chars or \n) take one column, no need to look their width up
+    ascii_only = string.isascii() and '\0' not in string
+
     in_special_character = False
     for spos, wc in enumerate(string):
         # Special case to skip poezio special characters that are contained
@@ -115,7 +145,7 @@ def cut_text(string: str, width: int) -> List[Tuple[int, int]]:
             continue
 
         # Get the number of columns needed to display this character. May be 0, 1 or 2
-        cols = xwcwidth(wc)
+        cols = 1 if ascii_only else xwcwidth(wc)
 
         # This is the second condition to end the line: we have consumed
         # enough columns to fill a whole line
@@ -146,12 +176,117 @@ def cut_text(string: str, width: int) -> List[Tuple[int, int]]:
     return retlist
 
 
+# cut_text_attrs: the same as cut_text, but also parses the poezio
+# formatting codes found in the string, in the same pass.
+#
+# Returns a list of (start, end, attrs) tuples, attrs being the tuple of the
+# attributes active at the start of the line, like parse_attrs would return
+# them for the text before it: 'b', 'u', 'i', or a color followed by its
+# '}'.  Consecutive lines starting with the same attributes share the same
+# tuple.
+#
+# For example,
+# cut_text_attrs("ab\x19bcd \x191}ef", 5)
+# will return [(0, 6, ()), (7, 12, ('b',))], meaning that the lines are
+# "ab\x19bcd" and "\x191}ef", the second one being in bold.
+def cut_text_attrs(string: str, width: int) -> List[Tuple[int, int, Tuple[str, ...]]]:
+    '''cut_text_attrs(text, width)
+
+    Return a list of three-tuple, the first int is the starting position of the line, the second is its end, and the third is the tuple of attributes active at its start.'''
+    retlist = []  # type: List[Tuple[int, int, Tuple[str, ...]]]
+    length = len(string)
+    # The attributes currently active, and their tuple, None when the stack
+    # changed since it was last built
+    stack = []  # type: List[str]
+    attrs = ()  # type: Optional[Tuple[str, ...]]
+    # The attributes active at the start of the current line, and at the
+    # last space seen in it
+    line_attrs = attrs  # type: Tuple[str, ...]
+    space_attrs = attrs  # type: Tuple[str, ...]
+    spos = 0
+    start_pos = 0
+    last_space = -1
+    cols_until_space = 0
+    columns = 0
+    # See cut_text
+    ascii_only = string.isascii() and '\0' not in string
+    while spos < length:
+        wc = string[spos]
+        # The formatting codes are not displayed, and do not take any column,
+        # but they change the attributes of what follows them
+        if wc == '\x19':
+            if spos + 1 >= length:
+                spos = length
+                break
+            attr = string[spos + 1]
+            if '0' <= attr <= '9' or attr == '-':
+                end = string.find('}', spos)
+                if end == -1:
+                    end = length - 1
+                if end > spos + 1:
+                    stack.append(string[spos + 1:end] + '}')
+                    attrs = None
+                spos = end + 1
+                continue
+            if 'A' <= attr <= 'Z':
+                attr = attr.lower()
+            if attr == 'o':
+                if stack:
+                    stack = []
+                    attrs = None
+            elif attr in ('u', 'b', 'i'):
+                stack.append(attr)
+                attrs = None
+            spos += 2
+            continue
+
+        if wc == '\n':
+            spos += 1
+            retlist.append((start_pos, spos, line_attrs))
+            start_pos = spos
+            last_space = -1
+            columns = 0
+            if attrs is None:
+                attrs = tuple(stack)
+            line_attrs = attrs
+            continue
+
+        cols = 1 if ascii_only else xwcwidth(wc)
+        if columns + cols > width:
+            if last_space != -1:
+                retlist.append((start_pos, last_space, line_attrs))
+                start_pos = last_space + 1
+                last_space = -1
+                columns -= (cols_until_space + 1)
+                line_attrs = space_attrs
+            else:
+                retlist.append((start_pos, spos, line_attrs))
+                start_pos = spos
+                columns = 0
+                if attrs is None:
+                    attrs = tuple(stack)
+                line_attrs = attrs
+        if wc == ' ':
+            last_space = spos
+            cols_until_space = columns
+            if attrs is None:
+                attrs = tuple(stack)
+            space_attrs = attrs
+        columns += cols
+        spos += 1
+    retlist.append((start_pos, spos, line_attrs))
+    return retlist
+
+
 # wcswidth: An emulation of the POSIX wcswidth(3) function using xwcwidth.
 def wcswidth(string: str) -> int:
     '''wcswidth(s)
 
     The wcswidth() function returns the number of columns needed to represent the wide-character string pointed to by s. Raise UnicodeError if an invalid unicode value is passed'''
 
+    # Printable ASCII chars all take one column
+    if string.isascii() and string.isprintable():
+        return len(string)
     columns = 0
     for wc in string:
         columns += xwcwidth(wc)
@@ -172,6 +307,8 @@ def cut_by_columns(string: str, limit: int) -> str:
 
     returns a string truncated to take at most limit columns'''
 
+    if string.isascii() and string.isprintable():
+        return string[:max(limit, 0)]
     spos = 0
     columns = 0
     for wc in string:
@@ -183,3 +320,61 @@ def cut_by_columns(string: str, limit: int) -> str:
         spos += 1
         columns += cols
     return string[:spos]
+
+
+# strip_attrs: takes a python string and returns it without its poezio
+# formatting codes, i.e. \x19 followed by a color (\x19<number>[,…]}) or by
+# one of 'b', 'u', 'a', 'i', 'o'.
+ATTRS_RE = re.compile(r'\x19-?\d[^}]*}|\x19[buaio]')
+
+
+def strip_attrs(string: str) -> str:
+    '''strip_attrs(text)
+
+    Return the text without its formatting codes.'''
+    return ATTRS_RE.sub('', string)
+
+
+# split_attrs: takes a python string and splits it on its formatting codes,
+# in one pass.
+#
+# Returns a list of (text, code) tuples: the text before each \x19, and
+# what follows it.  The code is the color (what is between the \x19 and the
+# next '}', or the end of the string minus one char if there is none), or
+# the lowercased attribute char, or an empty string if the \x19 ends the
+# string.  The last tuple is the remaining text, with None as its code.
+#
+# For example,
+# split_attrs("a\x19bb\x191}c") returns
+# [("a", "b"), ("b", "1"), ("c", None)]
+def split_attrs(string: str) -> List[Tuple[str, Optional[str]]]:
+    '''split_attrs(text)
+
+    Return a list of (text, code) tuples, split on the formatting codes of the text; the code of the last one is None.'''
+    retlist = []  # type: List[Tuple[str, Optional[str]]]
+    start = 0
+    length = len(string)
+    while start < length:
+        pos = string.find('\x19', start)
+        if pos == -1:
+            break
+        if pos + 1 >= length:
+            code = ''
+            next_start = pos + 2
+        else:
+            attr = string[pos + 1]
+            if '0' <= attr <= '9' or attr == '-':
+                end = string.find('}', pos)
+                if end == -1:
+                    end = length - 1
+                code = string[pos + 1:end]
+                next_start = end + 1
+            else:
+                if 'A' <= attr <= 'Z':
+                    attr = attr.lower()
+                code = attr
+                next_start = pos + 2
+        retlist.append((string[start:pos], code))
+        start = next_start
+    retlist.append((string[start:], None))
+    return retlist
@@ -221,6 +221,228 @@ static PyObject* poopt_cut_text(PyObject* self, PyObject* args)
     return retlist;
 }
 
+/**
+   cut_text_attrs: the same as cut_text, but also parses the poezio
+   formatting codes found in the string, in the same pass.
+
+   Returns a list of (start, end, attrs) tuples, attrs being the tuple of
+   the attributes active at the start of the line, like parse_attrs would
+   return them for the text before it: 'b', 'u', 'i', or a color followed
+   by its '}'.  Consecutive lines starting with the same attributes share
+   the same tuple.
+
+   For example,
+   poopt_cut_text_attrs("ab\x19bcd \x191}ef", 5);
+   will return [(0, 6, ()), (7, 12, ('b',))], meaning that the lines are
+   "ab\x19bcd" and "\x191}ef", the second one being in bold.
+*/
+PyDoc_STRVAR(poopt_cut_text_attrs_doc, "cut_text_attrs(text, width)\n\n\nReturn a list of three-tuple, the first int is the starting position of the line, the second is its end, and the third is the tuple of attributes active at its start.");
+
+/* Return the tuple of the attributes in stack, as a new reference, building
+ * it in *attrs if it is NULL (because the stack changed). */
+static PyObject* current_attrs(PyObject* stack, PyObject** attrs)
+{
+    if (*attrs == NULL)
+        *attrs = PyList_AsTuple(stack);
+    Py_XINCREF(*attrs);
+    return *attrs;
+}
+
+static int append_line(PyObject* retlist, Py_ssize_t start, Py_ssize_t end,
+                       PyObject* attrs)
+{
+    PyObject* tmp = Py_BuildValue("nnO", start, end, attrs);
+    if (tmp == NULL)
+        return -1;
+    const int res = PyList_Append(retlist, tmp);
+    Py_DECREF(tmp);
+    return res;
+}
+
+static PyObject* poopt_cut_text_attrs(PyObject* self, PyObject* args)
+{
+    PyObject* text;
+    unsigned long width;
+
+    if (PyArg_ParseTuple(args, "Uk", &text, &width) == 0)
+        return NULL;
+
+    const Py_ssize_t len = PyUnicode_GET_LENGTH(text);
+    const int kind = PyUnicode_KIND(text);
+    const void* const data = PyUnicode_DATA(text);
+
+    /* The list of tuples that we return */
+    PyObject* const retlist = PyList_New(0);
+    /* The attributes currently active, and their tuple, NULL when the
+     * stack changed since it was last built */
+    PyObject* const stack = PyList_New(0);
+    PyObject* attrs = PyTuple_New(0);
+    /* The attributes active at the start of the current line, and at the
+     * last space seen in it */
+    PyObject* line_attrs = NULL;
+    PyObject* space_attrs = NULL;
+    PyObject* code;
+    PyObject* tmp;
+    if (retlist == NULL || stack == NULL || attrs == NULL)
+        goto fail;
+    line_attrs = current_attrs(stack, &attrs);
+
+    /* The position in the python string */
+    Py_ssize_t spos = 0;
+    /* The start position of the next line */
+    Py_ssize_t start_pos = 0;
+    /* The position of the last space seen in the current line, used to
+     * cut on spaces instead of cutting inside words, if possible */
+    Py_ssize_t last_space = -1;
+    /* The number of columns taken by chars between start_pos and last_space */
+    size_t cols_until_space = 0;
+    /* Number of columns taken to display the current line so far */
+    size_t columns = 0;
+
+    while (spos < len)
+    {
+        const Py_UCS4 wc = PyUnicode_READ(kind, data, spos);
+        /* The formatting codes are not displayed, and do not take any
+         * column, but they change the attributes of what follows them */
+        if (wc == 25)   /* \x19 */
+        {
+            if (spos + 1 >= len)
+            {
+                spos = len;
+                break ;
+            }
+            Py_UCS4 attr = PyUnicode_READ(kind, data, spos + 1);
+            if ((attr >= '0' && attr <= '9') || attr == '-')
+            {   /* A color, until the next '}' */
+                Py_ssize_t end = PyUnicode_FindChar(text, '}', spos, len, 1);
+                if (end == -2)
+                    goto fail;
+                if (end == -1)
+                    end = len - 1;
+                if (end > spos + 1)
+                {
+                    tmp = PyUnicode_Substring(text, spos + 1, end);
+                    if (tmp == NULL)
+                        goto fail;
+                    code = PyUnicode_FromFormat("%U}", tmp);
+                    Py_DECREF(tmp);
+                    if (code == NULL || PyList_Append(stack, code) == -1)
+                    {
+                        Py_XDECREF(code);
+                        goto fail;
+                    }
+                    Py_DECREF(code);
+                    Py_CLEAR(attrs);
+                }
+                spos = end + 1;
+                continue ;
+            }
+            if (attr >= 'A' && attr <= 'Z')
+                attr += 'a' - 'A';
+            if (attr == 'o')
+            {
+                if (PyList_GET_SIZE(stack) != 0)
+                {
+                    if (PyList_SetSlice(stack, 0, PyList_GET_SIZE(stack), NULL) == -1)
+                        goto fail;
+                    Py_CLEAR(attrs);
+                }
+            }
+            else if (attr == 'u' || attr == 'b' || attr == 'i')
+            {
+                code = PyUnicode_FromOrdinal(attr);
+                if (code == NULL || PyList_Append(stack, code) == -1)
+                {
+                    Py_XDECREF(code);
+                    goto fail;
+                }
+                Py_DECREF(code);
+                Py_CLEAR(attrs);
+            }
+            spos += 2;
+            continue ;
+        }
+
+        /* This is one condition to end the line: an explicit \n is found */
+        if (wc == '\n')
+        {
+            spos++;
+            if (append_line(retlist, start_pos, spos, line_attrs) == -1)
+                goto fail;
+            /* And then initiate a new line */
+            start_pos = spos;
+            last_space = -1;
+            columns = 0;
+            Py_DECREF(line_attrs);
+            line_attrs = current_attrs(stack, &attrs);
+            if (line_attrs == NULL)
+                goto fail;
+            continue ;
+        }
+
+        /* Get the number of columns needed to display this character. May be 0, 1 or 2 */
+        const size_t cols = xwcwidth((wchar_t)wc);
+
+        /* This is the second condition to end the line: we have consumed
+         * enough columns to fill a whole line */
+        if (columns + cols > width)
+        {   /* If possible, cut on a space */
+            if (last_space != -1)
+            {
+                if (append_line(retlist, start_pos, last_space, line_attrs) == -1)
+                    goto fail;
+                start_pos = last_space + 1;
+                last_space = -1;
+                columns -= (cols_until_space + 1);
+                Py_DECREF(line_attrs);
+                line_attrs = space_attrs;
+                space_attrs = NULL;
+            }
+            else
+            {
+                /* Otherwise, cut in the middle of a word */
+                if (append_line(retlist, start_pos, spos, line_attrs) == -1)
+                    goto fail;
+                start_pos = spos;
+                columns = 0;
+                Py_DECREF(line_attrs);
+                line_attrs = current_attrs(stack, &attrs);
+                if (line_attrs == NULL)
+                    goto fail;
+            }
+        }
+        /* We save the position of the last space seen in this line, the
+           number of columns we have until now, and the attributes active
+           there, for when we will use that space as a cutting point */
+        if (wc == ' ')
+        {
+            last_space = spos;
+            cols_until_space = columns;
+            Py_XDECREF(space_attrs);
+            space_attrs = current_attrs(stack, &attrs);
+            if (space_attrs == NULL)
+                goto fail;
+        }
+        columns += cols;
+        spos++;
+    }
+    /* We are at the end of the string, append the last line, not finished */
+    if (append_line(retlist, start_pos, spos, line_attrs) == -1)
+        goto fail;
+    Py_DECREF(stack);
+    Py_XDECREF(attrs);
+    Py_DECREF(line_attrs);
+    Py_XDECREF(space_attrs);
+    return retlist;
+ fail:
+    Py_XDECREF(retlist);
+    Py_XDECREF(stack);
+    Py_XDECREF(attrs);
+    Py_XDECREF(line_attrs);
+    Py_XDECREF(space_attrs);
+    return NULL;
+}
+
 /**
    wcswidth: An emulation of the POSIX wcswidth(3) function using wcwidth
    and mbrtowc.
@@ -314,6 +536,196 @@ static PyObject* poopt_cut_by_columns(PyObject* self, PyObject* args)
   return Py_BuildValue("s#", start, ptr - start);
 }
 
+/**
+   strip_attrs: takes a python string and returns it without its poezio
+   formatting codes, i.e. \x19 followed by a color (\x19<number>[,…]}) or
+   by one of 'b', 'u', 'a', 'i', 'o'.  A \x19 that does not start such a
+   code is kept, like with the r'\x19-?\d[^}]*}|\x19[buaio]' regex.
+*/
+PyDoc_STRVAR(poopt_strip_attrs_doc, "strip_attrs(text)\n\n\nReturn the text without its formatting codes.");
+static PyObject* poopt_strip_attrs(PyObject* self, PyObject* args)
+{
+    PyObject* text;
+    if (PyArg_ParseTuple(args, "U", &text) == 0)
+        return NULL;
+
+    const Py_ssize_t len = PyUnicode_GET_LENGTH(text);
+    Py_ssize_t pos = PyUnicode_FindChar(text, 25, 0, len, 1);
+    if (pos == -2)
+        return NULL;
+    if (pos == -1)
+    {   /* Nothing to remove */
+        Py_INCREF(text);
+        return text;
+    }
+
+    const int kind = PyUnicode_KIND(text);
+    const void* const data = PyUnicode_DATA(text);
+    Py_UCS4* const result = PyMem_New(Py_UCS4, len);
+    if (result == NULL)
+        return PyErr_NoMemory();
+    Py_ssize_t result_len = 0;
+    Py_ssize_t i;
+    for (i = 0; i < pos; i++)
+        result[result_len++] = PyUnicode_READ(kind, data, i);
+
+    while (pos < len)
+    {
+        const Py_UCS4 c = PyUnicode_READ(kind, data, pos);
+        if (c != 25)
+        {
+            result[result_len++] = c;
+            pos++;
+            continue;
+        }
+        /* A color: \x19, an optional '-', a digit and everything until
+         * the next '}' */
+        Py_ssize_t digit = pos + 1;
+        if (digit < len && PyUnicode_READ(kind, data, digit) == '-')
+            digit++;
+        if (digit < len &&
+            Py_UNICODE_ISDECIMAL(PyUnicode_READ(kind, data, digit)))
+        {
+            const Py_ssize_t brace = PyUnicode_FindChar(text, '}', digit + 1,
+                                                        len, 1);
+            if (brace == -2)
+            {
+                PyMem_Free(result);
+                return NULL;
+            }
+            if (brace != -1)
+            {
+                pos = brace + 1;
+                continue;
+            }
+        }
+        /* Or a single char attribute */
+        if (pos + 1 < len)
+        {
+            const Py_UCS4 attr = PyUnicode_READ(kind, data, pos + 1);
+            if (attr == 'b' || attr == 'u' || attr == 'a' ||
+                attr == 'i' || attr == 'o')
+            {
+                pos += 2;
+                continue;
+            }
+        }
+        result[result_len++] = c;
+        pos++;
+    }
+    PyObject* const ret = PyUnicode_FromKindAndData(PyUnicode_4BYTE_KIND,
+                                                    result, result_len);
+    PyMem_Free(result);
+    return ret;
+}
+
+/**
+   split_attrs: takes a python string and splits it on its formatting
+   codes, in one pass.
+
+   Returns a list of (text, code) tuples: the text before each \x19, and
+   what follows it.  The code is the color (what is between the \x19 and
+   the next '}', or the end of the string minus one char if there is
+   none), or the lowercased attribute char, or an empty string if the
+   \x19 ends the string.  The last tuple is the remaining text, with None
+   as its code.
+
+   For example,
+   split_attrs("a\x19bb\x191}c") returns
+   [("a", "b"), ("b", "1"), ("c", None)]
+*/
+PyDoc_STRVAR(poopt_split_attrs_doc, "split_attrs(text)\n\n\nReturn a list of (text, code) tuples, split on the formatting codes of the text; the code of the last one is None.");
+static PyObject* poopt_split_attrs(PyObject* self, PyObject* args)
+{
+    PyObject* text;
+    if (PyArg_ParseTuple(args, "U", &text) == 0)
+        return NULL;
+
+    const Py_ssize_t len = PyUnicode_GET_LENGTH(text);
+    const int kind = PyUnicode_KIND(text);
+    const void* const data = PyUnicode_DATA(text);
+    PyObject* const retlist = PyList_New(0);
+    if (retlist == NULL)
+        return NULL;
+    PyObject* chunk;
+    PyObject* code;
+    PyObject* tmp;
+
+    /* The start of the text that is not split yet */
+    Py_ssize_t start = 0;
+    while (start < len)
+    {
+        const Py_ssize_t pos = PyUnicode_FindChar(text, 25, start, len, 1);
+        if (pos == -2)
+            goto fail;
+        if (pos == -1)
+            break ;
+        Py_ssize_t next;
+        if (pos + 1 >= len)
+        {
+            code = PyUnicode_New(0, 0);
+            next = pos + 2;
+        }
+        else
+        {
+            Py_UCS4 attr = PyUnicode_READ(kind, data, pos + 1);
+            if ((attr >= '0' && attr <= '9') || attr == '-')
+            {
+                Py_ssize_t end = PyUnicode_FindChar(text, '}', pos, len, 1);
+                if (end == -2)
+                    goto fail;
+                if (end == -1)
+                    end = len - 1;
+                code = PyUnicode_Substring(text, pos + 1, end);
+                next = end + 1;
+            }
+            else
+            {
+                if (attr >= 'A' && attr <= 'Z')
+                    attr += 'a' - 'A';
+                code = PyUnicode_FromOrdinal(attr);
+                next = pos + 2;
+            }
+        }
+        if (code == NULL)
+            goto fail;
+        chunk = PyUnicode_Substring(text, start, pos);
+        if (chunk == NULL)
+        {
+            Py_DECREF(code);
+            goto fail;
+        }
+        tmp = PyTuple_Pack(2, chunk, code);
+        Py_DECREF(chunk);
+        Py_DECREF(code);
+        if (tmp == NULL || PyList_Append(retlist, tmp) == -1)
+        {
+            Py_XDECREF(tmp);
+            goto fail;
+        }
+        Py_DECREF(tmp);
+        start = next;
+    }
+    /* We are at the end of the string, append the remaining text */
+    if (start > len)
+        start = len;
+    chunk = PyUnicode_Substring(text, start, len);
+    if (chunk == NULL)
+        goto fail;
+    tmp = PyTuple_Pack(2, chunk, Py_None);
+    Py_DECREF(chunk);
+    if (tmp == NULL || PyList_Append(retlist, tmp) == -1)
+    {
+        Py_XDECREF(tmp);
+        goto fail;
+    }
+    Py_DECREF(tmp);
+    return retlist;
+ fail:
+    Py_DECREF(retlist);
+    return NULL;
+}
+
 /***
     Module initialization. Just taken from the xxmodule.c template from the
     python sources.
@@ -417,8 +829,11 @@ static PyTypeObject Null_Type = {
 /* List of functions defined in the module */
 static PyMethodDef poopt_methods[] = {
   {"cut_text", poopt_cut_text, METH_VARARGS, poopt_cut_text_doc},
+  {"cut_text_attrs", poopt_cut_text_attrs, METH_VARARGS, poopt_cut_text_attrs_doc},
   {"wcswidth", poopt_wcswidth, METH_VARARGS, poopt_wcswidth_doc},
   {"cut_by_columns", poopt_cut_by_columns, METH_VARARGS, poopt_cut_by_columns_doc},
+  {"strip_attrs", poopt_strip_attrs, METH_VARARGS, poopt_strip_attrs_doc},
+  {"split_attrs", poopt_split_attrs, METH_VARARGS, poopt_split_attrs_doc},
   {}           /* sentinel */
 };
 
@@ -18,6 +18,7 @@ import logging
 import string
 import asyncio
 import time
+from itertools import islice
 from math import ceil, log10
 from datetime import datetime
 from xml.etree import ElementTree as ET
@@ -495,6 +496,9 @@ class ChatTab(Tab):
         self._jid = jid
         #: Is the tab currently requesting MAM data?
         self.query_status = False
+        #: Offset in the log file of the oldest message loaded from it
+        #: (None if nothing was loaded yet, 0 once the whole log was read)
+        self.log_offset = None  # type: Optional[int]
         self._name = jid.full  # type: Optional[str]
         self.text_win = windows.TextWin()
         self.directed_presence = None
@@ -574,14 +578,18 @@ class ChatTab(Tab):
     def general_jid(self) -> JID:
         raise NotImplementedError
 
+    @property
+    def log_name(self) -> str:
+        """Name of the log file of this tab"""
+        return self.jid.bare
+
     def log_message(self, message: BaseMessage, typ=1):
         """
         Log the messages in the archives.
         """
-        name = self.jid.bare
         if not isinstance(message, Message):
             return
-        if not logger.log_message(name, message.nickname, message.txt, date=message.time, typ=typ):
+        if not logger.log_message(self.log_name, message.nickname, message.txt, date=message.time, typ=typ):
             self.core.information('Unable to write in the log file', 'Error')
 
     def add_message(self, message: BaseMessage, typ=1):
@@ -611,7 +619,7 @@ class ChatTab(Tab):
         # build the list of the recent words
         char_we_dont_want = string.punctuation + ' ’„“”…«»'
         words = []
-        for msg in self._text_buffer.messages[:-40:-1]:
+        for msg in islice(reversed(self._text_buffer.messages), 39):
             if not msg:
                 continue
             txt = xhtml.clean_text(msg.txt)
@@ -800,8 +808,8 @@ class ChatTab(Tab):
         text_buffer = self._text_buffer
         built_lines = []
         message_count = 0
-        timestamp = config.get('show_timestamps')
-        nick_size = config.get('max_nick_length')
+        timestamp = config.get_bool('show_timestamps')
+        nick_size = config.get_int('max_nick_length')
         for message in text_buffer.messages:
             # Build lines of a message
             txt = message.txt
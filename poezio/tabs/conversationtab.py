@@ -261,17 +261,17 @@ class ConversationTab(OneToOneTab):
         log.debug('  TAB   Refresh: %s', self.__class__.__name__)
         display_bar = display_info_win = not self.size.tab_degrade_y
 
-        self.text_win.refresh()
+        self.text_win.refresh_if_changed()
 
         if display_bar:
-            self.upper_bar.refresh(self.get_dest_jid(),
-                                   roster[self.get_dest_jid()])
+            self.upper_bar.refresh_if_changed(self.get_dest_jid(),
+                                              roster[self.get_dest_jid()])
         self.get_info_header().refresh(
             self.get_dest_jid(), roster[self.get_dest_jid()], self.text_win,
             self.chatstate, ConversationTab.additional_information)
 
         if display_info_win:
-            self.info_win.refresh()
+            self.info_win.refresh_if_changed()
         self.refresh_tab_win()
         self.input.refresh()
 
@@ -321,6 +321,7 @@ class ConversationTab(OneToOneTab):
             if resource:
                 self.send_chat_state('inactive')
         self.check_scrolled()
+        self.text_win.make_lazy()
 
     def on_gain_focus(self):
         contact = roster[self.get_dest_jid()]
@@ -334,6 +335,7 @@ class ConversationTab(OneToOneTab):
             resource = None
 
         self.state = 'current'
+        self.text_win.build_pending()
         curses.curs_set(1)
         if (config.get_by_tabname('send_chat_states', self.general_jid)
                 and (not self.input.get_text()
@@ -418,15 +420,16 @@ class DynamicConversationTab(ConversationTab):
         log.debug('  TAB   Refresh: %s', self.__class__.__name__)
         display_bar = display_info_win = not self.size.tab_degrade_y
 
-        self.text_win.refresh()
+        self.text_win.refresh_if_changed()
         if display_bar:
-            self.upper_bar.refresh(self.jid.bare, roster[self.jid.bare])
+            self.upper_bar.refresh_if_changed(self.jid.bare,
+                                              roster[self.jid.bare])
         displayed_jid = self.jid.bare
         self.get_info_header().refresh(displayed_jid, roster[self.jid.bare],
                                        self.text_win, self.chatstate,
                                        ConversationTab.additional_information)
         if display_info_win:
-            self.info_win.refresh()
+            self.info_win.refresh_if_changed()
 
         self.refresh_tab_win()
         self.input.refresh()
@@ -8,7 +8,6 @@ user list, and updates private tabs when necessary.
 """
 
 import asyncio
-import bisect
 import curses
 import logging
 import asyncio
@@ -50,7 +49,7 @@ from poezio.decorators import refresh_wrapper, command_args_parser
 from poezio.logger import logger
 from poezio.roster import roster
 from poezio.theming import get_theme, dump_tuple
-from poezio.user import User
+from poezio.user import Occupants, User
 from poezio.core.structs import Completion, Status
 from poezio.ui.types import (
     BaseMessage,
@@ -70,7 +69,8 @@ log = logging.getLogger(__name__)
 NS_MUC_USER = 'http://jabber.org/protocol/muc#user'
 STATUS_XPATH = '{%s}x/{%s}status' % (NS_MUC_USER, NS_MUC_USER)
 
-COMPARE_USERS_LAST_TALKED = lambda x: x.last_talked
+# Number of nicks listed in the message summing up a batch of joins or parts
+JOIN_PART_SUMMARY_NICKS = 10
 
 
 class MucTab(ChatTab):
@@ -93,14 +93,20 @@ class MucTab(ChatTab):
         # self User object
         self.own_user = None  # type: Optional[User]
         self.password = password
-        # buffered presences
+        # buffered presences, and the event processing them
         self.presence_buffer = []  # type: List[Presence]
+        self.presence_batch_handle = None  # type: Optional[asyncio.Handle]
+        # join and part messages of the presences being processed
+        self.join_part_batch = None  # type: Optional[List[Tuple[str, str, str, bool]]]
         # userlist
-        self.users = []  # type: List[User]
+        self.users = Occupants()
         # private conversations
         self.privates = []  # type: List[Tab]
         self.topic = ''
         self.topic_from = ''
+        # the regex finding highlights, with the nick and the highlight_on
+        # option it was built from
+        self.highlight_regex = None  # type: Optional[Tuple[Tuple[str, str], Pattern]]
         # Self ping event, so we can cancel it when we leave the room
         self.self_ping_event = None  # type: Optional[timed_events.DelayedEvent]
         # UI stuff
@@ -255,7 +261,7 @@ class MucTab(ChatTab):
                 'The affiliation must be one of ' +
                 ', '.join(valid_affiliations), 'Error')
             return
-        if nick_or_jid in [user.nick for user in self.users]:
+        if self.users.get(nick_or_jid) is not None:
             muc.set_user_affiliation(
                 self.core.xmpp,
                 self.jid.bare,
@@ -379,7 +385,7 @@ class MucTab(ChatTab):
             return
         # Sort the user list by last talked, to avoid color conflicts
         # on active participants
-        sorted_users = sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True)
+        sorted_users = list(self.users.by_last_talked())
         full_sorted_users = sorted_users[:]
         # search our own user, to remove it from the list
         # Also remove users whose color is fixed
@@ -468,9 +474,11 @@ class MucTab(ChatTab):
         if config.get_by_tabname('send_chat_states', self.general_jid):
             self.send_chat_state('inactive')
         self.check_scrolled()
+        self.text_win.make_lazy()
 
     def on_gain_focus(self) -> None:
         self.state = 'current'
+        self.text_win.build_pending()
         if (self.text_win.built_lines and self.text_win.built_lines[-1] is None
                 and not config.get('show_useless_separator')):
             self.text_win.remove_line_separator()
@@ -481,57 +489,112 @@ class MucTab(ChatTab):
             self.send_chat_state('active')
 
     def handle_presence(self, presence: Presence) -> None:
-        """Handle MUC presence"""
+        """
+        Handle MUC presence: they are buffered, and processed together
+        muc_presence_batch_delay seconds after the first one, or as soon as
+        our own presence is received when joining
+        """
         self.reset_lag()
-        status_codes = set()
-        for status_code in presence.xml.findall(STATUS_XPATH):
-            status_codes.add(status_code.attrib['code'])
         if presence['type'] == 'error':
+            self.process_presence_buffer()
             self.core.room_error(presence, self.jid.bare)
-        elif not self.joined:
-            own = '110' in status_codes
-            if own or len(self.presence_buffer) >= 10:
-                self.process_presence_buffer(presence, own)
-            else:
-                self.presence_buffer.append(presence)
-                return
-        else:
-            try:
-                self.handle_presence_joined(presence, status_codes)
-            except PresenceError:
-                self.core.room_error(presence, presence['from'].bare)
+            if self.core.tabs.current_tab is self:
+                self.core.schedule_refresh()
+            return
+        self.presence_buffer.append(presence)
+        delay = config.get('muc_presence_batch_delay')
+        if delay <= 0 or (not self.joined and '110' in get_status_codes(presence)):
+            self.process_presence_buffer()
+        elif self.presence_batch_handle is None:
+            self.presence_batch_handle = asyncio.get_event_loop().call_later(
+                delay, self.process_presence_buffer)
+
+    def process_presence_buffer(self) -> None:
+        """
+        Batch-process all the buffered presences, with a single message
+        for the users who joined or left the room, and a single refresh
+        """
+        if self.presence_batch_handle is not None:
+            self.presence_batch_handle.cancel()
+            self.presence_batch_handle = None
+        buffer = self.presence_buffer
+        if not buffer:
+            return
+        self.presence_buffer = []
+        deterministic = config.get_by_tabname('deterministic_nick_colors',
+                                              self.jid.bare)
+        was_joined = self.joined
+        self.join_part_batch = []
+        try:
+            for stanza in buffer:
+                status_codes = get_status_codes(stanza)
+                try:
+                    if self.joined:
+                        self.handle_presence_joined(stanza, status_codes)
+                    else:
+                        self.handle_presence_unjoined(
+                            stanza, deterministic, '110' in status_codes)
+                except PresenceError:
+                    self.core.room_error(stanza, stanza['from'].bare)
+        finally:
+            batch, self.join_part_batch = self.join_part_batch, None
+        self.add_join_part_summary(batch)
+        if self.joined and not was_joined:
+            # Enable the self ping event, to regularly check if we
+            # are still in the room.
+            self.enable_self_ping_event()
+            if self.core.tabs.current_tab is not self:
+                self.refresh_tab_win()
+                self.core.tabs.current_tab.refresh_input()
+                self.core.doupdate()
         if self.core.tabs.current_tab is self:
-            self.text_win.refresh()
-            self.user_win.refresh_if_changed(self.users)
-            self.info_header.refresh(
-                self, self.text_win, user=self.own_user,
-                information=MucTab.additional_information)
-            self.input.refresh()
-            self.core.doupdate()
+            self.core.schedule_refresh()
 
-    def process_presence_buffer(self, last_presence: Presence, own: bool) -> None:
+    def add_join_part_message(self, msg: str, nick: str, color: str,
+                              joined: bool) -> None:
         """
-        Batch-process all the initial presences
+        Add a join or part message, or keep it for the summary of the
+        presences being processed
         """
-        deterministic = config.get_by_tabname('deterministic_nick_colors',
-                                              self.jid.bare)
+        if self.join_part_batch is None:
+            self.add_message(InfoMessage(msg), typ=2)
+        else:
+            self.join_part_batch.append((msg, nick, color, joined))
 
-        for stanza in self.presence_buffer:
-            try:
-                self.handle_presence_unjoined(stanza, deterministic)
-            except PresenceError:
-                self.core.room_error(stanza, stanza['from'].bare)
-        self.presence_buffer = []
-        self.handle_presence_unjoined(last_presence, deterministic, own)
-        self.users.sort()
-        # Enable the self ping event, to regularly check if we
-        # are still in the room.
-        if own:
-            self.enable_self_ping_event()
-        if self.core.tabs.current_tab is not self:
-            self.refresh_tab_win()
-            self.core.tabs.current_tab.refresh_input()
-            self.core.doupdate()
+    def add_join_part_summary(self,
+                              batch: List[Tuple[str, str, str, bool]]) -> None:
+        """
+        Add the join and part messages of a batch of presences, in a single
+        message if there are several of them
+        """
+        if not batch:
+            return
+        if len(batch) == 1:
+            self.add_message(InfoMessage(batch[0][0]), typ=2)
+            return
+        theme = get_theme()
+        info_col = dump_tuple(theme.COLOR_INFORMATION_TEXT)
+        lines = []
+        for joined in (True, False):
+            nicks = [(nick, color) for _, nick, color, j in batch if j is joined]
+            if not nicks:
+                continue
+            names = ', '.join(
+                '\x19%s}%s\x19%s}' % (color, nick, info_col)
+                for nick, color in nicks[:JOIN_PART_SUMMARY_NICKS])
+            if len(nicks) > JOIN_PART_SUMMARY_NICKS:
+                names += ' and %d others' % (
+                    len(nicks) - JOIN_PART_SUMMARY_NICKS)
+            if joined:
+                spec_col = dump_tuple(theme.COLOR_JOIN_CHAR)
+                spec = theme.CHAR_JOIN
+                action = 'joined the room'
+            else:
+                spec_col = dump_tuple(theme.COLOR_QUIT_CHAR)
+                spec = theme.CHAR_QUIT
+                action = 'left the room'
+            lines.append('\x19%s}%s %s %s' % (spec_col, spec, names, action))
+        self.add_message(InfoMessage('\n'.join(lines)), typ=2)
 
     def handle_presence_unjoined(self, presence: Presence, deterministic: bool, own: bool = False) -> None:
         """
@@ -547,13 +610,10 @@ class MucTab(ChatTab):
         user_color = self.search_for_color(from_nick)
         new_user = User(from_nick, affiliation, show, status, role, jid,
                         deterministic, user_color)
-        self.users.append(new_user)
+        self.users.add(new_user)
         self.core.events.trigger('muc_join', presence, self)
         if own:
-            status_codes = set()
-            for status_code in presence.xml.findall(STATUS_XPATH):
-                status_codes.add(status_code.attrib['code'])
-            self.own_join(from_nick, new_user, status_codes)
+            self.own_join(from_nick, new_user, get_status_codes(presence))
 
     def own_join(self, from_nick: str, new_user: User, status_codes: Set[str]) -> None:
         """
@@ -702,7 +762,7 @@ class MucTab(ChatTab):
                                               self.jid.bare)
         user = User(from_nick, affiliation, show, status, role, jid,
                     deterministic, color)
-        bisect.insort_left(self.users, user)
+        self.users.add(user)
         hide_exit_join = config.get_by_tabname('hide_exit_join',
                                                self.general_jid)
         if hide_exit_join != 0:
@@ -736,13 +796,14 @@ class MucTab(ChatTab):
                            'jid_color': dump_tuple(theme.COLOR_MUC_JID),
                            'color_spec': spec_col,
                        }
-            self.add_message(InfoMessage(msg), typ=2)
+            self.add_join_part_message(msg, from_nick, color, joined=True)
         self.core.on_user_rejoined_private_conversation(self.jid.bare, from_nick)
 
     def on_user_nick_change(self, presence: Presence, user: User, from_nick: str) -> None:
         new_nick = presence.xml.find(
             '{%s}x/{%s}item' % (NS_MUC_USER, NS_MUC_USER)).attrib['nick']
         old_color = user.color
+        self.users.remove(user)
         if user.nick == self.own_nick:
             self.own_nick = new_nick
             # also change our nick in all private discussions of this room
@@ -755,8 +816,7 @@ class MucTab(ChatTab):
             color = config.get_by_tabname(new_nick, 'muc_colors') or None
             if color or deterministic:
                 user.change_color(color, deterministic)
-        self.users.remove(user)
-        bisect.insort_left(self.users, user)
+        self.users.add(user)
 
         if config.get_by_tabname('display_user_color_in_join_part',
                                  self.general_jid):
@@ -1006,7 +1066,8 @@ class MucTab(ChatTab):
                              }
             if status:
                 leave_msg += ' (\x19o%s\x19%s})' % (status, info_col)
-            self.add_message(InfoMessage(leave_msg), typ=2)
+            self.add_join_part_message(leave_msg, from_nick, color,
+                                       joined=False)
         self.core.on_user_left_private_conversation(from_room, user, status)
 
     def on_user_change_status(self, user: User, from_nick: str, from_room: str, affiliation: str,
@@ -1071,7 +1132,7 @@ class MucTab(ChatTab):
         self.users.remove(user)
         # finally, effectively change the user status
         user.update(affiliation, show, status, role)
-        bisect.insort_left(self.users, user)
+        self.users.add(user)
 
     def disconnect(self) -> None:
         """
@@ -1079,7 +1140,10 @@ class MucTab(ChatTab):
         we can know if we can join it, send messages to it, etc
         """
         self.presence_buffer = []
-        self.users = []
+        if self.presence_batch_handle is not None:
+            self.presence_batch_handle.cancel()
+            self.presence_batch_handle = None
+        self.users.clear()
         if self is not self.core.tabs.current_tab:
             self.state = 'disconnected'
         self.joined = False
@@ -1099,7 +1163,7 @@ class MucTab(ChatTab):
         if not isinstance(msg, Message):
             return
         if not msg.history and self.joined and msg.nickname and msg.txt:  # don't log the history messages
-            if not logger.log_message(self.jid.bare, msg.nickname, msg.txt, typ=typ):
+            if not logger.log_message(self.log_name, msg.nickname, msg.txt, typ=typ):
                 self.core.information('Unable to write in the log file',
                                       'Error')
 
@@ -1107,10 +1171,7 @@ class MucTab(ChatTab):
         """
         Gets the user associated with the given nick, or None if not found
         """
-        for user in self.users:
-            if user.nick == nick:
-                return user
-        return None
+        return self.users.get(nick)
 
     def add_message(self, msg: BaseMessage, typ: int = 1) -> None:
         """Add a message to the text buffer and set various tab status"""
@@ -1121,7 +1182,7 @@ class MucTab(ChatTab):
         if not isinstance(msg, Message):
             return
         if msg.user:
-            msg.user.set_last_talked(msg.time)
+            self.users.set_last_talked(msg.user, msg.time)
         if config.get_by_tabname('notify_messages', self.jid.bare) and self.state != 'current':
             if msg.nickname != self.own_nick and not msg.history:
                 self.state = 'message'
@@ -1189,7 +1250,7 @@ class MucTab(ChatTab):
         if iq["type"] == "error" and iq["error"]["condition"] not in \
                 ("feature-not-implemented", "service-unavailable", "item-not-found"):
             self.command_cycle(iq["error"]["text"] or "not in this room")
-            self.core.refresh_window()
+            self.core.schedule_refresh()
         else:  # Re-send a self-ping in a few seconds
             self.reset_lag()
             self.enable_self_ping_event()
@@ -1219,7 +1280,7 @@ class MucTab(ChatTab):
                 ),
             )
             self._state = 'disconnected'
-            self.core.refresh_window()
+            self.core.schedule_refresh()
         self.enable_self_ping_event()
 
     def reset_lag(self) -> None:
@@ -1232,7 +1293,7 @@ class MucTab(ChatTab):
                 self._state = 'joined'
             else:
                 self._state = 'normal'
-            self.core.refresh_window()
+            self.core.schedule_refresh()
 
 ########################## UI ONLY #####################################
 
@@ -1306,17 +1367,17 @@ class MucTab(ChatTab):
             display_user_list = True
         display_info_win = not self.size.tab_degrade_y
 
-        self.topic_win.refresh(self.get_single_line_topic())
-        self.text_win.refresh()
+        self.topic_win.refresh_if_changed(self.get_single_line_topic())
+        self.text_win.refresh_if_changed()
         if display_user_list:
-            self.v_separator.refresh()
-            self.user_win.refresh(self.users)
+            self.v_separator.refresh_if_changed()
+            self.user_win.refresh_if_changed(self.users)
         self.info_header.refresh(
             self, self.text_win, user=self.own_user,
             information=MucTab.additional_information)
         self.refresh_tab_win()
         if display_info_win:
-            self.info_win.refresh()
+            self.info_win.refresh_if_changed()
         self.input.refresh()
 
     def on_info_win_size_changed(self) -> None:
@@ -1340,11 +1401,17 @@ class MucTab(ChatTab):
             1, self.width, self.height - 2 - self.core.information_win_size -
             Tab.tab_win_height(), 0)
 
-    # This maxsize is kinda arbitrary, but most users won’t have that many
-    # nicknames anyway.
-    @functools.lru_cache(maxsize=8)
-    def build_highlight_regex(self, nickname: str) -> Pattern:
-        return re.compile(r"(^|\W)" + re.escape(nickname) + r"(\W|$)", re.I)
+    def get_highlight_regex(self) -> Pattern:
+        """
+        Return the regex matching the messages that highlight us, compiled
+        again only when our nick or highlight_on changes
+        """
+        highlight_on = config.get_by_tabname('highlight_on', self.general_jid)
+        key = (self.own_nick, highlight_on)
+        if self.highlight_regex is None or self.highlight_regex[0] != key:
+            self.highlight_regex = (
+                key, common.build_highlight_regex(self.own_nick, highlight_on))
+        return self.highlight_regex[1]
 
     def message_is_highlight(self, txt: str, nickname: Optional[str], history: bool,
                              corrected: bool = False) -> bool:
@@ -1352,20 +1419,9 @@ class MucTab(ChatTab):
         # Don't highlight on info message or our own messages
         if not nickname or nickname == self.own_nick:
             return False
-        highlight_on = config.get_by_tabname(
-            'highlight_on',
-            self.general_jid,
-        ).split(':')
-        highlighted = False
-        if not history:
-            if self.build_highlight_regex(self.own_nick).search(txt):
-                highlighted = True
-            else:
-                for word in highlight_on:
-                    if word and word.lower() in txt.lower():
-                        highlighted = True
-                        break
-        return highlighted
+        if history:
+            return False
+        return self.get_highlight_regex().search(txt) is not None
 
     def do_highlight(self, txt: str, nickname: str, history: bool,
                      corrected: bool = False) -> bool:
@@ -1469,7 +1525,7 @@ class MucTab(ChatTab):
             return
         nick = args[0]
         try:
-            if nick in [user.nick for user in self.users]:
+            if self.users.get(nick) is not None:
                 jid = copy(self.jid)
                 jid.resource = nick
             else:
@@ -1828,11 +1884,16 @@ class MucTab(ChatTab):
             return
 
         # If we are not completing a command or a command argument,
-        # complete a nick
-        word_list = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
-            if user.nick != self.own_nick:
-                word_list.append(user.nick)
+        # complete a nick.  The input ignores the words when cycling through
+        # the nicks it already completed.
+        if self.input.last_completion:
+            word_list = []  # type: List[str]
+        else:
+            word_list = [
+                nick for nick in self.users.nicks_by_last_talked(
+                    self.input.get_completion_prefix())
+                if nick != self.own_nick
+            ]
         after = cast(str, config.get('after_completion')) + ' '
         input_pos = self.input.pos
         if ' ' not in self.input.get_text()[:input_pos] or (
@@ -1853,10 +1914,10 @@ class MucTab(ChatTab):
 
     def completion_version(self, the_input: windows.MessageInput) -> Completion:
         """Completion for /version"""
-        userlist = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
-            if user.nick != self.own_nick:
-                userlist.append(user.nick)
+        userlist = [
+            nick for nick in self.users.nicks_by_last_talked()
+            if nick != self.own_nick
+        ]
         comp = []
         for jid in (jid for jid in roster.jids() if len(roster[jid])):
             for resource in roster[jid].resources:
@@ -1868,9 +1929,7 @@ class MucTab(ChatTab):
 
     def completion_info(self, the_input: windows.MessageInput) -> Completion:
         """Completion for /info"""
-        userlist = []
-        for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
-            userlist.append(user.nick)
+        userlist = self.users.nicks_by_last_talked()
         return Completion(the_input.auto_completion, userlist, quotify=False)
 
     def completion_nick(self, the_input: windows.MessageInput) -> Completion:
@@ -1972,10 +2031,10 @@ class MucTab(ChatTab):
     def completion_quoted(self, the_input: windows.MessageInput) -> Optional[Completion]:
         """Nick completion, but with quotes"""
         if the_input.get_argument_position(quoted=True) == 1:
-            word_list = []
-            for user in sorted(self.users, key=COMPARE_USERS_LAST_TALKED, reverse=True):
-                if user.nick != self.own_nick:
-                    word_list.append(user.nick)
+            word_list = [
+                nick for nick in self.users.nicks_by_last_talked()
+                if nick != self.own_nick
+            ]
 
             return Completion(
                 the_input.new_completion, word_list, 1, quotify=True)
@@ -2280,3 +2339,13 @@ def dissect_presence(presence: Presence) -> Tuple[str, str, str, str, str, str,
     jid = presence['muc']['jid']
     typ = presence['type']
     return from_nick, from_room, affiliation, show, status, role, jid, typ
+
+
+def get_status_codes(presence: Presence) -> Set[str]:
+    """
+    Extract the MUC status codes of a presence
+    """
+    return {
+        status_code.attrib['code']
+        for status_code in presence.xml.findall(STATUS_XPATH)
+    }
@@ -105,6 +105,10 @@ class PrivateTab(OneToOneTab):
     def remove_information_element(plugin_name):
         del PrivateTab.additional_information[plugin_name]
 
+    @property
+    def log_name(self) -> str:
+        return self.jid.full
+
     def log_message(self, msg: BaseMessage, typ=1):
         """
         Log the messages in the archives.
@@ -112,7 +116,7 @@ class PrivateTab(OneToOneTab):
         if not isinstance(msg, Message):
             return
         if not logger.log_message(
-                self.jid.full, msg.nickname, msg.txt, date=msg.time, typ=typ):
+                self.log_name, msg.nickname, msg.txt, date=msg.time, typ=typ):
             self.core.information('Unable to write in the log file', 'Error')
 
     def on_close(self):
@@ -127,9 +131,12 @@ class PrivateTab(OneToOneTab):
             return
 
         # If we are not completing a command or a command's argument, complete a nick
-        compare_users = lambda x: x.last_talked
-        word_list = [user.nick for user in sorted(self.parent_muc.users, key=compare_users, reverse=True)\
-                         if user.nick != self.own_nick]
+        if self.input.last_completion:
+            word_list = []
+        else:
+            word_list = [nick for nick in self.parent_muc.users.nicks_by_last_talked(
+                             self.input.get_completion_prefix())
+                         if nick != self.own_nick]
         after = config.get('after_completion') + ' '
         input_pos = self.input.pos
         if ' ' not in self.input.get_text()[:input_pos] or (self.input.last_completion and\
@@ -279,9 +286,11 @@ class PrivateTab(OneToOneTab):
                 'send_chat_states', self.general_jid) and self.on:
             self.send_chat_state('inactive')
         self.check_scrolled()
+        self.text_win.make_lazy()
 
     def on_gain_focus(self):
         self.state = 'current'
+        self.text_win.build_pending()
         curses.curs_set(1)
         tab = self.core.tabs.by_name_and_class(self.jid.bare, MucTab)
         if tab and tab.joined and config.get_by_tabname(
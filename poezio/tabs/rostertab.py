@@ -867,17 +867,17 @@ class RosterInfoTab(Tab):
         display_info = not self.size.tab_degrade_x
         display_contact_win = not self.size.tab_degrade_y
 
-        self.roster_win.refresh(roster)
+        self.roster_win.refresh_if_changed(roster)
         if display_info:
-            self.v_separator.refresh()
-            self.information_win.refresh()
+            self.v_separator.refresh_if_changed()
+            self.information_win.refresh_if_changed()
             if display_contact_win:
                 row = self.roster_win.get_selected_row()
                 self.contact_info_win.refresh(row)
                 if isinstance(row, Contact):
-                    self.avatar_win.refresh(row.avatar)
+                    self.avatar_win.refresh_if_changed(row.avatar)
                 else:
-                    self.avatar_win.refresh(None)
+                    self.avatar_win.refresh_if_changed(None)
         self.refresh_tab_win()
         self.input.refresh()
 
@@ -146,7 +146,7 @@ class XMLTab(Tab):
 
     def update_filters(self, matcher):
         if not self.filters:
-            messages = self.core_buffer.messages[:]
+            messages = list(self.core_buffer.messages)
             self.filtered_buffer.messages = []
             self.core_buffer.del_window(self.text_win)
             self.filtered_buffer.add_window(self.text_win)
@@ -258,9 +258,9 @@ class XMLTab(Tab):
         if args is None:
             return self.core.command.help('dump')
         if self.filters:
-            xml = self.filtered_buffer.messages[:]
+            xml = list(self.filtered_buffer.messages)
         else:
-            xml = self.core_buffer.messages[:]
+            xml = list(self.core_buffer.messages)
         text = '\n'.join(
             ('%s %s %s' % (
                 msg.time.strftime('%H:%M:%S'),
@@ -366,9 +366,11 @@ class XMLTab(Tab):
 
     def on_lose_focus(self):
         self.state = 'normal'
+        self.text_win.make_lazy()
 
     def on_gain_focus(self):
         self.state = 'current'
+        self.text_win.build_pending()
         curses.curs_set(0)
 
     def on_close(self):
@@ -11,9 +11,12 @@ independently by their TextWins.
 import logging
 log = logging.getLogger(__name__)
 
+from collections import deque
 from typing import (
     cast,
+    Deque,
     Dict,
+    Iterable,
     List,
     Optional,
     TYPE_CHECKING,
@@ -54,8 +57,11 @@ class HistoryGap:
 
 class TextBuffer:
     """
-    This class just keep trace of messages, in a list with various
+    This class just keep trace of messages, in a ring buffer with various
     information and attributes.
+
+    Messages are kept in a deque, and indexed by identifier so that
+    corrections and receipts do not have to walk the whole buffer.
     """
 
     def __init__(self, messages_nb_limit: Optional[int] = None) -> None:
@@ -64,7 +70,13 @@ class TextBuffer:
             messages_nb_limit = cast(int, config.get('max_messages_in_memory'))
         self._messages_nb_limit = messages_nb_limit  # type: int
         # Message objects
-        self.messages = []  # type: List[BaseMessage]
+        self._messages = deque()  # type: Deque[BaseMessage]
+        # Absolute position of self._messages[0]; it increases every time
+        # a message is evicted, so that the positions stored in
+        # self._ids stay valid without renumbering.
+        self._first_pos = 0
+        # Message id -> absolute position of the last message with that id
+        self._ids = {}  # type: Dict[str, int]
         # COMPAT: Correction id -> Original message id.
         self.correction_ids = {}  # type: Dict[str, str]
         # we keep track of one or more windows
@@ -75,19 +87,46 @@ class TextBuffer:
     def add_window(self, win) -> None:
         self._windows.append(win)
 
+    @property
+    def messages(self) -> Deque[BaseMessage]:
+        return self._messages
+
+    @messages.setter
+    def messages(self, messages: Iterable[BaseMessage]) -> None:
+        self._messages = deque(messages)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        """Rebuild the identifier index from scratch"""
+        self._first_pos = 0
+        self._ids = {
+            msg.identifier: pos
+            for pos, msg in enumerate(self._messages)
+            if msg.identifier
+        }
+
+    def _evict(self) -> None:
+        """Remove the oldest message of the buffer"""
+        msg = self._messages.popleft()
+        if msg.identifier and self._ids.get(msg.identifier) == self._first_pos:
+            del self._ids[msg.identifier]
+        self._first_pos += 1
+
     def find_last_gap_muc(self) -> Optional[HistoryGap]:
         """Find the last known history gap contained in buffer"""
+        # deque indexing is linear in the middle, work on a list instead
+        messages = list(self._messages)
         leave = None  # type:Optional[Tuple[int, BaseMessage]]
         join = None  # type:Optional[Tuple[int, BaseMessage]]
-        for i, item in enumerate(reversed(self.messages)):
+        for i, item in enumerate(reversed(messages)):
             if isinstance(item, MucOwnLeaveMessage):
-                leave = (len(self.messages) - i - 1, item)
+                leave = (len(messages) - i - 1, item)
                 break
             elif join and isinstance(item, MucOwnJoinMessage):
-                leave = (len(self.messages) - i - 1, item)
+                leave = (len(messages) - i - 1, item)
                 break
             if isinstance(item, MucOwnJoinMessage):
-                join = (len(self.messages) - i - 1, item)
+                join = (len(messages) - i - 1, item)
 
         last_timestamp = None
         first_timestamp = datetime.now()
@@ -97,18 +136,18 @@ class TextBuffer:
         # having two joins with no leave, and messages in the middle.
         if leave and join and isinstance(leave[1], MucOwnJoinMessage):
             for i in range(join[0] - 1, leave[0], - 1):
-                if isinstance(self.messages[i], Message):
+                if isinstance(messages[i], Message):
                     leave = (
                         i,
-                        self.messages[i]
+                        messages[i]
                     )
-                    last_timestamp = self.messages[i].time
+                    last_timestamp = messages[i].time
                     break
         # If we have a normal gap but messages inbetween, it probably
         # already has history, so abort there without returning it.
         if join and leave:
             for i in range(leave[0] + 1, join[0], 1):
-                if isinstance(self.messages[i], Message):
+                if isinstance(messages[i], Message):
                     return None
         elif not (join or leave):
             return None
@@ -120,8 +159,8 @@ class TextBuffer:
         elif last_timestamp is None:
             leave_msg = leave[1]
             for i in range(leave[0], 0, -1):
-                if isinstance(self.messages[i], Message):
-                    last_timestamp = self.messages[i].time
+                if isinstance(messages[i], Message):
+                    last_timestamp = messages[i].time
                     break
         else:
             leave_msg = leave[1]
@@ -131,8 +170,8 @@ class TextBuffer:
             join_msg = None
         else:
             join_msg = join[1]
-            for i in range(join[0], len(self.messages)):
-                msg = self.messages[i]
+            for i in range(join[0], len(messages)):
+                msg = messages[i]
                 if isinstance(msg, Message) and msg.time < first_timestamp:
                     first_timestamp = msg.time
                     break
@@ -147,7 +186,7 @@ class TextBuffer:
         """Find the first index to insert into inside a gap"""
         if gap.leave_message is None:
             return 0
-        for i, msg in enumerate(self.messages):
+        for i, msg in enumerate(self._messages):
             if msg is gap.leave_message:
                 return i + 1
         return None
@@ -161,25 +200,29 @@ class TextBuffer:
             if new_index is None:  # Not sure what happened, abort
                 return
             index = new_index
+        first_index = index
         for message in messages:
-            self.messages.insert(index, message)
+            self._messages.insert(index, message)
             index += 1
             log.debug('inserted message: %s', message)
+        self._reindex()
         for window in self._windows:  # make the associated windows
-            window.rebuild_everything(self)
+            window.insert_history(self, first_index, len(messages))
 
     @property
     def last_message(self) -> Optional[BaseMessage]:
-        return self.messages[-1] if self.messages else None
+        return self._messages[-1] if self._messages else None
 
     def add_message(self, msg: BaseMessage):
         """
         Create a message and add it to the text buffer
         """
-        self.messages.append(msg)
+        if msg.identifier:
+            self._ids[msg.identifier] = self._first_pos + len(self._messages)
+        self._messages.append(msg)
 
-        while len(self.messages) > self._messages_nb_limit:
-            self.messages.pop(0)
+        while len(self._messages) > self._messages_nb_limit:
+            self._evict()
 
         ret_val = 0
         show_timestamps = cast(bool, config.get('show_timestamps'))
@@ -189,10 +232,13 @@ class TextBuffer:
             nb = window.build_new_message(
                 msg,
                 timestamp=show_timestamps,
-                nick_size=nick_size)
+                nick_size=nick_size,
+                room=self)
             if ret_val == 0:
                 ret_val = nb
-            if window.pos != 0:
+            # nothing is built by a lazy window, which will keep its
+            # position when building its pending messages
+            if nb and window.pos != 0:
                 window.scroll_up(nb)
 
         return min(ret_val, 1)
@@ -206,11 +252,10 @@ class TextBuffer:
         # of the corresponding id for the original message instead.
         orig_id = self.correction_ids.get(orig_id, orig_id)
 
-        for i in range(len(self.messages) - 1, -1, -1):
-            msg = self.messages[i]
-            if msg.identifier == orig_id:
-                return (orig_id, i)
-        return (orig_id, -1)
+        pos = self._ids.get(orig_id)
+        if pos is None:
+            return (orig_id, -1)
+        return (orig_id, pos - self._first_pos)
 
     def ack_message(self, old_id: str, jid: str) -> Union[None, bool, Message]:
         """Mark a message as acked"""
@@ -230,7 +275,7 @@ class TextBuffer:
         _, i = self._find_message(old_id)
         if i == -1:
             return None
-        msg = self.messages[i]
+        msg = self._messages[i]
         if not isinstance(msg, Message):
             return None
         if msg.ack == 1:  # Message was already acked
@@ -242,6 +287,7 @@ class TextBuffer:
         msg.ack = value
         if append:
             msg.txt += append
+        msg.layout_revision += 1
         return msg
 
     def modify_message(self,
@@ -269,7 +315,7 @@ class TextBuffer:
                 orig_id)
             raise CorrectionError("nothing to replace")
 
-        msg = self.messages[i]
+        msg = self._messages[i]
         if not isinstance(msg, Message):
             raise CorrectionError('Wrong message type')
         if msg.user and msg.user is not user:
@@ -299,7 +345,7 @@ class TextBuffer:
             old_message=msg,
             revisions=msg.revisions + 1,
             jid=jid)
-        self.messages[i] = message
+        self._messages[i] = message
         log.debug('Replacing message %s with %s.', orig_id, new_id)
         return message
 
@@ -308,11 +354,11 @@ class TextBuffer:
 
     def find_last_message(self) -> Optional[Message]:
         """Find the last real message received in this buffer"""
-        for message in reversed(self.messages):
+        for message in reversed(self._messages):
             if isinstance(message, Message):
                 return message
         return None
 
     def __del__(self):
-        size = len(self.messages)
+        size = len(self._messages)
         log.debug('** Deleting %s messages from textbuffer', size)
@@ -72,8 +72,8 @@ except ImportError:
         raise
 
 import curses
-import functools
 import os
+from collections import OrderedDict
 from typing import Dict, List, Union, Tuple, Optional
 from pathlib import Path
 from os import path
@@ -380,12 +380,73 @@ class Theme:
 # This is the default theme object, used if no theme is defined in the conf
 theme = Theme()
 
-# a dict "color tuple -> color_pair"
-# Each time we use a color tuple, we check if it has already been used.
-# If not we create a new color_pair and keep it in that dict, to use it
-# the next time.
-curses_colors_dict = {
-}  # type: Dict[Union[Tuple[int, int], Tuple[int, int, str]], int]
+
+class ColorPairs:
+    """
+    The curses color pairs of the (foreground, background) couples in use.
+
+    Each time we use a couple, we check if it already has a pair. If not we
+    create a new one, or reuse the least recently used pair once
+    max_color_pairs (or the number of pairs curses can address) are
+    allocated.
+    """
+
+    def __init__(self) -> None:
+        self.pairs = OrderedDict()  # type: OrderedDict[Tuple[int, int], int]
+        # Incremented when a pair is given to other colors: the attributes
+        # computed before may now display differently.
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def limit() -> int:
+        """The maximum number of pairs in use"""
+        # color_pair() stores the pair number in the A_COLOR bits
+        limit = min(curses.A_COLOR >> 8,
+                    getattr(curses, 'COLOR_PAIRS', 256) - 1)
+        wanted = config.get('max_color_pairs')
+        if 0 < wanted < limit:
+            return wanted
+        return limit
+
+    def get(self, colors: Tuple[int, int]) -> int:
+        """Return the number of the pair displaying these colors"""
+        pairs = self.pairs
+        pair = pairs.get(colors)
+        if pair is not None:
+            self.hits += 1
+            pairs.move_to_end(colors)
+            return pair
+        self.misses += 1
+        if len(pairs) < self.limit():
+            pair = len(pairs) + 1
+        else:
+            _, pair = pairs.popitem(last=False)
+            self.evictions += 1
+            self.generation += 1
+        curses.init_pair(pair, colors[0], colors[1])
+        pairs[colors] = pair
+        return pair
+
+    def clear(self) -> None:
+        """Forget all the pairs (e.g. when the theme changes)"""
+        self.pairs.clear()
+        self.generation += 1
+
+    def stats(self) -> str:
+        return ('%s/%s color pairs used, %s hits, %s misses, %s evictions' %
+                (len(self.pairs), self.limit(), self.hits, self.misses,
+                 self.evictions))
+
+
+color_pairs = ColorPairs()
+
+# a dict "color tuple -> (curses colors, additional attributes)", to
+# only parse each color tuple once
+parsed_color_tuples = {
+}  # type: Dict[Union[Tuple[int, int], Tuple[int, int, str]], Tuple[Tuple[int, int], int]]
 
 # yapf: disable
 
@@ -434,12 +495,12 @@ def read_tuple(_str: str) -> Tuple[Tuple[int, int], str]:
     return (int(attrs[0]), int(attrs[1])), char
 
 
-@functools.lru_cache(maxsize=128)
-def to_curses_attr(
-        color_tuple: Union[Tuple[int, int], Tuple[int, int, str]]) -> int:
+def parse_color_tuple(
+        color_tuple: Union[Tuple[int, int], Tuple[int, int, str]]
+) -> Tuple[Tuple[int, int], int]:
     """
-    Takes a color tuple (as defined at the top of this file) and
-    returns a valid curses attr that can be passed directly to attron() or attroff()
+    Takes a color tuple (as defined at the top of this file) and returns
+    the colors of its pair, and the attributes to add to it.
     """
     # extract the color from that tuple
     if len(color_tuple) == 3:
@@ -458,26 +519,33 @@ def to_curses_attr(
         if colors[1] >= 8:
             colors = (colors[0], colors[1] - 8)
 
-    # check if we already used these colors
-    try:
-        pair = curses_colors_dict[colors]
-    except KeyError:
-        pair = len(curses_colors_dict) + 1
-        curses.init_pair(pair, colors[0], colors[1])
-        curses_colors_dict[colors] = pair
-    curses_pair = curses.color_pair(pair)
+    attrs = 0
     if len(color_tuple) == 3:
         additional_val = color_tuple[2]
         if 'b' in additional_val or bold is True:
-            curses_pair = curses_pair | curses.A_BOLD
+            attrs |= curses.A_BOLD
         if 'u' in additional_val:
-            curses_pair = curses_pair | curses.A_UNDERLINE
+            attrs |= curses.A_UNDERLINE
         if 'i' in additional_val:
-            curses_pair = curses_pair | (curses.A_ITALIC if hasattr(
+            attrs |= (curses.A_ITALIC if hasattr(
                 curses, 'A_ITALIC') else curses.A_REVERSE)
         if 'a' in additional_val:
-            curses_pair = curses_pair | curses.A_BLINK
-    return curses_pair
+            attrs |= curses.A_BLINK
+    return colors, attrs
+
+
+def to_curses_attr(
+        color_tuple: Union[Tuple[int, int], Tuple[int, int, str]]) -> int:
+    """
+    Takes a color tuple (as defined at the top of this file) and
+    returns a valid curses attr that can be passed directly to attron() or attroff()
+    """
+    try:
+        colors, attrs = parsed_color_tuples[color_tuple]
+    except KeyError:
+        colors, attrs = parsed_color_tuples[color_tuple] = parse_color_tuple(
+            color_tuple)
+    return curses.color_pair(color_pairs.get(colors)) | attrs
 
 
 def get_theme() -> Theme:
@@ -545,6 +613,8 @@ def prepare_ccolor_palette(theme: Theme) -> None:
 
 
 def reload_theme() -> Optional[str]:
+    parsed_color_tuples.clear()
+    color_pairs.clear()
     theme_name = config.get('theme')
     global theme
     if theme_name == 'default' or not theme_name.strip():
@@ -4,7 +4,8 @@ Standalone functions used by the modules
 
 import string
 from typing import Optional, List
-from poezio.ui.consts import FORMAT_CHAR, FORMAT_CHARS
+from poezio import poopt
+from poezio.ui.consts import FORMAT_CHARS
 
 DIGITS = string.digits + '-'
 
@@ -33,30 +34,17 @@ def truncate_nick(nick: Optional[str], size=10) -> str:
 
 
 def parse_attrs(text: str, previous: Optional[List[str]] = None) -> List[str]:
-    next_attr_char = text.find(FORMAT_CHAR)
     if previous:
         attrs = previous
     else:
         attrs = []
-    while next_attr_char != -1 and text:
-        if next_attr_char + 1 < len(text):
-            attr_char = text[next_attr_char + 1].lower()
-        else:
-            attr_char = '\0'
-        if attr_char == 'o':
+    for _, code in poopt.split_attrs(text):
+        if not code:
+            continue
+        if code == 'o':
             attrs = []
-        elif attr_char == 'u':
-            attrs.append('u')
-        elif attr_char == 'b':
-            attrs.append('b')
-        elif attr_char == 'i':
-            attrs.append('i')
-        if attr_char in DIGITS and attr_char:
-            color_str = text[next_attr_char + 1:text.find('}', next_attr_char)]
-            if color_str:
-                attrs.append(color_str + '}')
-            text = text[next_attr_char + len(color_str) + 2:]
-        else:
-            text = text[next_attr_char + 2:]
-        next_attr_char = text.find(FORMAT_CHAR)
+        elif code in ('u', 'b', 'i'):
+            attrs.append(code)
+        elif code[0] in DIGITS:
+            attrs.append(code + '}')
     return attrs
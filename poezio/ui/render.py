@@ -7,7 +7,9 @@ from datetime import (
 from functools import singledispatch
 from math import ceil, log10
 from typing import (
+    Any,
     List,
+    Optional,
     Tuple,
     TYPE_CHECKING,
 )
@@ -23,7 +25,6 @@ from poezio.ui.consts import (
 )
 from poezio.ui.funcs import (
     truncate_nick,
-    parse_attrs,
 )
 from poezio.ui.types import (
     BaseMessage,
@@ -37,47 +38,58 @@ if TYPE_CHECKING:
 
 # msg is a reference to the corresponding Message object. text_start and
 # text_end are the position delimiting the text in this line.
+# format_runs keeps the attributes of the text parsed by the window
+# displaying it, along with the theme and text they were parsed for.
 class Line:
-    __slots__ = ('msg', 'start_pos', 'end_pos', 'prepend')
+    __slots__ = ('msg', 'start_pos', 'end_pos', 'prepend', 'format_runs')
 
     def __init__(self, msg: BaseMessage, start_pos: int, end_pos: int, prepend: str) -> None:
         self.msg = msg
         self.start_pos = start_pos
         self.end_pos = end_pos
         self.prepend = prepend
+        self.format_runs = None  # type: Optional[Tuple[Any, int, str, List[Tuple[str, int]]]]
 
     def __repr__(self):
         return '(%s, %s)' % (self.start_pos, self.end_pos)
 
 
-LinePos = Tuple[int, int]
+LinePos = Tuple[int, int, Tuple[str, ...]]
+# The theme is part of the key: it gives the width of the ack and XML
+# console characters
+LayoutKey = Tuple[int, bool, int, int, Any]
 
-def generate_lines(lines: List[LinePos], msg: BaseMessage, default_color: str = '') -> List[Line]: 
+# Number of different layouts kept for each message
+LAYOUT_CACHE_SIZE = 4
+
+def generate_lines(lines: List[LinePos], msg: BaseMessage, default_color: str = '') -> List[Line]:
+    """
+    Build the Line objects from the (start, end, attributes) tuples
+    returned by poopt.cut_text_attrs.
+    """
     line_objects = []
-    attrs = []  # type: List[str]
-    prepend = default_color if default_color else ''
-    for line in lines:
-        saved = Line(
-            msg=msg,
-            start_pos=line[0],
-            end_pos=line[1],
-            prepend=prepend)
-        attrs = parse_attrs(msg.txt[line[0]:line[1]], attrs)
-        if attrs:
-            prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
-        else:
-            if default_color:
-                prepend = default_color
+    previous_attrs = ()  # type: Tuple[str, ...]
+    prepend = default_color
+    for start_pos, end_pos, attrs in lines:
+        # Lines starting with the same attributes share the same tuple
+        if attrs is not previous_attrs:
+            if attrs:
+                prepend = FORMAT_CHAR + FORMAT_CHAR.join(attrs)
             else:
-                prepend = ''
-        line_objects.append(saved)
+                prepend = default_color
+            previous_attrs = attrs
+        line_objects.append(Line(
+            msg=msg,
+            start_pos=start_pos,
+            end_pos=end_pos,
+            prepend=prepend))
     return line_objects
 
 
 @singledispatch
 def build_lines(msg: BaseMessage, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
+    lines = poopt.cut_text_attrs(msg.txt, width - offset - 1)
     return generate_lines(lines, msg, default_color='')
 
 
@@ -95,7 +107,7 @@ def build_message(msg: Message, width: int, timestamp: bool, nick_size: int = 10
     if not txt:
         return []
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(txt, width - offset - 1)
+    lines = poopt.cut_text_attrs(txt, width - offset - 1)
     generated_lines = generate_lines(lines, msg, default_color='')
     return generated_lines
 
@@ -104,17 +116,37 @@ def build_message(msg: Message, width: int, timestamp: bool, nick_size: int = 10
 def build_status(msg: StatusMessage, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     msg.rebuild()
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
+    lines = poopt.cut_text_attrs(msg.txt, width - offset - 1)
     return generate_lines(lines, msg, default_color='')
 
 
 @build_lines.register(XMLLog)
 def build_xmllog(msg: XMLLog, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
     offset = msg.compute_offset(timestamp, nick_size)
-    lines = poopt.cut_text(msg.txt, width - offset - 1)
+    lines = poopt.cut_text_attrs(msg.txt, width - offset - 1)
     return generate_lines(lines, msg, default_color='')
 
 
+def build_lines_cached(msg: BaseMessage, width: int, timestamp: bool, nick_size: int = 10) -> List[Line]:
+    """
+    Same as build_lines, but reuse the lines built for the same message,
+    width, timestamp setting, nick size, revision of the message and theme.
+    """
+    # StatusMessages are rebuilt on each call, and can change at any time
+    if msg is None or isinstance(msg, StatusMessage):
+        return build_lines(msg, width, timestamp, nick_size)
+    key = (width, timestamp, nick_size, msg.layout_revision,
+           get_theme())  # type: LayoutKey
+    cache = msg.layout_cache
+    lines = cache.get(key)
+    if lines is None:
+        lines = build_lines(msg, width, timestamp, nick_size)
+        if len(cache) >= LAYOUT_CACHE_SIZE:
+            del cache[next(iter(cache))]
+        cache[key] = lines
+    return lines
+
+
 @singledispatch
 def write_pre(msg: BaseMessage, win: 'Win', with_timestamps: bool, nick_size: int) -> int:
     """Write the part before text (only the timestamp)"""
@@ -1,7 +1,7 @@
 
 from datetime import datetime
 from math import ceil, log10
-from typing import Union, Optional, List, Tuple
+from typing import Any, Dict, Union, Optional, List, Tuple
 from poezio.ui.funcs import truncate_nick
 from poezio import poopt
 from poezio.user import User
@@ -14,7 +14,7 @@ from poezio.ui.consts import (
 
 
 class BaseMessage:
-    __slots__ = ('txt', 'time', 'identifier')
+    __slots__ = ('txt', 'time', 'identifier', 'layout_cache', 'layout_revision')
 
     def __init__(self, txt: str, identifier: str = '', time: Optional[datetime] = None):
         self.txt = txt
@@ -23,6 +23,10 @@ class BaseMessage:
             self.time = time
         else:
             self.time = datetime.now()
+        # Lines already built for this message, see ui.render.build_lines_cached
+        self.layout_cache = {}  # type: Dict[Tuple[int, bool, int, int, Any], List]
+        # Must be incremented each time the message is modified in place
+        self.layout_revision = 0
 
     def compute_offset(self, with_timestamps: bool, nick_size: int) -> int:
         return SHORT_FORMAT_LENGTH + 1
@@ -9,11 +9,12 @@ Define the user class.
 A user is a MUC participant, not a roster contact (see contact.py)
 """
 
+import bisect
 import logging
+from collections import OrderedDict
 from datetime import timedelta, datetime
-from hashlib import md5
 from random import choice
-from typing import Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 from poezio import xhtml, colors
 from poezio.theming import get_theme
@@ -23,6 +24,9 @@ log = logging.getLogger(__name__)
 
 ROLE_DICT = {'': 0, 'none': 0, 'visitor': 1, 'participant': 2, 'moderator': 3}
 
+# The last_talked of the users who never talked: the oldest possible time
+NEVER_TALKED = datetime(1, 1, 1)
+
 
 class User:
     """
@@ -40,8 +44,7 @@ class User:
                  jid: JID,
                  deterministic=True,
                  color='') -> None:
-        # The oldest possible time
-        self.last_talked = datetime(1, 1, 1)  # type: datetime
+        self.last_talked = NEVER_TALKED  # type: datetime
         self.update(affiliation, show, status, role)
         self.change_nick(nick)
         self.jid = jid  # type: JID
@@ -57,19 +60,13 @@ class User:
 
     def set_deterministic_color(self) -> None:
         theme = get_theme()
-        if theme.ccg_palette:
-            # use XEP-0392 CCG
-            if self.jid and self.jid.domain:
-                input_ = self.jid.bare
-            else:
-                input_ = self.nick
-            fg_color = colors.ccg_text_to_color(theme.ccg_palette, input_)
-            self.color = fg_color, -1
+        if theme.ccg_palette and self.jid and self.jid.domain:
+            # use XEP-0392 CCG on the real JID
+            input_ = self.jid.bare
         else:
-            mod = len(theme.LIST_COLOR_NICKNAMES)
-            nick_pos = int(md5(self.nick.encode('utf-8')).hexdigest(),
-                           16) % mod
-            self.color = theme.LIST_COLOR_NICKNAMES[nick_pos]
+            input_ = self.nick
+        self.color = colors.nick_color(theme.ccg_palette,
+                                       theme.LIST_COLOR_NICKNAMES, input_)
 
     def update(self, affiliation: str, show: str, status: str, role: str):
         self.affiliation = affiliation
@@ -137,3 +134,206 @@ class User:
         if ROLE_DICT[self.role] == ROLE_DICT[b.role]:
             return self.nick.lower() <= b.nick.lower()
         return ROLE_DICT[self.role] >= ROLE_DICT[b.role]
+
+
+def user_sort_key(user: User) -> Tuple[int, str, str]:
+    """
+    The key sorting the users like User.__lt__ does: by role, then by
+    case-insensitive nick (and then by nick, to break ties)
+    """
+    return (-ROLE_DICT[user.role], user.nick.lower(), user.nick)
+
+
+class Occupants:
+    """
+    The users of a MUC, indexed by nick, and kept sorted by role and nick.
+
+    The users are kept in a list of sorted buckets of at most
+    2 * BUCKET_SIZE users, so that inserting or removing one only shifts
+    a small bucket, and finds it by bisection.  The key each user was
+    inserted with is kept, so a user has to be removed before its nick or
+    role is changed, and added back afterwards.
+
+    For the nick completion, the users who talked are also kept from the
+    least to the most recent one (set_last_talked moves a user at the
+    end, and the rare older times make it sort them again when needed).
+    The nicks starting with a prefix are found by bisection in the sorted
+    buckets, once for each role.
+    """
+    __slots__ = ('_by_nick', '_keys', '_buckets', '_maxes', '_len',
+                 '_talked', '_talked_sorted')
+
+    BUCKET_SIZE = 64
+
+    def __init__(self, users: Iterable[User] = ()) -> None:
+        self._by_nick = {}  # type: Dict[str, Tuple[Tuple[int, str, str], User]]
+        self._keys = []  # type: List[List[Tuple[int, str, str]]]
+        self._buckets = []  # type: List[List[User]]
+        self._maxes = []  # type: List[Tuple[int, str, str]]
+        self._len = 0
+        self._talked = OrderedDict()  # type: OrderedDict[str, User]
+        self._talked_sorted = True
+        for user in users:
+            self.add(user)
+
+    def get(self, nick: str) -> Optional[User]:
+        """Return the user with this nick, or None"""
+        entry = self._by_nick.get(nick)
+        return entry[1] if entry is not None else None
+
+    def add(self, user: User) -> None:
+        """Insert a user at its place, replacing the one with the same nick"""
+        if user.nick in self._by_nick:
+            self.remove(self._by_nick[user.nick][1])
+        key = user_sort_key(user)
+        self._by_nick[user.nick] = (key, user)
+        self._len += 1
+        if user.last_talked != NEVER_TALKED:
+            self._move_to_end(user)
+        if not self._buckets:
+            self._keys.append([key])
+            self._buckets.append([user])
+            self._maxes.append(key)
+            return
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            index -= 1
+            self._maxes[index] = key
+        keys = self._keys[index]
+        pos = bisect.bisect_left(keys, key)
+        keys.insert(pos, key)
+        self._buckets[index].insert(pos, user)
+        if len(keys) > 2 * self.BUCKET_SIZE:
+            bucket = self._buckets[index]
+            self._keys.insert(index + 1, keys[self.BUCKET_SIZE:])
+            self._buckets.insert(index + 1, bucket[self.BUCKET_SIZE:])
+            del keys[self.BUCKET_SIZE:]
+            del bucket[self.BUCKET_SIZE:]
+            self._maxes.insert(index, keys[-1])
+
+    def remove(self, user: User) -> None:
+        """Remove a user, raise ValueError if it is not there"""
+        entry = self._by_nick.get(user.nick)
+        if entry is None or entry[1] is not user:
+            raise ValueError('%r is not in the occupants' % user)
+        key = entry[0]
+        del self._by_nick[user.nick]
+        self._len -= 1
+        self._talked.pop(user.nick, None)
+        index = bisect.bisect_left(self._maxes, key)
+        keys = self._keys[index]
+        pos = bisect.bisect_left(keys, key)
+        del keys[pos]
+        del self._buckets[index][pos]
+        if not keys:
+            del self._keys[index]
+            del self._buckets[index]
+            del self._maxes[index]
+        elif pos == len(keys):
+            self._maxes[index] = keys[-1]
+
+    def clear(self) -> None:
+        self._by_nick.clear()
+        self._keys = []
+        self._buckets = []
+        self._maxes = []
+        self._len = 0
+        self._talked.clear()
+        self._talked_sorted = True
+
+    def _move_to_end(self, user: User) -> None:
+        talked = self._talked
+        if talked and talked[next(reversed(talked))].last_talked > user.last_talked:
+            self._talked_sorted = False
+        talked[user.nick] = user
+        talked.move_to_end(user.nick)
+
+    def set_last_talked(self, user: User, time: datetime) -> None:
+        """Update the time a user last talked, and the recency order"""
+        if time <= user.last_talked:
+            return
+        user.set_last_talked(time)
+        entry = self._by_nick.get(user.nick)
+        if entry is not None and entry[1] is user:
+            self._move_to_end(user)
+
+    def by_last_talked(self) -> Iterator[User]:
+        """
+        Iterate over the users from the one who talked last, those who never
+        talked coming after, in the role and nick order
+        """
+        talked = self._talked
+        if not self._talked_sorted:
+            talked = self._talked = OrderedDict(
+                sorted(talked.items(), key=lambda item: item[1].last_talked))
+            self._talked_sorted = True
+        yield from reversed(talked.values())
+        if len(talked) < self._len:
+            for user in self:
+                if user.nick not in talked:
+                    yield user
+
+    def nicks_by_last_talked(self, prefix: str = '') -> List[str]:
+        """
+        Return the nicks starting with prefix (case-insensitively), from the
+        one of the user who talked last, like by_last_talked
+        """
+        if not prefix:
+            return [user.nick for user in self.by_last_talked()]
+        prefix = prefix.lower()
+        users = []  # type: List[User]
+        for role in sorted(set(ROLE_DICT.values()), reverse=True):
+            for key, user in self._iter_from((-role, prefix, '')):
+                if key[0] != -role or not key[1].startswith(prefix):
+                    break
+                users.append(user)
+        users.sort(key=lambda user: user.last_talked, reverse=True)
+        return [user.nick for user in users]
+
+    def _iter_from(self, key: Tuple[int, str, str]
+                   ) -> Iterator[Tuple[Tuple[int, str, str], User]]:
+        """Iterate over the (key, user) couples from the first key >= key"""
+        index = bisect.bisect_left(self._maxes, key)
+        if index == len(self._maxes):
+            return
+        pos = bisect.bisect_left(self._keys[index], key)
+        for i in range(index, len(self._keys)):
+            yield from zip(self._keys[i][pos:], self._buckets[i][pos:])
+            pos = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len != 0
+
+    def __iter__(self) -> Iterator[User]:
+        for bucket in self._buckets:
+            yield from bucket
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            result = []  # type: List[User]
+            for bucket in self._buckets:
+                if start >= stop:
+                    break
+                if start < len(bucket):
+                    result.extend(bucket[start:stop])
+                start = max(start - len(bucket), 0)
+                stop -= len(bucket)
+            return result
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError('occupant index out of range')
+        for bucket in self._buckets:
+            if index < len(bucket):
+                return bucket[index]
+            index -= len(bucket)
+        raise IndexError('occupant index out of range')
+
+    def __repr__(self) -> str:
+        return 'Occupants(%r)' % list(self)
@@ -3,7 +3,7 @@ Module exporting all the Windows, which are wrappers around curses wins
 used to display information on the screen
 """
 
-from poezio.windows.base_wins import Win
+from poezio.windows.base_wins import Win, invalidate_all
 from poezio.windows.data_forms import FormWin
 from poezio.windows.bookmark_forms import BookmarksWin
 from poezio.windows.confirm import Dialog
@@ -21,7 +21,7 @@ from poezio.windows.text_win import TextWin
 from poezio.windows.image import ImageWin
 
 __all__ = [
-    'Win', 'FormWin', 'BookmarksWin', 'Dialog', 'GlobalInfoBar',
+    'Win', 'invalidate_all', 'FormWin', 'BookmarksWin', 'Dialog', 'GlobalInfoBar',
     'VerticalGlobalInfoBar', 'InfoWin', 'PrivateInfoWin', 'XMLInfoWin',
     'MucListInfoWin', 'ConversationInfoWin', 'MucInfoWin',
     'DynamicConversationInfoWin', 'ConversationStatusMessageWin',
@@ -16,15 +16,91 @@ import curses
 import string
 
 from contextlib import contextmanager
-from typing import Optional, Tuple, TYPE_CHECKING
+from typing import Any, List, Optional, Tuple, TYPE_CHECKING
 
-from poezio.theming import to_curses_attr, read_tuple
-
-from poezio.ui.consts import FORMAT_CHAR
+from poezio import poopt
+from poezio.theming import to_curses_attr, read_tuple, color_pairs
 
 if TYPE_CHECKING:
     from _curses import _CursesWindow  # pylint: disable=E0611
 
+# A string with its format codes parsed: (text, curses attributes) runs
+FormatRuns = List[Tuple[str, int]]
+
+ATTR_ITALIC = curses.A_ITALIC if hasattr(curses,
+                                         'A_ITALIC') else curses.A_REVERSE
+
+
+def attr_on(current: int, attr: int) -> int:
+    """
+    Return the attributes of a window after calling attron(attr) on it
+    (a color pair replaces the current one).
+    """
+    if attr & curses.A_COLOR:
+        return (current & ~curses.A_COLOR) | attr
+    return current | attr
+
+
+def compile_format(text: str) -> FormatRuns:
+    """
+    Parse the attributes of a string once, into runs that
+    Win.addstr_runs can write without parsing anything.
+    The syntax is the one of Win.addstr_colored, which starts with no
+    attribute set.
+    """
+    runs = []  # type: FormatRuns
+    attrs = 0
+    for chunk, code in poopt.split_attrs(text):
+        if code is None:
+            if chunk or not runs or runs[-1][1] != attrs:
+                runs.append((chunk, attrs))
+            break
+        if chunk:
+            runs.append((chunk, attrs))
+        if code == 'o':
+            attrs = 0
+        elif code == 'u':
+            attrs |= curses.A_UNDERLINE
+        elif code == 'b':
+            attrs |= curses.A_BOLD
+        elif code == 'i':
+            attrs |= ATTR_ITALIC
+        elif code and (code[0] in string.digits or code[0] == '-'):
+            if ',' in code:
+                tup, char = read_tuple(code)
+                attrs = attr_on(attrs, to_curses_attr(tup))
+                if char:
+                    if char == 'o':
+                        attrs = 0
+                    elif char == 'u':
+                        attrs |= curses.A_UNDERLINE
+                    elif char == 'b':
+                        attrs |= curses.A_BOLD
+                    elif char == 'i':
+                        attrs |= ATTR_ITALIC
+                else:
+                    # this will reset previous bold/uderline sequences if any was used
+                    attrs &= ~(curses.A_UNDERLINE | curses.A_BOLD)
+            else:
+                attrs = attr_on(attrs, to_curses_attr((int(code), -1)))
+    return runs
+
+
+# Incremented each time everything on the screen has to be drawn again
+# (tab switch, full redraw, theme or configuration change), see
+# Win.needs_refresh. Windows are also drawn again when color pairs are
+# reused for other colors.
+_screen_generation = 0
+
+
+def invalidate_all() -> None:
+    """
+    Make all the windows draw themselves again on their next
+    refresh_if_changed, whatever their inputs are.
+    """
+    global _screen_generation
+    _screen_generation += 1
+
 
 class DummyWin:
     def __getattribute__(self, name: str):
@@ -38,13 +114,67 @@ class DummyWin:
 
 
 class Win:
-    __slots__ = ('_win', 'height', 'width', 'y', 'x')
+    __slots__ = ('_win', 'height', 'width', 'y', 'x', '_drawn')
 
     def __init__(self) -> None:
         self._win = None  # type: _CursesWindow
         self.height, self.width = 0, 0
+        # What the window was last drawn from, see needs_refresh
+        self._drawn = None  # type: Any
+
+    def damage_key(self, *args) -> Any:
+        """
+        Return what the content of the window depends on, besides its
+        geometry and the theme. By default, the arguments of refresh;
+        override it if refresh reads some mutable state.
+        """
+        return args
+
+    def needs_refresh(self, key: Any) -> bool:
+        """
+        Tell if the window has to be drawn again to display key (see
+        damage_key), i.e. if anything changed since its last draw.
+        """
+        drawn = getattr(self, '_drawn', None)
+        return drawn is None or drawn != (_screen_generation,
+                                          color_pairs.generation,
+                                          self.height, self.width, key)
+
+    def refresh_if_changed(self, *args) -> None:
+        """
+        Refresh the window with the given arguments, unless its content
+        is already up to date on the screen.
+        """
+        if not self.needs_refresh(self.damage_key(*args)):
+            return
+        self.refresh(*args)
+        # refresh may fix the state up (scrolling position, etc), so
+        # the key is taken again afterwards
+        self._drawn = (_screen_generation, color_pairs.generation,
+                       self.height, self.width, self.damage_key(*args))
+
+    def drawn_key(self) -> Any:
+        """
+        Return the damage key the window was last drawn from, if that
+        drawing is still on the screen (the screen was not invalidated and
+        the window was not resized since), or None.
+        """
+        drawn = getattr(self, '_drawn', None)
+        if drawn is None or drawn[:4] != (_screen_generation,
+                                          color_pairs.generation,
+                                          self.height, self.width):
+            return None
+        return drawn[4]
+
+    def mark_dirty(self) -> None:
+        """
+        Draw the window on its next refresh_if_changed, even if its
+        inputs did not change.
+        """
+        self._drawn = None
 
     def _resize(self, height: int, width: int, y: int, x: int) -> None:
+        self._drawn = None
         if height == 0 or width == 0:
             self.height, self.width = height, width
             return
@@ -118,54 +248,23 @@ class Win:
         next_attr_char is the \x19 delimiter
         attr_char is the char following it, it can be
         one of 'u', 'b', 'i', 'c[0-9]'
+
+        Use compile_format and addstr_runs instead to write the same
+        string more than once.
+        """
+        self.addstr_runs(compile_format(text), y, x)
+
+    def addstr_runs(self, runs: FormatRuns, y: Optional[int] = None, x: Optional[int] = None) -> None:
+        """
+        Write a string compiled with compile_format on the window.
+        The attributes of the last run are left set.
         """
         if y is not None and x is not None:
             self.move(y, x)
-        next_attr_char = text.find(FORMAT_CHAR)
-        attr_italic = curses.A_ITALIC if hasattr(
-            curses, 'A_ITALIC') else curses.A_REVERSE
-        while next_attr_char != -1 and text:
-            if next_attr_char + 1 < len(text):
-                attr_char = text[next_attr_char + 1].lower()
-            else:
-                attr_char = str()
-            if next_attr_char != 0:
-                self.addstr(text[:next_attr_char])
-            if attr_char == 'o':
-                self._win.attrset(0)
-            elif attr_char == 'u':
-                self._win.attron(curses.A_UNDERLINE)
-            elif attr_char == 'b':
-                self._win.attron(curses.A_BOLD)
-            elif attr_char == 'i':
-                self._win.attron(attr_italic)
-            if (attr_char in string.digits
-                    or attr_char == '-') and attr_char != '':
-                color_str = text[next_attr_char +
-                                 1:text.find('}', next_attr_char)]
-                if ',' in color_str:
-                    tup, char = read_tuple(color_str)
-                    self._win.attron(to_curses_attr(tup))
-                    if char:
-                        if char == 'o':
-                            self._win.attrset(0)
-                        elif char == 'u':
-                            self._win.attron(curses.A_UNDERLINE)
-                        elif char == 'b':
-                            self._win.attron(curses.A_BOLD)
-                        elif char == 'i':
-                            self._win.attron(attr_italic)
-                    else:
-                        # this will reset previous bold/uderline sequences if any was used
-                        self._win.attroff(curses.A_UNDERLINE)
-                        self._win.attroff(curses.A_BOLD)
-                elif color_str:
-                    self._win.attron(to_curses_attr((int(color_str), -1)))
-                text = text[next_attr_char + len(color_str) + 2:]
-            else:
-                text = text[next_attr_char + 2:]
-            next_attr_char = text.find(FORMAT_CHAR)
-        self.addstr(text)
+        for text, attrs in runs:
+            self._win.attrset(attrs)
+            if text:
+                self.addstr(text)
 
     def finish_line(self, color: Optional[Tuple] = None) -> None:
         """
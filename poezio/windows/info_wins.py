@@ -359,16 +359,22 @@ class ConversationStatusMessageWin(InfoWin):
     def __init__(self):
         InfoWin.__init__(self)
 
-    def refresh(self, jid, contact):
-        log.debug('Refresh: %s', self.__class__.__name__)
+    def damage_key(self, jid, contact):
+        resource = self._get_resource(jid, contact)
+        return resource.status if resource else None
+
+    @staticmethod
+    def _get_resource(jid, contact):
         jid = safeJID(jid)
         if contact:
             if jid.resource:
-                resource = contact[jid.full]
-            else:
-                resource = contact.get_highest_priority_resource()
-        else:
-            resource = None
+                return contact[jid.full]
+            return contact.get_highest_priority_resource()
+        return None
+
+    def refresh(self, jid, contact):
+        log.debug('Refresh: %s', self.__class__.__name__)
+        resource = self._get_resource(jid, contact)
         self._win.erase()
         if resource:
             self.write_status_message(resource)
@@ -10,7 +10,7 @@ from typing import List, Dict, Callable, Optional
 from poezio import keyboard
 from poezio import common
 from poezio import poopt
-from poezio.windows.base_wins import Win
+from poezio.windows.base_wins import Win, FormatRuns, ATTR_ITALIC, attr_on
 from poezio.ui.consts import FORMAT_CHARS
 from poezio.ui.funcs import find_first_format_char
 from poezio.config import config
@@ -404,6 +404,16 @@ class Input(Win):
         self.hit_list = []
         self.last_completion = None
 
+    def get_completion_prefix(self) -> str:
+        """
+        Return the beginning of the word before the cursor, which the
+        normal completion completes
+        """
+        space_before_cursor = self.text.rfind(' ', 0, self.pos)
+        if space_before_cursor != -1:
+            return self.text[space_before_cursor + 1:self.pos]
+        return self.text[:self.pos]
+
     def normal_completion(self, word_list: List[str], after: str) -> None:
         """
         Normal completion
@@ -414,11 +424,7 @@ class Input(Win):
             after = after[:
                           -1]  # remove the last space if we are already on a space
         if not self.last_completion:
-            space_before_cursor = self.text.rfind(' ', 0, pos)
-            if space_before_cursor != -1:
-                begin = self.text[space_before_cursor + 1:pos]
-            else:
-                begin = self.text[:pos]
+            begin = self.get_completion_prefix()
             hit_list = []  # list of matching hits
             for word in word_list:
                 if word.lower().startswith(begin.lower()):
@@ -488,33 +494,41 @@ class Input(Win):
         (\x0E to \x19 instead of \x19 + attr). We do not use any }
         char in this version
         """
+        self.addstr_runs(self._compile_format_lite(text), y, x)
+
+    def _compile_format_lite(self, text: str) -> FormatRuns:
+        """
+        Parse the single-char attributes of a string into runs (see
+        compile_format), each attribute char being displayed as its
+        letter in reverse video.
+        """
         chars = FORMAT_CHARS + '\n'
-        if y is not None and x is not None:
-            self.move(y, x)
+        runs = []  # type: FormatRuns
+        attrs = 0
         format_char = find_first_format_char(text, chars)
-        attr_italic = curses.A_ITALIC if hasattr(
-            curses, 'A_ITALIC') else curses.A_REVERSE
         while format_char != -1:
             if text[format_char] == '\n':
                 attr_char = '|'
             else:
                 attr_char = self.text_attributes[FORMAT_CHARS.index(
                     text[format_char])]
-            self.addstr(text[:format_char])
-            self.addstr(attr_char, curses.A_REVERSE)
+            if format_char:
+                runs.append((text[:format_char], attrs))
+            runs.append((attr_char, curses.A_REVERSE))
             text = text[format_char + 1:]
             if attr_char == 'o':
-                self._win.attrset(0)
+                attrs = 0
             elif attr_char == 'u':
-                self._win.attron(curses.A_UNDERLINE)
+                attrs |= curses.A_UNDERLINE
             elif attr_char == 'b':
-                self._win.attron(curses.A_BOLD)
+                attrs |= curses.A_BOLD
             elif attr_char == 'i':
-                self._win.attron(attr_italic)
+                attrs |= ATTR_ITALIC
             elif attr_char in string.digits and attr_char != '':
-                self._win.attron(to_curses_attr((int(attr_char), -1)))
+                attrs = attr_on(attrs, to_curses_attr((int(attr_char), -1)))
             format_char = find_first_format_char(text, chars)
-        self.addstr(text)
+        runs.append((text, attrs))
+        return runs
 
     def rewrite_text(self) -> None:
         """
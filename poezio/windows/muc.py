@@ -5,35 +5,52 @@ Windows specific to a MUC
 import logging
 import curses
 
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 
 from poezio.windows.base_wins import Win
 
 from poezio import poopt
 from poezio.config import config
-from poezio.theming import to_curses_attr, get_theme
+from poezio.theming import color_pairs, to_curses_attr, get_theme
 from poezio.user import User
 
 log = logging.getLogger(__name__)
 
-CachedUser = Tuple[str, str, Optional[str], str, str]
+# What a row of the user list shows: nick, show, chatstate, affiliation,
+# role and color
+CachedUser = Tuple[str, str, Optional[str], str, str, Tuple[int, int]]
+
+# How a row is drawn: the status char and its attribute, the affiliation
+# char and its attribute, and the nick (cut to the width) and its attribute
+DrawnUser = Tuple[str, int, str, int, str, int]
+
+# Maximum number of different rows whose drawing is kept
+ROW_CACHE_SIZE = 1024
 
 
 def userlist_to_cache(userlist: List[User]) -> List[CachedUser]:
     result = []
     for user in userlist:
-        result.append((user.nick, user.status, user.chatstate,
-                       user.affiliation, user.role))
+        result.append((user.nick, user.show, user.chatstate,
+                       user.affiliation, user.role, user.color))
     return result
 
 
 class UserList(Win):
-    __slots__ = ('pos', 'cache')
+    """
+    The list of the users of a MUC.
+
+    Only the visible slice of the users is read.  When the window is still
+    on the screen, only the rows whose user changed are drawn again, and
+    the drawing of each row is cached by the state of its user.
+    """
+    __slots__ = ('pos', '_row_cache', '_row_cache_key')
 
     def __init__(self) -> None:
         Win.__init__(self)
         self.pos = 0
-        self.cache = []  # type: List[CachedUser]
+        self._row_cache = {}  # type: Dict[CachedUser, DrawnUser]
+        self._row_cache_key = None  # type: Any
 
     def scroll_up(self) -> bool:
         self.pos += self.height - 1
@@ -50,18 +67,11 @@ class UserList(Win):
         self.addstr(y, self.width - 2, '++',
                     to_curses_attr(get_theme().COLOR_MORE_INDICATOR))
 
-    def refresh_if_changed(self, users: List[User]) -> None:
-        old = self.cache
-        new = userlist_to_cache(users[self.pos:self.pos + self.height])
-        if len(old) != len(new):
-            self.cache = new
-            self.refresh(users)
-            return
-        for a, b in zip(old, new):
-            if a != b:
-                self.cache = new
-                self.refresh(users)
-                return
+    def damage_key(self, users: List[User]) -> Tuple:
+        # the number of users decides whether the "more" indicators are
+        # displayed
+        return (self.pos, len(users),
+                tuple(userlist_to_cache(users[self.pos:self.pos + self.height])))
 
     def refresh(self, users: List[User]) -> None:
         log.debug('Refresh: %s', self.__class__.__name__)
@@ -71,56 +81,75 @@ class UserList(Win):
             self.pos = 0
         elif self.pos >= len(users) - self.height and self.pos != 0:
             self.pos = len(users) - self.height
-        self._win.erase()
         asc_sort = (config.get('user_list_sort').lower() == 'asc')
+        rows = userlist_to_cache(users[self.pos:self.pos + self.height])
+        rows += [None] * (self.height - len(rows))
+        more_before = self.pos > 0
+        more_after = self.pos + self.height < len(users)
         if asc_sort:
-            y, _ = self._win.getmaxyx()
-            y -= 1
-        else:
-            y = 0
-
-        for user in users[self.pos:self.pos + self.height]:
-            self.draw_role_affiliation(y, user)
-            self.draw_status_chatstate(y, user)
-            self.addstr(y, 2, poopt.cut_by_columns(user.nick, self.width - 2),
-                        to_curses_attr(user.color))
+            rows.reverse()
+            more_before, more_after = more_after, more_before
+
+        # Only the rows that changed are drawn again, if what was drawn
+        # before is still on the screen and was not scrolled
+        drawn = self.drawn_key()
+        if drawn is not None and drawn[0] == self.pos:
+            previous = list(drawn[2])
+            previous += [None] * (self.height - len(previous))
             if asc_sort:
-                y -= 1
-            else:
-                y += 1
-            if y == self.height:
-                break
+                previous.reverse()
+            # the rows under the indicators are drawn again when these change
+            if (drawn[0] > 0, drawn[0] + self.height < drawn[1]) != (
+                    self.pos > 0, self.pos + self.height < len(users)):
+                previous[0] = previous[-1] = ()
+        else:
+            self._win.erase()
+            previous = [None] * self.height
+
+        for y, row in enumerate(rows):
+            if row == previous[y]:
+                continue
+            if previous[y] is not None:
+                self.move(y, 0)
+                self._win.clrtoeol()
+            if row is not None:
+                self.draw_row(y, row)
         # draw indicators of position in the list
-        if self.pos > 0:
-            if asc_sort:
-                self.draw_plus(self.height - 1)
-            else:
-                self.draw_plus(0)
-        if self.pos + self.height < len(users):
-            if asc_sort:
-                self.draw_plus(0)
-            else:
-                self.draw_plus(self.height - 1)
+        if more_before:
+            self.draw_plus(0)
+        if more_after:
+            self.draw_plus(self.height - 1)
         self._refresh()
 
-    def draw_role_affiliation(self, y: int, user: User) -> None:
+    def draw_row(self, y: int, row: CachedUser) -> None:
+        """Draw a user, from the cached drawing of its state"""
         theme = get_theme()
-        color = theme.color_role(user.role)
-        symbol = theme.char_affiliation(user.affiliation)
-        self.addstr(y, 1, symbol, to_curses_attr(color))
-
-    def draw_status_chatstate(self, y: int, user: User) -> None:
-        theme = get_theme()
-        show_col = theme.color_show(user.show)
-        if user.chatstate == 'composing':
-            char = theme.CHAR_CHATSTATE_COMPOSING
-        elif user.chatstate == 'active':
-            char = theme.CHAR_CHATSTATE_ACTIVE
-        elif user.chatstate == 'paused':
-            char = theme.CHAR_CHATSTATE_PAUSED
-        else:
-            char = theme.CHAR_STATUS
-        self.addstr(y, 0, char, to_curses_attr(show_col))
+        cache_key = (theme, color_pairs.generation, self.width)
+        if cache_key != self._row_cache_key or len(
+                self._row_cache) >= ROW_CACHE_SIZE:
+            self._row_cache = {}
+            self._row_cache_key = cache_key
+        drawing = self._row_cache.get(row)
+        if drawing is None:
+            nick, show, chatstate, affiliation, role, color = row
+            if chatstate == 'composing':
+                char = theme.CHAR_CHATSTATE_COMPOSING
+            elif chatstate == 'active':
+                char = theme.CHAR_CHATSTATE_ACTIVE
+            elif chatstate == 'paused':
+                char = theme.CHAR_CHATSTATE_PAUSED
+            else:
+                char = theme.CHAR_STATUS
+            drawing = (char, to_curses_attr(theme.color_show(show)),
+                       theme.char_affiliation(affiliation),
+                       to_curses_attr(theme.color_role(role)),
+                       poopt.cut_by_columns(nick, self.width - 2),
+                       to_curses_attr(color))
+            self._row_cache[row] = drawing
+        char, show_attr, symbol, role_attr, nick, nick_attr = drawing
+        self.addstr(y, 0, char, show_attr)
+        self.addstr(y, 1, symbol, role_attr)
+        self.addstr(y, 2, nick, nick_attr)
 
     def resize(self, height: int, width: int, y: int, x: int) -> None:
         separator = to_curses_attr(get_theme().COLOR_VERTICAL_SEPARATOR)
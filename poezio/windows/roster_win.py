@@ -6,7 +6,7 @@ import logging
 log = logging.getLogger(__name__)
 
 from datetime import datetime
-from typing import Optional, List, Union, Dict
+from typing import Optional, List, Tuple, Union, Dict
 
 from poezio.windows.base_wins import Win
 
@@ -129,6 +129,9 @@ class RosterWin(Win):
                                                                 pos] != self.selected_row:
                 self.pos = self.roster_cache.index(self.selected_row)
 
+    def damage_key(self, roster: Roster) -> Tuple:
+        return (roster.last_modified, self.pos, self.start_pos)
+
     def refresh(self, roster: Roster) -> None:
         """
         We display a number of lines from the roster cache
@@ -6,25 +6,193 @@ Can be locked, scrolled, has a separator, etc…
 import logging
 import curses
 from math import ceil, log10
-from typing import Optional, List, Union
+from typing import Dict, Iterator, Optional, List, Tuple, Union
 
-from poezio.windows.base_wins import Win, FORMAT_CHAR
+from poezio.windows.base_wins import Win, compile_format
 from poezio.ui.funcs import truncate_nick, parse_attrs
 from poezio.text_buffer import TextBuffer
 
 from poezio import poopt
 from poezio.config import config
-from poezio.theming import to_curses_attr, get_theme, dump_tuple
+from poezio.theming import (to_curses_attr, get_theme, dump_tuple,
+                            color_pairs)
 from poezio.ui.types import Message, BaseMessage
-from poezio.ui.render import Line, build_lines, write_pre
+from poezio.ui.render import Line, build_lines_cached, write_pre
 
 log = logging.getLogger(__name__)
 
 
+class LineStore:
+    """
+    The lines built by a TextWin, None being the separator.
+
+    Each stored line has an absolute position, which does not change when
+    the oldest lines are trimmed, so that the position of the separator
+    and of the first line of each message can be kept in constant time
+    lookups. When lines are inserted or removed in the middle, the
+    positions of the smallest side of the store are updated.
+    """
+    __slots__ = ('_lines', '_start', '_base', '_msg_pos', '_separator_pos')
+
+    def __init__(self) -> None:
+        # Lines before self._start have been trimmed, and are removed
+        # once they take more than half of the list.
+        self._lines = []  # type: List[Optional[Line]]
+        self._start = 0
+        # Absolute position of self._lines[0]
+        self._base = 0
+        # Message -> absolute position of its first line
+        self._msg_pos = {}  # type: Dict[BaseMessage, int]
+        self._separator_pos = None  # type: Optional[int]
+
+    def __len__(self) -> int:
+        return len(self._lines) - self._start
+
+    def __iter__(self) -> Iterator[Optional[Line]]:
+        for i in range(self._start, len(self._lines)):
+            yield self._lines[i]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                return self._lines[self._start + start:self._start + stop]
+            return [self._lines[self._start + i] for i in range(start, stop, step)]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('line index out of range')
+        return self._lines[self._start + key]
+
+    def _register(self, index: int, line: Optional[Line]) -> None:
+        """Record the position of a new line if it is remarkable"""
+        if line is None:
+            self._separator_pos = index + self._base
+        elif line.start_pos == 0:
+            self._msg_pos[line.msg] = index + self._base
+
+    def _unregister(self, index: int, line: Optional[Line]) -> None:
+        """Forget the position of a line that is removed"""
+        pos = index + self._base
+        if line is None:
+            if self._separator_pos == pos:
+                self._separator_pos = None
+        elif self._msg_pos.get(line.msg) == pos:
+            del self._msg_pos[line.msg]
+
+    def _shift(self, lo: int, hi: int, delta: int) -> None:
+        """
+        Move the recorded positions of the lines between the list indexes
+        lo and hi by delta
+        """
+        moved = []  # type: List[Tuple[BaseMessage, int]]
+        lines, base, msg_pos = self._lines, self._base, self._msg_pos
+        for i in range(lo, hi):
+            line = lines[i]
+            if line is None:
+                if self._separator_pos == i + base:
+                    moved.append((None, i + base + delta))
+            elif msg_pos.get(line.msg) == i + base:
+                moved.append((line.msg, i + base + delta))
+        for msg, pos in moved:
+            if msg is None:
+                self._separator_pos = pos
+            else:
+                msg_pos[msg] = pos
+
+    def append(self, line: Optional[Line]) -> None:
+        self._register(len(self._lines), line)
+        self._lines.append(line)
+
+    def extend(self, lines: List[Optional[Line]]) -> None:
+        for line in lines:
+            self.append(line)
+
+    def splice(self, index: int, nb: int, lines: List[Optional[Line]]) -> None:
+        """Replace the nb lines starting at index with the given lines"""
+        start = self._start + index
+        end = start + nb
+        for i in range(start, end):
+            self._unregister(i, self._lines[i])
+        delta = len(lines) - nb
+        if delta and len(self._lines) - end <= start - self._start:
+            self._shift(end, len(self._lines), delta)
+        elif delta:
+            # Keep the positions of the following lines, and move the
+            # preceding ones instead.
+            self._shift(self._start, start, -delta)
+            self._base -= delta
+        self._lines[start:end] = lines
+        for i, line in enumerate(lines, start):
+            self._register(i, line)
+
+    def insert(self, index: int, lines: List[Optional[Line]]) -> None:
+        self.splice(index, 0, lines)
+
+    def trim(self, limit: int) -> None:
+        """Remove the oldest lines to keep at most limit lines"""
+        lines = self._lines
+        while len(lines) - self._start > limit:
+            self._unregister(self._start, lines[self._start])
+            lines[self._start] = None
+            self._start += 1
+        if self._start * 2 > len(lines):
+            del lines[:self._start]
+            self._base += self._start
+            self._start = 0
+
+    def message_index(self, msg: BaseMessage) -> Optional[int]:
+        """Index of the first line of a message, if it is displayed"""
+        pos = self._msg_pos.get(msg)
+        if pos is None:
+            return None
+        return pos - self._base - self._start
+
+    def message_lines_count(self, index: int) -> int:
+        """Number of lines of the message whose first line is at index"""
+        lines = self._lines
+        i = self._start + index
+        msg = lines[i].msg
+        end = i + 1
+        while end < len(lines) and lines[end] is not None and lines[end].msg is msg:
+            end += 1
+        return end - i
+
+    def index(self, line: Optional[Line]) -> int:
+        """Index of a line, raises ValueError if it is not there"""
+        if line is None:
+            index = self.separator_index()
+        else:
+            index = self.message_index(line.msg)
+        if index is not None:
+            lines = self._lines
+            i = self._start + index
+            if line is None:
+                return index
+            while i < len(lines) and lines[i] is not None and lines[i].msg is line.msg:
+                if lines[i] is line:
+                    return i - self._start
+                i += 1
+        raise ValueError('line not in store')
+
+    def separator_index(self) -> Optional[int]:
+        if self._separator_pos is None:
+            return None
+        return self._separator_pos - self._base - self._start
+
+    def remove_separator(self) -> bool:
+        index = self.separator_index()
+        if index is None:
+            return False
+        self.splice(index, 1, [])
+        return True
+
+
 class TextWin(Win):
     __slots__ = ('lines_nb_limit', 'pos', 'built_lines', 'lock', 'lock_buffer',
                  'separator_after', 'highlights', 'hl_pos',
-                 'nb_of_highlights_after_separator')
+                 'nb_of_highlights_after_separator', 'lazy',
+                 'pending_messages', 'pending_rebuild', 'revision')
 
     def __init__(self, lines_nb_limit: Optional[int] = None) -> None:
         Win.__init__(self)
@@ -34,7 +202,7 @@ class TextWin(Win):
         self.pos = 0
         # Each new message is built and kept here.
         # on resize, we rebuild all the messages
-        self.built_lines = []  # type: List[Union[None, Line]]
+        self.built_lines = LineStore()
 
         self.lock = False
         self.lock_buffer = []  # type: List[Union[None, Line]]
@@ -51,6 +219,17 @@ class TextWin(Win):
         # This is useful to make “go to next highlight“ work after a “move to separator”.
         self.nb_of_highlights_after_separator = 0
 
+        # When lazy (i.e. the tab is not displayed), new messages are only
+        # recorded, and their lines are built when the window is shown
+        # or scrolled.
+        self.lazy = False
+        self.pending_messages = []  # type: List[BaseMessage]
+        # Text buffer to rebuild everything from when leaving lazy mode
+        self.pending_rebuild = None  # type: Optional[TextBuffer]
+        # Incremented when lines are rebuilt, possibly into the same
+        # (cached) Line objects that now display differently.
+        self.revision = 0
+
     def toggle_lock(self) -> bool:
         if self.lock:
             self.release_lock()
@@ -66,7 +245,42 @@ class TextWin(Win):
             self.built_lines.append(line)
         self.lock = False
 
+    def make_lazy(self) -> None:
+        """
+        Stop building the lines of the new messages until the window
+        is displayed again.
+        """
+        self.lazy = True
+
+    def build_pending(self) -> None:
+        """
+        Leave the lazy mode, building the lines of all the messages
+        received in the meantime.
+        """
+        if not self.lazy:
+            return
+        self.lazy = False
+        messages = self.pending_messages
+        self.pending_messages = []
+        room = self.pending_rebuild
+        self.pending_rebuild = None
+        if room is not None:
+            self.rebuild_everything(room)
+        elif messages:
+            with_timestamps = config.get_bool('show_timestamps')
+            nick_size = config.get_int('max_nick_length')
+            nb = 0
+            for message in messages:
+                nb += self.build_new_message(
+                    message, timestamp=with_timestamps, nick_size=nick_size)
+            if self.pos != 0:
+                self.scroll_up(nb)
+        buf_size = len(self.built_lines)
+        if buf_size - self.pos < self.height:
+            self.pos = max(buf_size - self.height, 0)
+
     def scroll_up(self, dist: int = 14) -> bool:
+        self.build_pending()
         pos = self.pos
         self.pos += dist
         if self.pos + self.height > len(self.built_lines):
@@ -76,6 +290,7 @@ class TextWin(Win):
         return self.pos != pos
 
     def scroll_down(self, dist: int = 14) -> bool:
+        self.build_pending()
         pos = self.pos
         self.pos -= dist
         if self.pos <= 0:
@@ -86,13 +301,25 @@ class TextWin(Win):
                           message: BaseMessage,
                           clean: bool = True,
                           timestamp: bool = False,
-                          nick_size: int = 10) -> int:
+                          nick_size: int = 10,
+                          room: Optional[TextBuffer] = None) -> int:
         """
         Take one message, build it and add it to the list
         Return the number of lines that are built for the given
         message.
+        When lazy, room is the text buffer the message comes from, to
+        rebuild from instead once more messages are pending than lines
+        can be kept.
         """
-        lines = build_lines(
+        if self.lazy:
+            if self.pending_rebuild is None:
+                self.pending_messages.append(message)
+                if (room is not None and
+                        len(self.pending_messages) > self.lines_nb_limit):
+                    self.pending_messages = []
+                    self.pending_rebuild = room
+            return 0
+        lines = build_lines_cached(
             message, self.width, timestamp=timestamp, nick_size=nick_size
         )
         if self.lock:
@@ -107,20 +334,31 @@ class TextWin(Win):
             log.debug("Number of highlights after separator is now %s",
                       self.nb_of_highlights_after_separator)
         if clean:
-            while len(self.built_lines) > self.lines_nb_limit:
-                self.built_lines.pop(0)
+            self.built_lines.trim(self.lines_nb_limit)
         return len(lines)
 
+    def visible_lines(self) -> List[Union[None, Line]]:
+        """
+        The lines currently on the screen, from top to bottom.
+        """
+        if self.height <= 0:
+            return []
+        if self.pos == 0:
+            return self.built_lines[-self.height:]
+        return self.built_lines[-self.height - self.pos:-self.pos]
+
+    def damage_key(self) -> Tuple:
+        self.build_pending()
+        return (self.revision, tuple(self.visible_lines()))
+
     def refresh(self) -> None:
         log.debug('Refresh: %s', self.__class__.__name__)
         if self.height <= 0:
             return
-        if self.pos == 0:
-            lines = self.built_lines[-self.height:]
-        else:
-            lines = self.built_lines[-self.height - self.pos:-self.pos]
-        with_timestamps = config.get("show_timestamps")
-        nick_size = config.get("max_nick_length")
+        self.build_pending()
+        lines = self.visible_lines()
+        with_timestamps = config.get_bool('show_timestamps')
+        nick_size = config.get_int('max_nick_length')
         self._win.move(0, 0)
         self._win.erase()
         offset = 0
@@ -132,9 +370,7 @@ class TextWin(Win):
                 elif y == 0:
                     offset = msg.compute_offset(with_timestamps,
                                                 nick_size)
-                self.write_text(
-                    y, offset,
-                    line.prepend + line.msg.txt[line.start_pos:line.end_pos])
+                self.write_line(y, offset, line)
             else:
                 self.write_line_separator(y)
             if y != self.height - 1:
@@ -148,6 +384,22 @@ class TextWin(Win):
         """
         self.addstr_colored(txt, y, x)
 
+    def write_line(self, y: int, x: int, line: Line) -> None:
+        """
+        write the text of a built line, parsing its attributes only
+        if it was not done already (or the theme was reloaded, or color
+        pairs were reused since).
+        """
+        txt = line.prepend + line.msg.txt[line.start_pos:line.end_pos]
+        theme = get_theme()
+        generation = color_pairs.generation
+        cached = line.format_runs
+        if (cached is None or cached[0] is not theme
+                or cached[1] != generation or cached[2] != txt):
+            cached = line.format_runs = (theme, generation, txt,
+                                         compile_format(txt))
+        self.addstr_runs(cached[3], y, x)
+
     def resize(self, height: int, width: int, y: int, x: int, room: TextBuffer=None) -> None:
         if hasattr(self, 'width'):
             old_width = self.width
@@ -166,9 +418,18 @@ class TextWin(Win):
                 self.pos = 0
 
     def rebuild_everything(self, room: TextBuffer) -> None:
-        self.built_lines = []
-        with_timestamps = config.get('show_timestamps')
-        nick_size = config.get('max_nick_length')
+        if self.lazy:
+            self.pending_messages = []
+            self.pending_rebuild = room
+            return
+        self.revision += 1
+        self.built_lines = LineStore()
+        # The highlights are found again while building the lines
+        self.highlights = []
+        self.hl_pos = float('nan')
+        self.nb_of_highlights_after_separator = 0
+        with_timestamps = config.get_bool('show_timestamps')
+        nick_size = config.get_int('max_nick_length')
         for message in room.messages:
             self.build_new_message(
                 message,
@@ -177,16 +438,57 @@ class TextWin(Win):
                 nick_size=nick_size)
             if self.separator_after is message:
                 self.built_lines.append(None)
-        while len(self.built_lines) > self.lines_nb_limit:
-            self.built_lines.pop(0)
+                self.nb_of_highlights_after_separator = 0
+        self.built_lines.trim(self.lines_nb_limit)
+
+    def insert_history(self, room: TextBuffer, index: int, nb: int) -> None:
+        """
+        Build the lines of the nb history messages inserted at index in
+        the text buffer, and insert them before the lines of the message
+        following them, instead of rebuilding everything.
+        """
+        if not nb:
+            return
+        if self.lazy:
+            self.rebuild_everything(room)
+            return
+        messages = room.messages
+        if index + nb < len(messages):
+            following = messages[index + nb]  # type: Optional[BaseMessage]
+        else:
+            following = None
+        if following is None:
+            line_index = len(self.built_lines)  # type: Optional[int]
+        else:
+            line_index = self.built_lines.message_index(following)
+            if line_index is None:
+                # The following message is not displayed (trimmed,
+                # filtered…), we cannot know where to insert the lines.
+                self.rebuild_everything(room)
+                return
+        with_timestamps = config.get_bool('show_timestamps')
+        nick_size = config.get_int('max_nick_length')
+        lines = []  # type: List[Union[None, Line]]
+        for i in range(index, index + nb):
+            message = messages[i]
+            lines.extend(
+                build_lines_cached(
+                    message,
+                    self.width,
+                    timestamp=with_timestamps,
+                    nick_size=nick_size))
+            if self.separator_after is message:
+                lines.append(None)
+        self.built_lines.insert(line_index, lines)
+        self.built_lines.trim(self.lines_nb_limit)
 
     def remove_line_separator(self) -> None:
         """
         Remove the line separator
         """
         log.debug('remove_line_separator')
-        if None in self.built_lines:
-            self.built_lines.remove(None)
+        self.build_pending()
+        if self.built_lines.remove_separator():
             self.separator_after = None
 
     def add_line_separator(self, room: TextBuffer = None) -> None:
@@ -195,7 +497,8 @@ class TextWin(Win):
         room is a textbuffer that is needed to get the previous message
         (in case of resize)
         """
-        if None not in self.built_lines:
+        self.build_pending()
+        if self.built_lines.separator_index() is None:
             self.built_lines.append(None)
             self.nb_of_highlights_after_separator = 0
             log.debug("Resetting number of highlights after separator")
@@ -222,6 +525,7 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the next highlight…')
+        self.build_pending()
         if (not self.highlights or self.hl_pos != self.hl_pos
                 or self.hl_pos >= len(self.highlights) - 1):
             self.hl_pos = float('nan')
@@ -235,7 +539,7 @@ class TextWin(Win):
         log.debug("self.hl_pos = %s", self.hl_pos)
         hl = self.highlights[self.hl_pos]
         pos = None
-        while not pos:
+        while pos is None:
             try:
                 pos = self.built_lines.index(hl)
             except ValueError:
@@ -258,6 +562,7 @@ class TextWin(Win):
         highlights, scroll to the end of the buffer.
         """
         log.debug('Going to the previous highlight…')
+        self.build_pending()
         if not self.highlights or self.hl_pos <= 0:
             self.hl_pos = float('nan')
             self.pos = 0
@@ -269,7 +574,7 @@ class TextWin(Win):
         log.debug("self.hl_pos = %s", self.hl_pos)
         hl = self.highlights[self.hl_pos]
         pos = None
-        while not pos:
+        while pos is None:
             try:
                 pos = self.built_lines.index(hl)
             except ValueError:
@@ -289,9 +594,10 @@ class TextWin(Win):
         Scroll to the first message after the separator.  If no
         separator is present, scroll to the first message of the window
         """
-        if None in self.built_lines:
-            self.pos = len(self.built_lines) - self.built_lines.index(
-                None) - self.height + 1
+        self.build_pending()
+        separator = self.built_lines.separator_index()
+        if separator is not None:
+            self.pos = len(self.built_lines) - separator - self.height + 1
             if self.pos < 0:
                 self.pos = 0
         else:
@@ -310,26 +616,23 @@ class TextWin(Win):
         Find a message, and replace it with a new one
         (instead of rebuilding everything in order to correct a message)
         """
-        with_timestamps = config.get('show_timestamps')
-        nick_size = config.get('max_nick_length')
-        for i in range(len(self.built_lines) - 1, -1, -1):
-            current = self.built_lines[i]
-            if current is not None and current.msg.identifier == old_id:
-                index = i
-                while (
-                        index >= 0
-                        and current is not None
-                        and current.msg.identifier == old_id
-                        ):
-                    self.built_lines.pop(index)
-                    index -= 1
-                    if index >= 0:
-                        current = self.built_lines[index]
-                index += 1
-                lines = build_lines(
-                    message, self.width, timestamp=with_timestamps, nick_size=nick_size
-                )
-                for line in lines:
-                    self.built_lines.insert(index, line)
-                    index += 1
-                break
+        if self.lazy:
+            if self.pending_rebuild is not None:
+                return
+            for i, pending in enumerate(self.pending_messages):
+                if pending.identifier == old_id:
+                    self.pending_messages[i] = message
+                    return
+        index = self.built_lines.message_index(message)
+        if index is None and isinstance(message, Message) and message.old_message:
+            index = self.built_lines.message_index(message.old_message)
+        if index is None:
+            return
+        with_timestamps = config.get_bool('show_timestamps')
+        nick_size = config.get_int('max_nick_length')
+        lines = build_lines_cached(
+            message, self.width, timestamp=with_timestamps, nick_size=nick_size
+        )
+        self.built_lines.splice(
+            index, self.built_lines.message_lines_count(index), lines)
+        self.revision += 1
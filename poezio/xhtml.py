@@ -25,6 +25,7 @@ from typing import List, Dict, Optional, Union, Tuple
 
 from slixmpp.xmlstream import ET
 from poezio.config import config
+from poezio import poopt
 from poezio.colors import ncurses_color_to_rgb
 
 digits = '0123456789'  # never trust the modules
@@ -184,7 +185,6 @@ colors = {
 
 whitespace_re = re.compile(r'\s+')
 
-xhtml_attr_re = re.compile(r'\x19-?\d[^}]*}|\x19[buaio]')
 xhtml_data_re = re.compile(r'data:image/([a-z]+);base64,(.+)')
 xhtml_cid_re = re.compile(r'^cid:(sha1\+[0-9a-fA-F]+@bob\.xmpp\.org)$')
 poezio_color_double = re.compile(r'(?:\x19\d+}|\x19\d)+(\x19\d|\x19\d+})')
@@ -466,8 +466,7 @@ def clean_text(s: str) -> str:
     Remove all xhtml-im attributes (\x19etc) from the string with the
     complete color format, i.e \x19xxx}
     """
-    s = re.sub(xhtml_attr_re, "", s)
-    return s
+    return poopt.strip_attrs(s)
 
 
 def clean_text_simple(string: str) -> str:
@@ -11,7 +11,8 @@ from poezio.common import (_datetime_tuple as datetime_tuple, get_utc_time,
                            get_local_time, shell_split, _find_argument_quoted
                            as find_argument_quoted, _find_argument_unquoted as
                            find_argument_unquoted, parse_str_to_secs,
-                           parse_secs_to_str, safeJID, unique_prefix_of)
+                           parse_secs_to_str, safeJID, unique_prefix_of,
+                           build_highlight_regex)
 
 def test_utc_time():
     delta = timedelta(seconds=-3600)
@@ -82,3 +83,16 @@ def test_unique_prefix_of__normal_shared_prefix():
     assert unique_prefix_of("foobar", "foobaz") == "foobar"
     assert unique_prefix_of("fnord", "funky") == "fn"
     assert unique_prefix_of("asbestos", "aspergers") == "asb"
+
+
+def test_build_highlight_regex():
+    regex = build_highlight_regex('Toto', 'foo:b.r::Été')
+    assert regex.search('toto: hi')
+    assert regex.search('hi, TOTO')
+    assert not regex.search('totoro')
+    assert regex.search('FOOBAR')
+    assert regex.search('a b.r')
+    assert not regex.search('a bar')
+    assert regex.search("l'été")
+    assert not regex.search('nothing')
+    assert not build_highlight_regex('a+b', '').search('aab')
@@ -110,3 +110,50 @@ class TestTabNames(object):
         assert config_obj.get_by_tabname('test_int', 'toto@toto.com', fallback=False) == ''
 
 
+
+class TestCache(object):
+    def test_invalidation(self, config_obj):
+        assert config_obj.get('cached') == ''
+        config_obj.set_and_save('cached', 'a')
+        assert config_obj.get('cached') == 'a'
+        config_obj.set('cached', 'b')
+        assert config_obj.get('cached') == 'b'
+        assert config_obj.silent_set('cached', 'c')
+        assert config_obj.get('cached') == 'c'
+        assert config_obj.get_by_tabname('cached', 'toto@toto.com') == 'c'
+        config_obj.set_and_save('cached', 'd', section='@toto.com')
+        assert config_obj.get_by_tabname('cached', 'toto@toto.com') == 'd'
+        config_obj.remove_and_save('cached', section='@toto.com')
+        assert config_obj.get_by_tabname('cached', 'toto@toto.com') == 'c'
+        config_obj.remove_and_save('cached')
+        assert config_obj.get('cached') == ''
+
+    def test_typed(self, config_obj):
+        config_obj.set_and_save('typed_int', '12')
+        config_obj.set_and_save('typed_bool', 'true')
+        assert config_obj.get_int('typed_int') == 12
+        assert config_obj.get_bool('typed_bool') is True
+        assert config_obj.get_str('typed_int') == '12'
+        assert config_obj.get_int('typed_missing') == 0
+        assert config_obj.get_int('typed_bool') == 0
+        # the same option with another type is not mixed up in the cache
+        assert config_obj.get('typed_int', 1) == 12
+        # not a boolean: the default value
+        assert config_obj.get('typed_int', True) is True
+        config_obj.remove_and_save('typed_int')
+        config_obj.remove_and_save('typed_bool')
+        assert config_obj.get_int('typed_int') == 0
+
+    def test_cache_size(self, config_obj, monkeypatch):
+        monkeypatch.setattr(config, 'CONFIG_CACHE_SIZE', 3)
+        config_obj.invalidate_cache()
+        config_obj.set_and_save('bounded', 'a')
+        assert config_obj.get('bounded') == 'a'
+        for i in range(5):
+            config_obj.get_by_tabname('bounded', 'toto%s@toto.com' % i)
+            assert config_obj.get('bounded') == 'a'
+            assert len(config_obj._cache) <= 3
+        # the most recently used value is kept
+        assert ('bounded', config.DEFSECTION, None,
+                type(None)) in config_obj._cache
+        config_obj.remove_and_save('bounded')
@@ -31,3 +31,110 @@ def test_log_and_parse_messages():
         {'time': msg1['date'], 'history': True, 'txt': '\x195,-1}coucou', 'nickname': 'toto'},
         {'time': msg2['date'], 'history': True, 'txt': '\x195,-1}coucou\ncoucou', 'nickname': 'toto'},
     ]
+
+
+class LoggerConfig:
+    def __init__(self, **kwargs):
+        self.values = {
+            'use_log': True,
+            'log_sync': 'batched',
+            'log_buffer_size': 65536,
+            'log_flush_interval': 5,
+            'log_max_open_files': 64,
+            'log_index_interval': 100,
+        }
+        self.values.update(kwargs)
+
+    def get(self, option, default=None):
+        return self.values.get(option, default)
+
+    def get_by_tabname(self, option, tabname, default=None):
+        return self.values.get(option, default)
+
+
+def test_batched_log(monkeypatch, tmp_path):
+    from poezio import logger as logger_module
+    monkeypatch.setattr(logger_module, 'config', LoggerConfig())
+    monkeypatch.setattr(logger_module, 'log_dir', tmp_path)
+    logger = logger_module.Logger()
+    assert logger.log_message('toto@example.org', 'toto', 'coucou')
+    assert logger.log_message('toto@example.org', 'toto', 'coucou 2')
+    assert (tmp_path / 'toto@example.org').read_text() == ''
+    logger.flush_all()
+    lines = (tmp_path / 'toto@example.org').read_text().splitlines()
+    assert [line.split('>')[1].strip() for line in lines] == ['coucou', 'coucou 2']
+    logger.log_message('toto@example.org', 'toto', 'coucou 3')
+    logger.close('toto@example.org')
+    assert len((tmp_path / 'toto@example.org').read_text().splitlines()) == 3
+
+
+def test_batched_log_size(monkeypatch, tmp_path):
+    from poezio import logger as logger_module
+    monkeypatch.setattr(logger_module, 'config', LoggerConfig(log_buffer_size=100))
+    monkeypatch.setattr(logger_module, 'log_dir', tmp_path)
+    logger = logger_module.Logger()
+    logger.log_message('toto@example.org', 'toto', 'coucou')
+    assert (tmp_path / 'toto@example.org').read_text() == ''
+    logger.log_message('toto@example.org', 'toto', 'x' * 100)
+    assert len((tmp_path / 'toto@example.org').read_text().splitlines()) == 2
+    logger.flush_all()
+
+
+def test_max_open_files(monkeypatch, tmp_path):
+    from poezio import logger as logger_module
+    config = LoggerConfig(log_sync='always', log_max_open_files=2)
+    monkeypatch.setattr(logger_module, 'config', config)
+    monkeypatch.setattr(logger_module, 'log_dir', tmp_path)
+    logger = logger_module.Logger()
+    for jid in ('a@example.org', 'b@example.org', 'a@example.org', 'c@example.org', 'a@example.org', 'b@example.org'):
+        assert logger.log_message(jid, 'toto', 'coucou')
+    assert (logger.fd_hits, logger.fd_misses, logger.fd_evictions) == (2, 4, 2)
+    assert logger.stats() == ('2/2 log files open, 2 hits, 4 misses, '
+                              '2 evictions')
+    assert list(logger._fds) == ['a@example.org', 'b@example.org']
+    assert len((tmp_path / 'a@example.org').read_text().splitlines()) == 3
+    assert len((tmp_path / 'b@example.org').read_text().splitlines()) == 2
+
+
+def test_get_logs(monkeypatch, tmp_path):
+    from poezio import logger as logger_module
+    monkeypatch.setattr(logger_module, 'config', LoggerConfig())
+    monkeypatch.setattr(logger_module, 'log_dir', tmp_path)
+    logger = logger_module.Logger()
+    assert logger.get_logs('toto@example.org', nb=3) == ([], 0)
+    for i in range(5):
+        logger.log_message('toto@example.org', 'toto', 'coucou %s\nline' % i)
+    # buffered messages are written before reading the file
+    logs, offset = logger.get_logs('toto@example.org', nb=3)
+    assert [log['txt'].split('coucou ')[1] for log in logs] == ['2\nline', '3\nline', '4\nline']
+    assert offset > 0
+    logs, offset = logger.get_logs('toto@example.org', nb=3, end=offset)
+    assert [log['txt'].split('coucou ')[1] for log in logs] == ['0\nline', '1\nline']
+    assert offset == 0
+    assert logger.get_logs('toto@example.org', nb=3, end=offset) == ([], 0)
+    logger.flush_all()
+
+
+def test_log_index(monkeypatch, tmp_path):
+    from poezio import logger as logger_module
+    config = LoggerConfig(log_sync='always', log_index_interval=3)
+    monkeypatch.setattr(logger_module, 'config', config)
+    monkeypatch.setattr(logger_module, 'log_dir', tmp_path)
+    logger = logger_module.Logger()
+    assert logger.find_offset('toto@example.org', datetime.datetime(2020, 1, 1)) is None
+    dates = [datetime.datetime(2020, 1, 1, 12, minute) for minute in range(10)]
+    for i, date in enumerate(dates):
+        logger.log_message('toto@example.org', 'toto', 'coucou %s\nlinè' % i, date=date)
+    index = (tmp_path / 'toto@example.org.idx').read_bytes()
+    assert len(index) == 4 * logger_module.INDEX_RECORD_SIZE
+
+    logger.close('toto@example.org')
+    logger.rebuild_index('toto@example.org')
+    assert (tmp_path / 'toto@example.org.idx').read_bytes() == index
+
+    for i, date in enumerate(dates):
+        offset = logger.find_offset('toto@example.org', date)
+        logs, _ = logger.get_logs('toto@example.org', nb=1, end=offset)
+        assert [log['time'] for log in logs] == dates[i - 1:i]
+    end = logger.find_offset('toto@example.org', datetime.datetime(2021, 1, 1))
+    assert end == len((tmp_path / 'toto@example.org').read_bytes())
@@ -0,0 +1,161 @@
+"""
+Test the MAM query scheduler
+"""
+import asyncio
+from types import SimpleNamespace
+
+from slixmpp import JID
+
+from poezio import mam
+
+
+class MAMConfig:
+    def __init__(self, **kwargs):
+        self.values = {'max_mam_queries': 2}
+        self.values.update(kwargs)
+
+    def get(self, option, default=None):
+        return self.values.get(option, default)
+
+    def get_by_tabname(self, option, tabname):
+        return self.values.get(option)
+
+
+def make_tab(jid, core, state='normal'):
+    return SimpleNamespace(
+        jid=JID(jid), core=core, state=state, closed=False,
+        query_status=False)
+
+
+def test_scheduler(monkeypatch):
+    monkeypatch.setattr(mam, 'config', MAMConfig())
+    core = SimpleNamespace(tabs=SimpleNamespace(current_tab=None))
+    tabs = [make_tab('room%s@example.org' % i, core) for i in range(5)]
+    tabs[3].state = 'highlight'
+    core.tabs.current_tab = tabs[4]
+    started = []
+    running = []
+
+    async def query(tab):
+        started.append(tab)
+        running.append(tab)
+        assert len(running) <= 2
+        await asyncio.sleep(0)
+        running.remove(tab)
+        tab.query_status = False
+
+    async def run():
+        scheduler = mam.MAMScheduler()
+        for tab in tabs:
+            assert scheduler.schedule(tab, query)
+        assert not scheduler.schedule(tabs[2], query)
+        assert all(tab.query_status for tab in tabs)
+        while len(started) < len(tabs) or running:
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert started == [tabs[0], tabs[1], tabs[4], tabs[3], tabs[2]]
+
+
+def test_disco_cache():
+    calls = []
+
+    async def get_info(jid):
+        calls.append(jid)
+        await asyncio.sleep(0)
+        return {'disco_info': SimpleNamespace(
+            get_features=lambda: ['urn:xmpp:mam:2'])}
+
+    core = SimpleNamespace(xmpp=SimpleNamespace(
+        plugin={'xep_0030': SimpleNamespace(get_info=get_info)}))
+
+    async def run():
+        jid = JID('room@example.org')
+        results = await asyncio.gather(
+            mam.get_features(core, jid), mam.get_features(core, jid))
+        assert results == [['urn:xmpp:mam:2']] * 2
+        await mam.get_features(core, jid)
+
+    mam.clear_disco_cache()
+    asyncio.run(run())
+    assert calls == [JID('room@example.org')]
+    mam.clear_disco_cache()
+
+
+def make_history_tab():
+    from poezio.text_buffer import TextBuffer
+    return SimpleNamespace(
+        jid=JID('room@example.org'), closed=False, query_status=True,
+        log_offset=None, text_win=SimpleNamespace(height=5),
+        _text_buffer=TextBuffer(100),
+        core=SimpleNamespace(refresh_window=lambda: None))
+
+
+def make_messages(name, nb, first):
+    from datetime import timedelta
+    from poezio.ui.types import Message
+    return [
+        Message('%s %s' % (name, i), 'toto',
+                time=first + timedelta(minutes=i))
+        for i in range(nb)
+    ]
+
+
+def run_new_tab_open(monkeypatch, tab, local, pages):
+    monkeypatch.setattr(mam, 'config', MAMConfig(load_log=10))
+    monkeypatch.setattr(mam, 'fetch_local_history',
+                        lambda tab, amount, end: list(local))
+    queries = []
+
+    async def iterate_history(tab, start=None, end=None, amount=100):
+        queries.append((start, end, amount))
+        for page in pages.pop(0):
+            yield page
+
+    monkeypatch.setattr(mam, 'iterate_history', iterate_history)
+    asyncio.run(mam.on_new_tab_open(tab))
+    assert not tab.query_status
+    return queries
+
+
+def test_new_tab_open_offline_messages(monkeypatch):
+    from datetime import datetime, timedelta
+    tab = make_history_tab()
+    local = make_messages('local', 3, datetime(2020, 1, 1, 10))
+    offline = make_messages('offline', 2, datetime(2020, 1, 1, 11))
+    older = make_messages('older', 4, datetime(2020, 1, 1, 9))
+    queries = run_new_tab_open(monkeypatch, tab, local,
+                               [[offline], [older]])
+    assert list(tab._text_buffer.messages) == older + local + offline
+    start, _, amount = queries[0]
+    assert start == local[-1].time + timedelta(seconds=1)
+    assert amount == 10
+    # The older messages are requested before the first local one
+    assert queries[1] == (None, None, 5)
+
+
+def test_new_tab_open_logs_too_old(monkeypatch):
+    from datetime import datetime
+    tab = make_history_tab()
+    local = make_messages('local', 3, datetime(2020, 1, 1, 10))
+    offline = make_messages('offline', 10, datetime(2020, 1, 1, 11))
+    queries = run_new_tab_open(monkeypatch, tab, local,
+                               [[offline[5:], offline[:5]]])
+    assert list(tab._text_buffer.messages) == offline
+    assert len(queries) == 1
+    # the logs would leave a hole: only the server is used from now on
+    assert tab.log_offset == 0
+
+
+def test_new_tab_open_no_mam(monkeypatch):
+    from datetime import datetime
+    tab = make_history_tab()
+    local = make_messages('local', 3, datetime(2020, 1, 1, 10))
+
+    class NoMAM:
+        def __iter__(self):
+            raise mam.NoMAMSupportException()
+
+    queries = run_new_tab_open(monkeypatch, tab, local, [NoMAM()])
+    assert list(tab._text_buffer.messages) == local
+    assert len(queries) == 1
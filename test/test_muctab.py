@@ -0,0 +1,187 @@
+"""
+Test the batched processing of the MUC presences
+"""
+
+import asyncio
+from xml.etree import ElementTree as ET
+
+import pytest
+
+from slixmpp import JID, Presence
+
+from poezio.tabs import muctab
+from poezio.tabs.muctab import MucTab
+
+
+class MucConfig(object):
+    def __init__(self, delay):
+        self.delay = delay
+
+    def get(self, option, *args, **kwargs):
+        if option == 'muc_presence_batch_delay':
+            return self.delay
+        return ''
+
+    get_by_tabname = get
+
+
+class Events(object):
+    def trigger(self, *args, **kwargs):
+        pass
+
+
+class Tabs(object):
+    current_tab = None
+
+
+class Core(object):
+    def __init__(self):
+        self.events = Events()
+        self.tabs = Tabs()
+        self.errors = []
+
+    def room_error(self, presence, room):
+        self.errors.append(presence)
+
+    def schedule_refresh(self):
+        pass
+
+
+def make_presence(nick, typ=None, codes=()):
+    presence = Presence()
+    presence['from'] = 'room@muc.example/%s' % nick
+    if typ is not None:
+        presence['type'] = typ
+    if codes:
+        x = ET.SubElement(presence.xml,
+                          '{http://jabber.org/protocol/muc#user}x')
+        for code in codes:
+            ET.SubElement(x, '{http://jabber.org/protocol/muc#user}status',
+                          {'code': code})
+    return presence
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def make_tab(monkeypatch, delay):
+    monkeypatch.setattr(muctab, 'config', MucConfig(delay))
+    tab = MucTab.__new__(MucTab)
+    tab.core = Core()
+    tab.jid = JID('room@muc.example')
+    tab.joined = True
+    tab._state = 'normal'
+    tab.presence_buffer = []
+    tab.presence_batch_handle = None
+    tab.join_part_batch = None
+    tab.messages = []
+    tab.processed = []
+
+    def handle_presence_joined(presence, status_codes):
+        tab.processed.append(presence)
+        nick = presence['from'].resource
+        tab.add_join_part_message('%s joined' % nick, nick, '1',
+                                  presence['type'] != 'unavailable')
+
+    def handle_presence_unjoined(presence, deterministic, own=False):
+        tab.processed.append(presence)
+        if own:
+            tab.joined = True
+
+    tab.handle_presence_joined = handle_presence_joined
+    tab.handle_presence_unjoined = handle_presence_unjoined
+    tab.add_message = lambda msg, typ=1: tab.messages.append(msg.txt)
+    tab.reset_lag = lambda: None
+    tab.enable_self_ping_event = lambda: None
+    tab.disable_self_ping_event = lambda: None
+    tab.core.tabs.current_tab = tab
+    return tab
+
+
+def test_batch_summary(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 0.01)
+    for i in range(12):
+        tab.handle_presence(make_presence('nick%s' % i))
+    tab.handle_presence(make_presence('gone', typ='unavailable'))
+    assert not tab.processed
+    assert tab.presence_batch_handle is not None
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert len(tab.processed) == 13
+    assert tab.presence_batch_handle is None
+    assert len(tab.messages) == 1
+    joined, left = tab.messages[0].split('\n')
+    assert 'nick9' in joined and 'nick10' not in joined
+    assert joined.endswith('and 2 others joined the room')
+    assert 'gone' in left and left.endswith('left the room')
+
+
+def test_single_message(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 0.01)
+    tab.handle_presence(make_presence('toto'))
+    tab.process_presence_buffer()
+    assert len(tab.messages) == 1
+    assert tab.messages[0].endswith('toto joined')
+
+
+def test_no_delay(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 0)
+    tab.handle_presence(make_presence('toto'))
+    assert len(tab.processed) == 1
+    assert tab.presence_batch_handle is None
+    assert len(tab.messages) == 1
+
+
+def test_own_presence_flush(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 10)
+    tab.joined = False
+    tab.handle_presence(make_presence('toto'))
+    assert not tab.processed
+    tab.handle_presence(make_presence('me', codes=('110', )))
+    assert len(tab.processed) == 2
+    assert tab.joined
+    assert tab.presence_batch_handle is None
+
+
+def test_error_flush(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 10)
+    tab.handle_presence(make_presence('toto'))
+    error = make_presence('me', typ='error')
+    tab.handle_presence(error)
+    assert len(tab.processed) == 1
+    assert tab.core.errors == [error]
+    assert tab.presence_batch_handle is None
+
+
+def test_disconnect(monkeypatch, loop):
+    tab = make_tab(monkeypatch, 0.01)
+    tab.users = muctab.Occupants()
+    tab.handle_presence(make_presence('toto'))
+    handle = tab.presence_batch_handle
+    tab.disconnect()
+    assert handle.cancelled()
+    assert tab.presence_batch_handle is None
+    assert not tab.presence_buffer
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert not tab.processed
+    assert not tab.joined
+
+
+def test_private_chatstate_flush(monkeypatch, loop):
+    from slixmpp import Message
+    from poezio.core.handlers import HandlerCore
+    tab = make_tab(monkeypatch, 10)
+    tab.core.tabs.by_name_and_class = lambda name, cls: (
+        tab if cls is MucTab and name == tab.jid.bare else None)
+    tab.handle_presence(make_presence('toto'))
+    message = Message()
+    message['from'] = 'room@muc.example/toto'
+    HandlerCore(tab.core)._on_chatstate_private_conversation(
+        message, 'composing')
+    assert len(tab.processed) == 1
+    assert tab.presence_batch_handle is None
@@ -2,6 +2,14 @@
 Test of the poopt module
 """
 
+import importlib.util
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+from poezio import poopt
 from poezio.poopt import cut_text
 
 def test_cut_text():
@@ -14,3 +22,131 @@ def test_cut_text():
 
     text = 'vivent les réfrigérateurs'
     assert cut_text(text, 6) == [(0, 6), (6, 10), (11, 17), (17, 23), (23, 25)]
+
+
+def load_python_poopt():
+    """Load the CFFI/pure python poopt, even if the C module is built"""
+    path = Path(poopt.__file__).parent / 'poopt.py'
+    spec = importlib.util.spec_from_file_location('poopt_python', str(path))
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except (ImportError, OSError):
+        pytest.skip('cffi is not available')
+    return module
+
+
+def random_formatted_texts(nb=2000):
+    rand = random.Random(42)
+    pieces = ['\x19', '\x19b', '\x19B', '\x19o', '\x19u', '\x19i', '\x19a',
+              '\x19x', '\x191}', '\x19-1}', '\x1912,-1}', '\x193,-1,b}',
+              '\x19-', '\x19-x}', '}', 'a', 'é', '😆', ' ', '\n', '1',
+              '\x19٣}', 'İ']
+    for _ in range(nb):
+        yield ''.join(rand.choice(pieces) for _ in range(rand.randint(0, 8)))
+
+
+def reference_parse_attrs(text, previous=None):
+    """The parse_attrs of poezio.ui.funcs before it used split_attrs"""
+    next_attr_char = text.find('\x19')
+    attrs = previous if previous else []
+    while next_attr_char != -1 and text:
+        if next_attr_char + 1 < len(text):
+            attr_char = text[next_attr_char + 1].lower()
+        else:
+            attr_char = '\0'
+        if attr_char == 'o':
+            attrs = []
+        elif attr_char in ('u', 'b', 'i'):
+            attrs.append(attr_char)
+        if attr_char in '0123456789-' and attr_char:
+            color_str = text[next_attr_char + 1:text.find('}', next_attr_char)]
+            if color_str:
+                attrs.append(color_str + '}')
+            text = text[next_attr_char + len(color_str) + 2:]
+        else:
+            text = text[next_attr_char + 2:]
+        next_attr_char = text.find('\x19')
+    return attrs
+
+
+def test_split_attrs():
+    assert poopt.split_attrs('') == [('', None)]
+    assert poopt.split_attrs('a\x19bb\x191}c') == [
+        ('a', 'b'), ('b', '1'), ('c', None)]
+    assert poopt.split_attrs('\x193,-1,u}é\x19') == [
+        ('', '3,-1,u'), ('é', ''), ('', None)]
+    python_poopt = load_python_poopt()
+    for text in random_formatted_texts():
+        assert poopt.split_attrs(text) == python_poopt.split_attrs(text)
+
+
+def test_strip_attrs():
+    xhtml_attr_re = re.compile(r'\x19-?\d[^}]*}|\x19[buaio]')
+    assert poopt.strip_attrs('a\x19bb\x191}c\x19') == 'abc\x19'
+    python_poopt = load_python_poopt()
+    for text in random_formatted_texts():
+        expected = xhtml_attr_re.sub('', text)
+        assert poopt.strip_attrs(text) == expected
+        assert python_poopt.strip_attrs(text) == expected
+
+
+def test_parse_attrs():
+    from poezio.ui.funcs import parse_attrs
+    for text in random_formatted_texts():
+        assert parse_attrs(text) == reference_parse_attrs(text)
+        assert parse_attrs(text, ['b']) == reference_parse_attrs(text, ['b'])
+
+
+def test_cut_text_attrs():
+    from poezio.ui.funcs import parse_attrs
+    assert poopt.cut_text_attrs('', 5) == [(0, 0, ())]
+    assert poopt.cut_text_attrs('ab\x19bcd \x191}ef', 5) == [
+        (0, 6, ()), (7, 12, ('b',))]
+    assert poopt.cut_text_attrs('\x19u\x1912}a\nb\x19oc', 5) == [
+        (0, 8, ()), (8, 12, ('u', '12}'))]
+    assert poopt.cut_text_attrs('ab\x193,-1,b}cd', 4) == [(0, 12, ())]
+    python_poopt = load_python_poopt()
+    rand = random.Random(42)
+    # Only well-formed codes
+    pieces = ['\x19b', '\x19o', '\x19u', '\x19i', '\x19a', '\x191}',
+              '\x19-1}', '\x1912,-1}', '\x193,-1,b}', 'a', 'é', '😆', ' ',
+              '  ', '\n', 'word']
+    for _ in range(2000):
+        text = ''.join(rand.choice(pieces) for _ in range(rand.randint(1, 30)))
+        width = rand.randint(1, 12)
+        lines = poopt.cut_text_attrs(text, width)
+        assert python_poopt.cut_text_attrs(text, width) == lines
+        # cut_text stops skipping a color at the 'b' of its attributes
+        if ',b}' not in text:
+            assert [line[:2] for line in lines] == cut_text(text, width)
+        attrs = []
+        for start, end, line_attrs in lines:
+            assert line_attrs == tuple(attrs)
+            attrs = parse_attrs(text[start:end], attrs)
+
+
+def test_width_table():
+    python_poopt = load_python_poopt()
+    for character in list(range(0x3000)) + [0xfffd, 0x1f606, 0x1f606, 0x20000]:
+        char = chr(character)
+        assert python_poopt.xwcwidth(char) == python_poopt._wcwidth(character)
+        assert python_poopt.wcswidth(char * 3) == 3 * python_poopt._wcwidth(character)
+    rand = random.Random(42)
+    pieces = ['a', 'word', ' ', '\n', '\t', '\x7f', '\x19b', '\x191}', 'é',
+              'エメ', '😆', '́']
+    for _ in range(1000):
+        text = ''.join(rand.choice(pieces) for _ in range(rand.randint(1, 20)))
+        width = rand.randint(1, 12)
+        widths = [python_poopt._wcwidth(ord(char)) for char in text]
+        assert python_poopt.wcswidth(text) == sum(widths)
+        columns = 0
+        for spos, cols in enumerate(widths):
+            if columns == width or columns + cols > width:
+                break
+            columns += cols
+        else:
+            spos = len(text)
+        assert python_poopt.cut_by_columns(text, width) == text[:spos]
+        assert (python_poopt.cut_text_attrs(text, width)
+                == poopt.cut_text_attrs(text, width))
@@ -57,6 +57,37 @@ def test_message_nb_limit():
     assert len(buf.messages) == 5
 
 
+def test_message_nb_limit_index():
+    buf = TextBuffer(5)
+    for i in range(10):
+        buf.add_message(Message("%s" % i, 'toto', identifier='id%s' % i))
+    assert buf.ack_message('id2', None) is None
+    msg = buf.ack_message('id7', None)
+    assert msg is buf.messages[2]
+    assert msg.ack == 1
+
+
+def test_modify_message():
+    buf = TextBuffer(5)
+    for i in range(3):
+        buf.add_message(Message("%s" % i, 'toto', identifier='id%s' % i, jid='a@b/c'))
+    msg = buf.modify_message('new', 'id1', 'id3', jid='a@b/c')
+    assert buf.messages[1] is msg
+    assert msg.old_message.txt == '1'
+    msg2 = buf.modify_message('newer', 'id3', 'id4', jid='a@b/c')
+    assert buf.messages[1] is msg2
+    assert msg2.revisions == 2
+
+
+def test_index_after_history(buf2048):
+    msg1 = Message('1', 'q', identifier='1')
+    msg2 = Message('2', 's', identifier='2')
+    buf2048.add_message(msg1)
+    buf2048.add_history_messages([msg2])
+    assert buf2048.nack_message('err', '1', None) is msg1
+    assert buf2048.nack_message('err', '2', None) is msg2
+
+
 def test_find_gap(buf2048, msgs_noleave):
     msg1 = Message('1', 'q')
     msg2 = Message('2', 's')
@@ -184,7 +215,7 @@ def test_add_history_messages(buf2048):
     msg6 = Message('6', 'h')
     gap = buf2048.find_last_gap_muc()
     buf2048.add_history_messages([msg5, msg6], gap=gap)
-    assert buf2048.messages == [msg1, msg2, leave, msg5, msg6, join, msg3, msg4]
+    assert list(buf2048.messages) == [msg1, msg2, leave, msg5, msg6, join, msg3, msg4]
 
 
 def test_add_history_empty(buf2048):
@@ -194,5 +225,5 @@ def test_add_history_empty(buf2048):
     msg4 = Message('4', 'f')
     buf2048.add_message(msg1)
     buf2048.add_history_messages([msg2, msg3, msg4])
-    assert buf2048.messages == [msg2, msg3, msg4, msg1]
+    assert list(buf2048.messages) == [msg2, msg3, msg4, msg1]
 
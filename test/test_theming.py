@@ -22,3 +22,68 @@ def test_dump_tuple():
     assert dump_tuple((1, 2, 'u')) == '1,2,u'
 
 
+
+class ColorPairsConfig(object):
+    def get(self, option, *args, **kwargs):
+        assert option == 'max_color_pairs'
+        return 2
+
+def test_color_pairs(monkeypatch):
+    from poezio import theming
+    init_pair_calls = []
+    monkeypatch.setattr(theming, 'config', ColorPairsConfig())
+    monkeypatch.setattr(theming.curses, 'init_pair',
+                        lambda *args: init_pair_calls.append(args),
+                        raising=False)
+    pairs = theming.ColorPairs()
+    assert pairs.get((1, -1)) == 1
+    assert pairs.get((2, -1)) == 2
+    assert pairs.get((1, -1)) == 1
+    assert pairs.generation == 0
+    # (2, -1) is the least recently used
+    assert pairs.get((3, -1)) == 2
+    assert pairs.generation == 1
+    assert pairs.get((1, -1)) == 1
+    assert init_pair_calls == [(1, 1, -1), (2, 2, -1), (2, 3, -1)]
+    assert (pairs.hits, pairs.misses, pairs.evictions) == (2, 3, 1)
+    assert pairs.stats().startswith('2/2 color pairs used')
+    pairs.clear()
+    assert pairs.get((3, -1)) == 1
+
+def test_nick_color(monkeypatch):
+    from poezio import colors
+    computed = []
+    def ccg_text_to_color(palette, text):
+        computed.append(text)
+        return palette[0]
+    monkeypatch.setattr(colors, 'ccg_text_to_color', ccg_text_to_color)
+    monkeypatch.setattr(colors, 'NICK_COLOR_CACHE_SIZE', 2)
+    nick_colors = [(1, -1), (2, -1), (3, -1)]
+    palette = {0: 42}
+    assert colors.nick_color(palette, nick_colors, 'a') == (42, -1)
+    assert colors.nick_color(palette, nick_colors, 'a') == (42, -1)
+    assert computed == ['a']
+    colors.nick_color(palette, nick_colors, 'b')
+    colors.nick_color(palette, nick_colors, 'a')
+    # b is the least recently used
+    colors.nick_color(palette, nick_colors, 'c')
+    colors.nick_color(palette, nick_colors, 'a')
+    colors.nick_color(palette, nick_colors, 'b')
+    assert computed == ['a', 'b', 'c', 'b']
+    # another palette (e.g. a theme reload) empties the cache
+    assert colors.nick_color({0: 12}, nick_colors, 'a') == (12, -1)
+    assert computed[-1] == 'a'
+    # without a palette, one of the nick colors is used
+    color = colors.nick_color({}, nick_colors, 'a')
+    assert color in nick_colors
+    assert colors.nick_color({}, nick_colors, 'a') is color
+
+def test_ccg_palette_lookup():
+    from poezio import colors
+    palette = {10: 1, 12: 2, 300: 3, 20: 4}
+    for angle in [x / 4 for x in range(0, 361 * 4)]:
+        assert (colors.ccg_palette_lookup(palette, angle) ==
+                colors._linear_palette_lookup(palette, angle))
+    # on a tie, the first color of the palette wins
+    assert colors.ccg_palette_lookup(palette, 11) == 1
+    assert colors.ccg_palette_lookup({12: 2, 10: 1}, 11) == 2
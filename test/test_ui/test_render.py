@@ -2,7 +2,7 @@ import pytest
 from contextlib import contextmanager
 from datetime import datetime
 from poezio.theming import get_theme
-from poezio.ui.render import build_lines, Line, write_pre
+from poezio.ui.render import build_lines, build_lines_cached, Line, write_pre
 from poezio.ui.consts import SHORT_FORMAT
 from poezio.ui.types import BaseMessage, Message, StatusMessage, XMLLog
 
@@ -39,6 +39,43 @@ def test_simple_render_status():
     assert msg.txt == "Coucou titi"
 
 
+def test_build_lines_cached():
+    msg = Message(txt='coucou ' * 20, nickname='toto')
+    lines = build_lines_cached(msg, 40, True, 10)
+    assert build_lines_cached(msg, 40, True, 10) is lines
+    assert build_lines_cached(msg, 100, True, 10) is not lines
+    assert build_lines_cached(msg, 40, True, 10) is lines
+    msg.layout_revision += 1
+    assert build_lines_cached(msg, 40, True, 10) is not lines
+
+
+def test_build_lines_cached_theme(monkeypatch):
+    from poezio import theming
+    msg = Message(txt='coucou ' * 20, nickname='toto')
+    msg.ack = 1
+    lines = build_lines_cached(msg, 40, True, 10)
+
+    class WideAckTheme(theming.Theme):
+        CHAR_ACK_RECEIVED = '✔✔✔✔✔'
+
+    monkeypatch.setattr(theming, 'theme', WideAckTheme())
+    new_lines = build_lines_cached(msg, 40, True, 10)
+    assert new_lines is not lines
+    assert new_lines[0].end_pos < lines[0].end_pos
+    assert build_lines_cached(msg, 40, True, 10) is new_lines
+
+
+def test_build_lines_cached_status():
+    class Obj:
+        name = 'toto'
+    msg = StatusMessage("Coucou {name}", {'name': lambda: Obj.name})
+    build_lines_cached(msg, 100, True, 10)
+    Obj.name = 'titi'
+    line = build_lines_cached(msg, 100, True, 10)[0]
+    assert (line.start_pos, line.end_pos) == (0, 11)
+    assert msg.txt == "Coucou titi"
+
+
 class FakeBuffer:
     def __init__(self):
         self.text = ''
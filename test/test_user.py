@@ -2,10 +2,11 @@
 Tests for the User class
 """
 
+import random
 import pytest
-from datetime import datetime
+from datetime import datetime, timedelta
 from slixmpp import JID
-from poezio.user import User
+from poezio.user import Occupants, User
 
 
 @pytest.fixture
@@ -43,3 +44,74 @@ def test_change_nick(user1):
 def test_change_color(user1):
     user1.change_color('blue', deterministic=False)
     assert user1.color == (21, -1)
+
+
+def test_occupants():
+    rand = random.Random(42)
+    roles = ['visitor', 'participant', 'moderator']
+    users = {}
+    occupants = Occupants()
+    for _ in range(1000):
+        nick = 'Nick%d' % rand.randint(0, 400)
+        user = users.get(nick)
+        action = rand.random()
+        if user is None:
+            user = User(nick, 'none', '', '', rand.choice(roles),
+                        JID('foo@muc/' + nick), False, 'red')
+            users[nick] = user
+            occupants.add(user)
+        elif action < 0.4:
+            del users[nick]
+            occupants.remove(user)
+        elif action < 0.7:
+            occupants.remove(user)
+            user.update('none', '', '', rand.choice(roles))
+            occupants.add(user)
+        else:
+            new_nick = nick.lower() if nick[0] == 'N' else nick.title()
+            if new_nick in users:
+                continue
+            occupants.remove(user)
+            del users[nick]
+            user.change_nick(new_nick)
+            users[new_nick] = user
+            occupants.add(user)
+        # Users with the same case-insensitive nick are sorted by nick
+        expected = sorted(sorted(users.values(), key=lambda u: u.nick))
+        assert list(occupants) == expected
+        assert len(occupants) == len(expected)
+        assert occupants.get(nick) is users.get(nick)
+    assert occupants[5:17] == expected[5:17]
+    assert occupants[-1] is expected[-1]
+    assert occupants[len(expected) - 3:len(expected) + 10] == expected[-3:]
+    with pytest.raises(ValueError):
+        occupants.remove(User('unknown', 'none', '', '', 'visitor', JID('foo@muc/unknown'), False, 'red'))
+    occupants.clear()
+    assert not occupants
+    assert list(occupants) == []
+
+
+def test_occupants_last_talked():
+    rand = random.Random(42)
+    occupants = Occupants()
+    for i in range(200):
+        nick = rand.choice(['Alice', 'alfred', 'Bob', 'bea', 'Zed']) + str(i)
+        occupants.add(User(nick, 'none', '', '', rand.choice(['visitor', 'participant', 'moderator']),
+                           JID('foo@muc/' + nick), False, 'red'))
+    for step in range(500):
+        user = rand.choice(list(occupants))
+        # mostly in order, sometimes older times from the history
+        if rand.random() < 0.9:
+            time = datetime(2020, 1, 1, 0, 0, 0) + timedelta(seconds=step)
+        else:
+            time = datetime(2019, 1, 1) + timedelta(seconds=rand.randint(0, 10000))
+        occupants.set_last_talked(user, time)
+        if step % 50 == 0:
+            occupants.remove(user)
+            user.change_nick(user.nick + '_')
+            occupants.add(user)
+        expected = sorted(occupants, key=lambda u: u.last_talked, reverse=True)
+        assert list(occupants.by_last_talked()) == expected
+        for prefix in ('', 'al', 'AL', 'b', 'bea1', 'x'):
+            assert occupants.nicks_by_last_talked(prefix) == [
+                u.nick for u in expected if u.nick.lower().startswith(prefix.lower())]
@@ -73,3 +73,337 @@ class TestInput(object):
 
         assert input.text == 'this is a line of textz'
 
+
+class TextWinConfig(object):
+    def get(self, option, *args, **kwargs):
+        return {'show_timestamps': True, 'max_nick_length': 10}.get(option, '')
+    get_bool = get_int = get
+
+@pytest.fixture
+def text_win(monkeypatch):
+    from poezio.windows import text_win as text_win_module
+    from poezio import text_buffer as text_buffer_module
+    monkeypatch.setattr(text_win_module, 'config', TextWinConfig())
+    monkeypatch.setattr(text_buffer_module, 'config', TextWinConfig())
+    win = text_win_module.TextWin(100)
+    win.height, win.width = 10, 40
+    return win
+
+class TestTextWin(object):
+
+    def test_lazy(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        buf.add_message(Message('coucou', 'toto'))
+        text_win.make_lazy()
+        for i in range(5):
+            buf.add_message(Message('message %s' % i, 'toto'))
+        assert len(text_win.built_lines) == 1
+        assert len(text_win.pending_messages) == 5
+        text_win.build_pending()
+        assert not text_win.lazy
+        assert [line.msg for line in text_win.built_lines] == list(buf.messages)
+
+    def test_lazy_rebuild(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        text_win.make_lazy()
+        buf.add_message(Message('coucou', 'toto'))
+        buf.add_history_messages([Message('history', 'toto')])
+        assert not text_win.built_lines
+        assert not text_win.pending_messages
+        text_win.scroll_up(1)
+        assert [line.msg for line in text_win.built_lines] == list(buf.messages)
+
+    def test_lazy_limit(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        text_win.lines_nb_limit = 20
+        text_win.make_lazy()
+        for i in range(21):
+            buf.add_message(Message('message %s' % i, 'toto'))
+        assert not text_win.pending_messages
+        assert text_win.pending_rebuild is buf
+        text_win.build_pending()
+        assert len(text_win.built_lines) == 20
+        assert text_win.built_lines[-1].msg is buf.messages[-1]
+
+    def test_lazy_scrolled(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        for i in range(20):
+            buf.add_message(Message('message %s' % i, 'toto'))
+        text_win.scroll_up(5)
+        text_win.make_lazy()
+        buf.add_message(Message('coucou', 'toto'))
+        assert text_win.lazy
+        assert text_win.pos == 5
+        text_win.build_pending()
+        assert text_win.pos == 6
+
+    def test_rebuild_highlights(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        buf.add_message(Message('hl 1', 'toto', highlight=True))
+        text_win.add_line_separator(buf)
+        for i in range(2, 4):
+            buf.add_message(Message('hl %s' % i, 'toto', highlight=True))
+        buf.add_message(Message('no hl', 'toto'))
+        for i in range(2):
+            text_win.rebuild_everything(buf)
+        assert [line.msg.txt for line in text_win.highlights] == [
+            'hl 1', 'hl 2', 'hl 3'
+        ]
+        assert text_win.nb_of_highlights_after_separator == 2
+        text_win.previous_highlight()
+        assert text_win.hl_pos == 2
+        text_win.previous_highlight()
+        assert text_win.hl_pos == 1
+
+class TestLineStore(object):
+
+    @staticmethod
+    def make_lines(msg, nb):
+        from poezio.ui.render import Line
+        return [Line(msg, i, i + 1, '') for i in range(nb)]
+
+    def test_append_trim(self):
+        from poezio.windows.text_win import LineStore
+        from poezio.ui.types import BaseMessage
+        store = LineStore()
+        msgs = [BaseMessage(str(i)) for i in range(50)]
+        for msg in msgs:
+            store.extend(self.make_lines(msg, 2))
+        store.append(None)
+        store.trim(21)
+        assert len(store) == 21
+        assert store[-1] is None
+        assert store.separator_index() == 20
+        assert store.message_index(msgs[0]) is None
+        assert store.message_index(msgs[40]) == 0
+        assert store[0].msg is msgs[40]
+        assert [line.msg for line in store[-3:-1]] == [msgs[49], msgs[49]]
+
+    def test_splice(self):
+        from poezio.windows.text_win import LineStore
+        from poezio.ui.types import BaseMessage
+        store = LineStore()
+        msgs = [BaseMessage(str(i)) for i in range(10)]
+        model = []
+        for msg in msgs:
+            lines = self.make_lines(msg, 3)
+            store.extend(lines)
+            model.extend(lines)
+        store.append(None)
+        model.append(None)
+        # replace a message near the end, then near the start
+        for msg in (msgs[8], msgs[1]):
+            index = store.message_index(msg)
+            assert store.message_lines_count(index) == 3
+            new_lines = self.make_lines(msg, 1)
+            store.splice(index, 3, new_lines)
+            model[index:index + 3] = new_lines
+            assert list(store) == model
+        history = BaseMessage('history')
+        store.insert(0, self.make_lines(history, 4))
+        model[0:0] = store[0:4]
+        assert list(store) == model
+        for i, line in enumerate(model):
+            assert store.index(line) == i
+        for msg in msgs:
+            assert model[store.message_index(msg)].msg is msg
+        assert store.remove_separator()
+        assert store.separator_index() is None
+        assert list(store) == model[:-1]
+
+
+class TestCompileFormat(object):
+
+    @pytest.fixture(autouse=True)
+    def fake_colors(self, monkeypatch):
+        from poezio.windows import base_wins, inputs
+        # color pairs are stored in the A_COLOR bits
+        fake = lambda tup: (tup[0] + 1) << 8
+        monkeypatch.setattr(base_wins, 'to_curses_attr', fake)
+        monkeypatch.setattr(inputs, 'to_curses_attr', fake)
+
+    def test_compile(self):
+        import curses
+        from poezio.windows.base_wins import compile_format
+        assert compile_format('') == [('', 0)]
+        assert compile_format('coucou') == [('coucou', 0)]
+        assert compile_format('\x19bcou\x191}cou\x192}!\x19o') == [
+            ('cou', curses.A_BOLD),
+            ('cou', curses.A_BOLD | 2 << 8),
+            ('!', curses.A_BOLD | 3 << 8),
+            ('', 0),
+        ]
+        assert compile_format('\x19u\x193,-1,b}a\x19ob') == [
+            ('a', curses.A_UNDERLINE | curses.A_BOLD | 4 << 8),
+            ('b', 0),
+        ]
+
+    def test_compile_lite(self, input):
+        import curses
+        assert input._compile_format_lite('a\x0eb\x11c\nd') == [
+            ('a', 0),
+            ('b', curses.A_REVERSE),
+            ('b', curses.A_BOLD),
+            ('1', curses.A_REVERSE),
+            ('c', curses.A_BOLD | 2 << 8),
+            ('|', curses.A_REVERSE),
+            ('d', curses.A_BOLD | 2 << 8),
+        ]
+
+
+class TestDamageTracking(object):
+
+    @staticmethod
+    def make_win():
+        from poezio.windows.base_wins import Win
+        class CountingWin(Win):
+            __slots__ = ('drawn', )
+            def __init__(self):
+                Win.__init__(self)
+                self.drawn = []
+            def refresh(self, *args):
+                self.drawn.append(args)
+        return CountingWin()
+
+    def test_refresh_if_changed(self):
+        from poezio.windows import invalidate_all
+        win = self.make_win()
+        win.refresh_if_changed('topic')
+        win.refresh_if_changed('topic')
+        assert win.drawn == [('topic', )]
+        win.refresh_if_changed('other topic')
+        assert win.drawn == [('topic', ), ('other topic', )]
+        win.mark_dirty()
+        win.refresh_if_changed('other topic')
+        assert len(win.drawn) == 3
+        invalidate_all()
+        win.refresh_if_changed('other topic')
+        assert len(win.drawn) == 4
+        win.height = 3
+        win.refresh_if_changed('other topic')
+        assert len(win.drawn) == 5
+
+    def test_text_win(self, text_win):
+        from poezio.text_buffer import TextBuffer
+        from poezio.ui.types import Message
+        buf = TextBuffer(100)
+        buf.add_window(text_win)
+        buf.add_message(Message('coucou', 'toto'))
+        key = text_win.damage_key()
+        assert text_win.damage_key() == key
+        buf.add_message(Message('coucou 2', 'toto'))
+        assert text_win.damage_key() != key
+        key = text_win.damage_key()
+        # the same (cached) lines are built again, but they may be
+        # displayed differently
+        text_win.rebuild_everything(buf)
+        assert text_win.damage_key() != key
+        key = text_win.damage_key()
+        text_win.scroll_up(1)
+        assert text_win.damage_key() == key
+        for i in range(20):
+            buf.add_message(Message('message %s' % i, 'toto'))
+        key = text_win.damage_key()
+        assert text_win.scroll_up(1)
+        assert text_win.damage_key() != key
+
+
+class FakeCursesWin(object):
+    """A curses window keeping the text written on it"""
+
+    def __init__(self, height, width):
+        self.lines = [[' '] * width for _ in range(height)]
+        self.cursor = (0, 0)
+        self.written = []
+
+    def erase(self):
+        for line in self.lines:
+            line[:] = [' '] * len(line)
+
+    def move(self, y, x):
+        self.cursor = (y, x)
+
+    def clrtoeol(self):
+        y, x = self.cursor
+        self.lines[y][x:] = [' '] * (len(self.lines[y]) - x)
+
+    def addstr(self, y, x, text, attr=0):
+        self.written.append(y)
+        for i, char in enumerate(text):
+            if x + i < len(self.lines[y]):
+                self.lines[y][x + i] = char
+
+    def noutrefresh(self):
+        pass
+
+    def screen(self):
+        return [''.join(line) for line in self.lines]
+
+
+class TestUserList(object):
+
+    @pytest.fixture
+    def user_list(self, monkeypatch):
+        from poezio.windows import muc
+        monkeypatch.setattr(muc, 'config', ConfigShim())
+        monkeypatch.setattr(muc, 'to_curses_attr', lambda color: 0)
+        win = muc.UserList()
+        win.height, win.width = 5, 12
+        win._win = FakeCursesWin(5, 12)
+        return win
+
+    @staticmethod
+    def expected_screen(win, users):
+        other = type(win)()
+        other.height, other.width = win.height, win.width
+        other._win = FakeCursesWin(win.height, win.width)
+        other.pos = win.pos
+        other.refresh(users)
+        return other._win.screen()
+
+    def test_partial_redraw(self, user_list):
+        from slixmpp import JID
+        from poezio.user import Occupants, User
+        users = Occupants(
+            User('nick%d' % i, 'none', '', '', 'participant',
+                 JID('room@muc/nick%d' % i), False, 'red')
+            for i in range(8))
+        user_list.refresh_if_changed(users)
+        assert user_list._win.screen() == self.expected_screen(user_list, users)
+        assert user_list._win.screen()[4].endswith('++')
+
+        # a change on a single row only draws that row
+        user_list._win.written = []
+        users.get('nick2').chatstate = 'composing'
+        user_list.refresh_if_changed(users)
+        assert user_list._win.written == [2, 2, 2, 4]
+        assert user_list._win.screen() == self.expected_screen(user_list, users)
+
+        # off-screen changes draw nothing
+        user_list._win.written = []
+        users.get('nick7').show = 'away'
+        user_list.refresh_if_changed(users)
+        assert user_list._win.written == []
+
+        # fewer users: the indicator and the last rows go away
+        for i in range(4, 8):
+            users.remove(users.get('nick%d' % i))
+        user_list.refresh_if_changed(users)
+        screen = user_list._win.screen()
+        assert screen == self.expected_screen(user_list, users)
+        assert screen[4].strip() == ''